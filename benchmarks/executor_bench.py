@@ -0,0 +1,31 @@
+""" Compare per-call overhead of the subprocess executor against `sh`.
+
+    Usage: PYTHONPATH=. python benchmarks/executor_bench.py [calls]
+
+    Runs `ip -o link show` through both backends and reports wall time per
+    call. Since the `ip` process itself is identical, the difference is the
+    overhead of the wrapper.
+"""
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import sys
+import timeit
+
+import sh
+
+from ipyroute import executor
+
+
+def main(calls=200):
+    path = executor.which('ip')
+    backends = [('sh', sh.Command(path).bake('-o').link.show),
+                ('executor', executor.Command(path).bake('-o').link.show)]
+    for name, cmd in backends:
+        cmd()   # warm up
+        elapsed = min(timeit.repeat(cmd, number=calls, repeat=3))
+        print('{0:>10}: {1:8.1f} us/call'.format(name, elapsed / calls * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
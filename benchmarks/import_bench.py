@@ -0,0 +1,44 @@
+""" Measure startup time of ipyroute in a fresh interpreter.
+
+    Usage: PYTHONPATH=. python benchmarks/import_bench.py [runs]
+
+    Each statement is timed in a new process, and the bare interpreter
+    startup is reported alongside for reference. Run it once beforehand so
+    bytecode is cached; the target for `import ipyroute` is under 50 ms.
+"""
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import subprocess
+import sys
+import time
+
+TARGET = 0.050
+STATEMENTS = [('interpreter', 'pass'),
+              ('import ipyroute', 'import ipyroute'),
+              ('import Route4', 'from ipyroute import Route4'),
+              ('cli --help', 'import ipyroute.__main__ as m; m._parser().format_help()')]
+
+
+def startup(statement, runs):
+    """ Return best wall time of running statement in a new interpreter. """
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement])
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(runs=20):
+    results = [(name, startup(statement, runs)) for name, statement in STATEMENTS]
+    for name, elapsed in results:
+        print('{0:>16}: {1:8.1f} ms'.format(name, elapsed * 1e3))
+    elapsed = dict(results)['import ipyroute']
+    print('{0:>16}: {1}'.format('target', 'ok' if elapsed < TARGET else 'MISSED'))
+    return 0 if elapsed < TARGET else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(i) for i in sys.argv[1:]]))
@@ -1,10 +1,43 @@
 """ Interface with ipyroute utility. """
+import importlib
+import sys
+
 from . import base
-from .base import EUI, IPAddress, IPNetwork
 
-from .address import Address
-from .link import Link
-from .neighbor import Neighbor
-from .route import Route4, Route6, Nexthop
-from .rule import Rule4, Rule6
+# Public names and the modules defining them. Modules are imported on first
+# access, so `import ipyroute` stays cheap for short-lived tools.
+_EXPORTS = dict(EUI='base', IPAddress='base', IPNetwork='base',
+                Address='address', AddressIndex='address',
+                Aggregator='aggregate',
+                Link='link', LinkSampler='link',
+                Neighbor='neighbor',
+                NexthopObject='nexthop', NexthopGroup='nexthop',
+                Route4='route', Route6='route', Nexthop='route',
+                Rule4='rule', Rule6='rule')
+
+# Submodules, which the eager imports this replaced made attributes as well.
+_SUBMODULES = ('address', 'aggregate', 'executor', 'fake', 'link', 'neighbor', 'nexthop',
+               'parallel', 'route', 'rule', 'shm', 'watch')
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        # importing a submodule sets it as an attribute of the package.
+        return importlib.import_module('.' + name, __name__)
+    if name not in _EXPORTS:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+    module = importlib.import_module('.' + _EXPORTS[name], __name__)
+    value = globals()[name] = getattr(module, name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | set(_SUBMODULES))
+
 
+if sys.version_info < (3, 7):
+    # Module __getattr__ needs PEP 562, so older interpreters import eagerly.
+    for _name in __all__:
+        __getattr__(_name)
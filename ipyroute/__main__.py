@@ -0,0 +1,156 @@
+""" Command line interface, printing results as JSON.
+
+    python -m ipyroute [-4|-6] OBJECT {show,add,del} [ARGS...]
+
+    Arguments after the verb follow iproute2 syntax, e.g.
+
+    python -m ipyroute route add 10.0.0.0/24 via 192.0.2.1 dev eth0
+    python -m ipyroute -6 route show table main
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import sys
+
+import ipyroute
+from ipyroute import base
+
+# Object name to classes used for IPv4 and IPv6.
+CLASSES = collections.OrderedDict([
+    ('link', ('Link', 'Link')),
+    ('addr', ('Address', 'Address')),
+    ('route', ('Route4', 'Route6')),
+    ('rule', ('Rule4', 'Rule6')),
+    ('neigh', ('Neighbor', 'Neighbor')),
+    ('nexthop', ('NexthopObject', 'NexthopObject')),
+])
+VERBS = ('show', 'add', 'del')
+
+
+def jsonable(value):
+    """ Convert parsed value into types json can encode. Addresses and
+        other netaddr values become strings.
+    """
+    if isinstance(value, base.Base):
+        return dict((k, jsonable(v)) for k, v in value.__dict__.items())
+    if isinstance(value, (list, tuple, base.ResultSet)):
+        return [jsonable(i) for i in value]
+    if value is None or isinstance(value, (bool, int, float) + base.string_types):
+        return value
+    return str(value)
+
+
+def _pairs(args, flags=()):
+    """ Return ordered dict of `key value` arguments. Flags take no value. """
+    kwargs = collections.OrderedDict()
+    args = list(args)
+    while args:
+        key = args.pop(0)
+        if key in flags:
+            kwargs[key] = True
+        elif not args:
+            raise ValueError("Missing value for {0!r}".format(key))
+        else:
+            kwargs[key] = args.pop(0)
+    return kwargs
+
+
+def _link(cls, verb, args):
+    if verb == 'add':
+        # add_many returns the links it created.
+        return cls.add_many([_pairs(args, ('up',))])
+    if not args:
+        raise ValueError("Missing link name")
+    cls(name=args[0]).delete(*args[1:])
+
+
+def _route(cls, verb, args):
+    if not args:
+        raise ValueError("Missing prefix")
+    fields = cls.fields(' '.join(args))
+    network = fields.pop('network')
+    if 'nexthops' in fields:
+        fields['nexthops'] = [ipyroute.Nexthop(**i) for i in fields['nexthops']]
+    (cls.add if verb == 'add' else cls.delete)(network, **fields)
+
+
+def _rule(cls, verb, args):
+    names = {'from': 'fromprefix', 'to': 'toprefix', 'not': '_not'}
+    rule = cls(**dict((names.get(k, k), v) for k, v in _pairs(args, ('not',)).items()))
+    if verb == 'add':
+        rule.add()
+    else:
+        rule.delete()
+
+
+def _nexthop(cls, verb, args):
+    kwargs = _pairs(args, ('blackhole', 'onlink', 'fdb'))
+    if 'id' not in kwargs:
+        raise ValueError("Missing nexthop id")
+    nhid = kwargs.pop('id')
+    if 'group' in kwargs:
+        cls = ipyroute.NexthopGroup
+    if verb == 'add':
+        cls.add(nhid, **kwargs)
+    else:
+        cls.delete(nhid)
+
+
+def _generic(cls, verb, args):
+    (cls.add if verb == 'add' else cls.delete)(*args)
+
+
+# Handlers for add and del, returning objects to print or None.
+MODIFY = dict(link=_link, route=_route, rule=_rule, nexthop=_nexthop)
+
+
+def run(obj, verb, args, family=4):
+    """ Run verb on object type and return JSON-ready result. """
+    cls = getattr(ipyroute, CLASSES[obj][family == 6])
+    if verb == 'show':
+        return jsonable(cls.get(*args))
+    result = MODIFY.get(obj, _generic)(cls, verb, list(args))
+    return dict(ok=True) if result is None else jsonable(result)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog='python -m ipyroute',
+                                     description="Query and modify iproute2 state as JSON.")
+    family = parser.add_mutually_exclusive_group()
+    family.add_argument('-4', dest='family', action='store_const', const=4, default=4,
+                        help="IPv4 routes and rules (default)")
+    family.add_argument('-6', dest='family', action='store_const', const=6,
+                        help="IPv6 routes and rules")
+    parser.add_argument('--indent', type=int, default=None, help="indent JSON output")
+    objects = parser.add_subparsers(dest='object', metavar='OBJECT')
+    objects.required = True
+    for name in CLASSES:
+        sub = objects.add_parser(name, help="{0} objects".format(name))
+        sub.add_argument('verb', choices=VERBS)
+        sub.add_argument('args', nargs=argparse.REMAINDER,
+                         help="iproute2 arguments")
+    return parser
+
+
+def main(argv=None):
+    """ Entry point. Returns exit status: that of `ip` if it failed. """
+    parser = _parser()
+    opts = parser.parse_args(argv)
+    try:
+        result = run(opts.object, opts.verb, opts.args, opts.family)
+    except (ValueError, base.AddrFormatError) as exc:
+        parser.error(str(exc))
+    except base.ErrorReturnCode as exc:
+        stderr = getattr(exc, 'stderr', None) or b''
+        error = dict(error=stderr.decode('utf-8', 'replace').strip() or str(exc),
+                     exit_code=exc.exit_code)
+        print(json.dumps(error, sort_keys=True), file=sys.stderr)
+        return exc.exit_code
+    print(json.dumps(result, indent=opts.indent, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,9 @@
-import re
+import collections
+import weakref
 from ipyroute import base
-import six
 
 class Address(base.Base):
-    regex = re.compile(r'(?P<ifnum>\d+): '
+    regex = base.LazyRegex(r'(?P<ifnum>\d+): '
                        r'(?P<ifname>\S+?)(@(?P<phy>\S+))?\s+'
                        r'(inet|inet6) '
                        r'(?P<addr>\S+) '
@@ -16,19 +16,23 @@ class Address(base.Base):
 
 
     casts = dict(ifnum=int,
-                 ifname=unicode if not six.PY3 else lambda x: x,
-                 label=unicode if not six.PY3 else lambda x: x,
-                 addr=base.IPNetwork, brd=base.IPAddress, peer=base.IPNetwork)
+                 ifname=base.intern_text,
+                 label=unicode if not base.PY3 else lambda x: x,
+                 addr=base.to_network, brd=base.to_addr, peer=base.to_network)
 
     _scopes = set(['host', 'link', 'global'])
+    _indexes = weakref.WeakSet()
     _order = ('peer', 'dev', 'scope', 'to', 'label')
+    # Address options that take no value in iproute2 syntax.
+    _flags = frozenset(['home', 'mngtmpaddr', 'nodad', 'optimistic',
+                        'noprefixroute', 'autojoin'])
 
     @classmethod
     def _get(cls, *args):
-        for line in base.IPR.ipv4.addr.show(*args):
+        for line in base.stream(base.IPR.ipv4.addr.show, *args):
+            yield line
+        for line in base.stream(base.IPR.ipv6.addr.show, *args):
             yield line
-        for line in base.IPR.ipv6.addr.show(*args):
-           yield line
 
     def __getattr__(self, name):
         """ Map scope types to properties. """
@@ -40,33 +44,173 @@ class Address(base.Base):
             pass
         super(Address, self).__getattr__(name)
 
+    @base.classproperty
+    def _monitor(cls):
+        # pylint: disable=no-member
+        return base.IPR.root.monitor.address
+
+    def _key(self):
+        return (self.ifnum, self.addr)
+
     @base.classproperty
     def cmd(cls):
         # We load root in IPR class at runtime.
         # pylint: disable=no-member
         return base.IPR.root.addr
 
+    @classmethod
+    def _tracked(cls, op, func):
+        """ Wrap command so live AddressIndex objects follow successful changes. """
+        def wrapped(*args, **kwargs):
+            result = func(*args, **kwargs)
+            for index in list(cls._indexes):
+                # The command already succeeded, so an update we cannot apply
+                # only marks the index for a rebuild on next lookup.
+                # pylint: disable=protected-access,broad-except
+                try:
+                    index._update(op, *args, **kwargs)
+                except Exception:
+                    index._stale = True
+            return result
+        return wrapped
+
     @base.classproperty
     def add(cls):
         """ Add command for address. """
         cls.cache.clear()
-        return cls.shwrap(cls.cmd.add, cls._order)
+        return cls._tracked('add', cls.shwrap(cls.cmd.add, cls._order))
 
     @base.classproperty
     def change(cls):
         """ Change command for address. """
         cls.cache.clear()
-        return cls.shwrap(cls.cmd.change, cls._order)
+        return cls._tracked('change', cls.shwrap(cls.cmd.change, cls._order))
 
     @base.classproperty
     def replace(cls):
         """ Replace command for address. """
         cls.cache.clear()
-        return cls.shwrap(cls.cmd.replace, cls._order)
+        return cls._tracked('replace', cls.shwrap(cls.cmd.replace, cls._order))
 
     @base.classproperty
     def delete(cls):
         """ Delete command for address. """
         cls.cache.clear()
-        return cls.shwrap(getattr(cls.cmd, 'del'), cls._order)
+        return cls._tracked('delete', cls.shwrap(getattr(cls.cmd, 'del'), cls._order))
+
+
+
+class AddressIndex(object):
+    """ Find addresses by IP, containing prefix, peer, interface or label.
+
+        The index is built from a single Address.get() and afterwards follows
+        Address.add/change/replace/delete calls made through the library.
+        Prefix lookups are keyed on integer network values per prefix length,
+        so a lookup costs one dict probe per distinct prefix length.
+    """
+    def __init__(self, addresses=None):
+        self._build(Address.get() if addresses is None else addresses)
+        Address._indexes.add(self) # pylint: disable=protected-access
+
+    def _build(self, addresses):
+        self._stale = False
+        self._exact = collections.defaultdict(list)
+        self._prefixes = collections.defaultdict(lambda: collections.defaultdict(list))
+        self._peers = collections.defaultdict(list)
+        self._ifnums = collections.defaultdict(list)
+        self._labels = collections.defaultdict(list)
+        self._ifnames = {}
+        for addr in addresses:
+            self._insert(addr)
+
+    def _refresh(self):
+        """ Rebuild from Address.get() if a change could not be applied. """
+        if self._stale:
+            self._build(Address.get())
+
+    @staticmethod
+    def _hostbits(ipaddr):
+        return 32 if ipaddr.version == 4 else 128
+
+    def _buckets(self, addr):
+        net = addr.addr
+        shift = self._hostbits(net) - net.prefixlen
+        yield self._exact[(net.version, int(net.ip))]
+        yield self._prefixes[(net.version, net.prefixlen)][int(net.ip) >> shift]
+        if addr.peer is not None:
+            yield self._peers[(addr.peer.version, int(addr.peer.ip))]
+        yield self._ifnums[addr.ifnum]
+        yield self._labels[addr.label]
+
+    def _insert(self, addr):
+        if addr.ifnum is not None:
+            self._ifnames[addr.ifname] = addr.ifnum
+        for bucket in self._buckets(addr):
+            bucket.append(addr)
+
+    def _remove(self, addr):
+        """ Remove entries for the same interface, local IP and peer. """
+        ipaddr = addr.addr.ip
+        for entry in list(self._exact.get((ipaddr.version, int(ipaddr)), ())):
+            if entry.ifname == addr.ifname and entry.peer == addr.peer:
+                for bucket in self._buckets(entry):
+                    bucket.remove(entry)
+
+    def _update(self, op, *args, **kwargs):
+        """ Apply change made through Address commands. Positional arguments
+            follow iproute2 syntax: `[local] IFADDR` then key/value pairs.
+        """
+        args = list(args)
+        if args and args[0] != 'local':
+            args.insert(0, 'local')
+        while args:
+            key = args.pop(0)
+            if key not in Address._flags: # pylint: disable=protected-access
+                kwargs.setdefault(key, args.pop(0))
+        local = kwargs['local']
+        ifname = kwargs.get('dev')
+        label = kwargs.get('label')
+        if label is not None and ifname and label.startswith(ifname + ':'):
+            label = label[len(ifname) + 1:]
+        addr = Address(addr=local, ifname=ifname, ifnum=self._ifnames.get(ifname),
+                       peer=kwargs.get('peer'), brd=kwargs.get('brd'),
+                       scope=kwargs.get('scope', 'global'), label=label)
+        if addr.peer is not None:
+            addr.addr = base.IPNetwork(addr.addr.ip)
+        self._remove(addr)
+        if op != 'delete':
+            self._insert(addr)
+
+    def lookup(self, ipaddr):
+        """ Return addresses assigned with this exact IP. """
+        self._refresh()
+        ipaddr = base.IPAddress(ipaddr)
+        return list(self._exact.get((ipaddr.version, int(ipaddr)), ()))
+
+    def containing(self, prefix):
+        """ Return addresses whose subnet contains IP or prefix, most specific first. """
+        self._refresh()
+        prefix = base.IPNetwork(prefix)
+        value, bits = int(prefix.ip), self._hostbits(prefix)
+        result = []
+        for (version, prefixlen), networks in sorted(self._prefixes.items(), reverse=True):
+            if version != prefix.version or prefixlen > prefix.prefixlen:
+                continue
+            result.extend(networks.get(value >> (bits - prefixlen), ()))
+        return result
+
+    def peer(self, ipaddr):
+        """ Return addresses configured with this peer. """
+        self._refresh()
+        ipaddr = base.IPNetwork(ipaddr).ip
+        return list(self._peers.get((ipaddr.version, int(ipaddr)), ()))
+
+    def by_ifnum(self, ifnum):
+        """ Return addresses on interface index. """
+        self._refresh()
+        return list(self._ifnums.get(ifnum, ()))
 
+    def by_label(self, label):
+        """ Return addresses with label (the part following "ifname:"). """
+        self._refresh()
+        return list(self._labels.get(label, ()))
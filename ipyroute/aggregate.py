@@ -0,0 +1,133 @@
+""" Aggregate routes into covering prefixes before installing them. """
+# -*- coding: utf-8 -*-
+import collections
+
+import netaddr
+
+from ipyroute import base
+
+
+def _hashable(value):
+    """ Return value in a form suitable for grouping equal attributes. """
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(i) for i in value)
+    if isinstance(value, base.Base):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.__dict__.items()))
+    return str(value)
+
+
+def _valid(aggregate, inside, others):
+    """ An aggregate may replace the routes inside it unless a route from
+        another group lies within the aggregate and covers one of them: that
+        route used to lose to the more specific original, but would win over
+        the aggregate.
+    """
+    for other in others:
+        if other in aggregate and any(net in other for net in inside):
+            return False
+    return True
+
+
+def _cover(nets, others):
+    """ Yield (installed, originals) pairs covering sorted, unique nets. """
+    idx = 0
+    for aggregate in netaddr.cidr_merge(nets):
+        # aggregates are disjoint and sorted, so each holds a run of nets.
+        inside = []
+        while idx < len(nets) and nets[idx] in aggregate:
+            inside.append(nets[idx])
+            idx += 1
+        if _valid(aggregate, inside, others):
+            yield aggregate, inside
+            continue
+        if aggregate in inside:
+            # staged itself, so it stays while its more specifics are split.
+            yield aggregate, [aggregate]
+        for half in aggregate.subnet(aggregate.prefixlen + 1):
+            part = [i for i in inside if i in half]
+            if part:
+                for pair in _cover(part, others):
+                    yield pair
+
+
+class Aggregator(object):
+    """ Install routes through a route class, merging routes with identical
+        forwarding attributes into the smallest set of covering prefixes.
+
+        Routes are staged with add and delete, and changes reach the kernel
+        on commit, in a single batch. Aggregation never changes how an address
+        is forwarded: a more specific route with different attributes stays
+        installed, and aggregates which would override one are split. The
+        installed prefix for every staged route is kept in mapping, so
+        deleting a route withdraws or shrinks the aggregate covering it.
+    """
+    def __init__(self, cls):
+        self.cls = cls
+        self.routes = collections.OrderedDict()     # (network, table, metric) -> kwargs
+        self.installed = {}                         # (network, table, metric) -> kwargs
+        self.mapping = {}                           # staged key -> installed network
+
+    @staticmethod
+    def _key(network, kwargs):
+        return (netaddr.IPNetwork(network).cidr, kwargs.get('table'), kwargs.get('metric'))
+
+    def add(self, network, **kwargs):
+        """ Stage route, replacing any staged with the same prefix, table and
+            metric. Accepts the same arguments as Route.add.
+        """
+        kwargs = dict((k, v) for k, v in kwargs.items() if v is not None)
+        self.routes[self._key(network, kwargs)] = kwargs
+
+    def delete(self, network, table=None, metric=None):
+        """ Unstage route. Raises KeyError if it was never added. """
+        del self.routes[self._key(network, dict(table=table, metric=metric))]
+
+    def lookup(self, network, table=None, metric=None):
+        """ Return installed prefix for a staged route as of the last commit. """
+        return self.mapping[self._key(network, dict(table=table, metric=metric))]
+
+    def plan(self):
+        """ Return (installed, mapping) for staged routes: dicts of installed
+            key to kwargs, and of staged key to installed prefix.
+        """
+        groups = collections.OrderedDict()
+        for key, kwargs in self.routes.items():
+            attrs = tuple(sorted((k, _hashable(v)) for k, v in kwargs.items()))
+            groups.setdefault(attrs, []).append(key)
+
+        # routes which may be shadowed by an aggregate, per table.
+        tables = collections.defaultdict(list)
+        for attrs, keys in groups.items():
+            for network, table, _ in keys:
+                tables[table].append((network, attrs))
+
+        installed, mapping = {}, {}
+        for attrs, keys in groups.items():
+            _, table, metric = keys[0]
+            kwargs = self.routes[keys[0]]
+            others = [net for net, other in tables[table] if other != attrs]
+            nets = sorted(set(net for net, _, _ in keys))
+            covering = {}
+            for aggregate, inside in _cover(nets, others):
+                installed[(aggregate, table, metric)] = kwargs
+                covering.update((net, aggregate) for net in inside)
+            mapping.update((key, covering[key[0]]) for key in keys)
+        return installed, mapping
+
+    def commit(self, force=False):
+        """ Bring kernel in line with staged routes. New aggregates are
+            installed before the ones they supersede are removed, so no
+            destination is left unrouted. Returns the batched operations.
+        """
+        installed, mapping = self.plan()
+        ops = []
+        for key, kwargs in installed.items():
+            if self.installed.get(key) != kwargs:
+                ops.append(('replace', key[0], kwargs))
+        for key, kwargs in self.installed.items():
+            if key not in installed:
+                ops.append(('delete', key[0], dict(table=key[1], metric=key[2])))
+        if ops:
+            self.cls.batch(ops, force)
+        self.installed, self.mapping = installed, mapping
+        return ops
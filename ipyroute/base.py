@@ -2,17 +2,153 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import collections
 import functools
-import netaddr
 import re
 import sys
+import threading
 import time
 
-from sh import ErrorReturnCode
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import executor
+
+PY3 = sys.version_info[0] == 3
+if PY3:
+    text_type, string_types = str, (str,)
+else:
+    # pylint: disable=undefined-variable
+    text_type, string_types = unicode, (basestring,)
+
+
+# sh and netaddr take longer to import than the rest of ipyroute put together,
+# so they are only loaded once something needs them. ErrorReturnCode,
+# AddrFormatError, EUI, IPAddress, IPNetwork, FrozenIPAddress and FrozenEUI are
+# resolved through the module __getattr__ below.
+def _sh():
+    import sh
+    return sh
+
+
+def _netaddr():
+    import netaddr
+    return netaddr
+
+
+def to_addr(value):
+    """ Cast value to netaddr.IPAddress. """
+    return _netaddr().IPAddress(value)
+
+
+def to_network(value):
+    """ Cast value to netaddr.IPNetwork. """
+    return _netaddr().IPNetwork(value)
+
+
+def to_eui(value):
+    """ Cast value to netaddr.EUI, printed in the format used by iproute2. """
+    netaddr = _netaddr()
+    return netaddr.EUI(value, dialect=netaddr.mac_unix_expanded)
+
+
+def _readonly(prop, slot):
+    """ Return copy of prop which can only be set while slot is unset. """
+    def fset(self, value):
+        if getattr(self, slot, None) is not None:
+            raise AttributeError("{0} is shared, and cannot be changed".format(
+                type(self).__name__))
+        prop.fset(self, value)
+    return property(prop.fget, fset, doc=prop.__doc__)
+
+
+def _frozen(name):
+    """ Build netaddr subclasses whose value cannot change in place, so a
+        single instance can be shared between parsed objects.
+    """
+    netaddr = _netaddr()
+    if name == 'FrozenIPAddress':
+        class FrozenIPAddress(netaddr.IPAddress):
+            """ IPAddress which cannot be changed in place. """
+            __slots__ = ()
+            value = _readonly(netaddr.IPAddress.value, '_value')
+
+            def __iadd__(self, num):
+                return self + num
+
+            def __isub__(self, num):
+                return self - num
+
+            def __repr__(self):
+                return "IPAddress('{0}')".format(self)
+        return FrozenIPAddress
+
+    class FrozenEUI(netaddr.EUI):
+        """ EUI which cannot be changed in place. """
+        __slots__ = ()
+        value = _readonly(netaddr.EUI.value, '_value')
+        dialect = _readonly(netaddr.EUI.dialect, '_dialect')
+    return FrozenEUI
+
+
+def _frozen_addr(value):
+    """ Cast value to FrozenIPAddress. """
+    cls = globals().get('FrozenIPAddress') or __getattr__('FrozenIPAddress')
+    return cls(value)
+
+
+def _frozen_eui(value):
+    """ Cast value to FrozenEUI, printed in the format used by iproute2. """
+    cls = globals().get('FrozenEUI') or __getattr__('FrozenEUI')
+    return cls(value, dialect=_netaddr().mac_unix_expanded)
+
+
+def _lazy(name):
+    if name in ('FrozenIPAddress', 'FrozenEUI'):
+        cls = _frozen(name)
+        # pickle finds the class as a module attribute.
+        cls.__qualname__ = name
+        return cls
+    if name == 'ErrorReturnCode':
+        return _sh().ErrorReturnCode
+    if name == 'EUI':
+        netaddr = _netaddr()
+        return functools.partial(netaddr.EUI, dialect=netaddr.mac_unix_expanded)
+    if name in ('AddrFormatError', 'IPAddress', 'IPNetwork'):
+        return getattr(_netaddr(), name)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+def __getattr__(name):
+    value = globals()[name] = _lazy(name)
+    return value
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ needs PEP 562, so older interpreters import eagerly.
+    for _name in ('ErrorReturnCode', 'AddrFormatError', 'EUI', 'IPAddress', 'IPNetwork',
+                  'FrozenIPAddress', 'FrozenEUI'):
+        __getattr__(_name)
+
+
+class LazyRegex(object):
+    """ Regular expression compiled on first use. Class definitions hold
+        dozens of patterns, most of which a given program never matches.
+    """
+    __slots__ = ('pattern', 'flags', '_compiled')
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self._compiled = None
+
+    def __getattr__(self, name):
+        if self._compiled is None:
+            self._compiled = re.compile(self.pattern, self.flags)
+        return getattr(self._compiled, name)
 
-EUI = functools.partial(netaddr.EUI, dialect=netaddr.mac_unix_expanded)
-IPAddress = netaddr.IPAddress
-IPNetwork = netaddr.IPNetwork
 
 class IPRouteMeta(type):
     """ This is a relatively dense way of only requiring iproute2 at runtime.
@@ -23,49 +159,460 @@ class IPRouteMeta(type):
         them on first miss with the appropriate bindings.
     """
     def __getattr__(cls, name):
-        if name not in ('link', 'ipv4', 'ipv6'):
+        if name not in ('root', 'link', 'ipv4', 'ipv6'):
             msg = "{0!r} object has no attribute {1!r}".format(type(cls).__name__, name)
             raise AttributeError(msg)
 
         if cls._ipr is None:
-            try:
-                # pylint: disable=no-name-in-module
-                from sh import ip
-            except ImportError:
+            ip = executor.which('ip')
+            if ip is None:
                 sys.exit("ERROR: iproute2 not found.")
-
-            # pylint: disable=attribute-defined-outside-init
-            cls._ipr = ip.bake('-o')
-            cls.root = cls._ipr
-            cls.link = cls.root.bake('-0')
-            cls.ipv4 = cls.root.bake('-4')
-            cls.ipv6 = cls.root.bake('-6')
+            cls.bind(executor.Command(ip))
         return getattr(cls, name)
 
 
-class IPR(object):
+class IPR(IPRouteMeta('IPRBase', (object,), {})):
     """ This is a dummy proxy class for interfacing with iproute2. """
     # pylint: disable=too-few-public-methods
-    __metaclass__ = IPRouteMeta
     _ipr = None
 
+    @classmethod
+    def bind(cls, ip):
+        """ Bind proxy to an `ip` command. By default this is an
+            `executor.Command`, but anything that bakes like `sh.ip` will do,
+            e.g. `sh.ip` itself or the in-memory backend in `ipyroute.fake`.
+        """
+        # pylint: disable=attribute-defined-outside-init
+        cls._ipr = ip.bake('-o')
+        cls.root = cls._ipr
+        cls.link = cls.root.bake('-0')
+        cls.ipv4 = cls.root.bake('-4')
+        cls.ipv6 = cls.root.bake('-6')
+
 
 class Cache(dict):
-    """ Cache dictionary with timeout for storing results of iproute show. """
-    def __init__(self, timeout=0):
+    """ Cache dictionary with timeout for storing results of iproute show.
+        Safe to share between threads. The generation counter increments on
+        every clear, so results computed before a change are not stored.
+
+        With max_stale, expired entries keep being served for up to that many
+        seconds past expiry while a background refresh runs, with at most
+        refresh_workers refreshes in flight. A failed refresh leaves the last
+        good value in place and is recorded in errors.
+    """
+    def __init__(self, timeout=0, max_stale=0, refresh_workers=1):
+        super(Cache, self).__init__()
         self._timeout = timeout
+        self._max_stale = max_stale
         self._time = {}
+        self._lock = threading.RLock()
+        self._workers = threading.BoundedSemaphore(refresh_workers)
+        self._refreshing = set()
+        self.generation = 0
+        self.errors = {}
+        self.cleared = 0
 
     def __setitem__(self, key, val):
-        super(Cache, self).__setitem__(key, val)
-        self._time[key] = time.time()
+        with self._lock:
+            super(Cache, self).__setitem__(key, val)
+            self._time[key] = time.time()
 
     def __contains__(self, key):
-        return key in self._time and time.time() < self._time[key] + self._timeout
+        with self._lock:
+            return key in self._time and time.time() < self._time[key] + self._timeout
+
+    def lookup(self, key, default=None):
+        """ Return value for key if present and not expired. """
+        with self._lock:
+            if key in self:
+                return self[key]
+            return default
+
+    def lookup_stale(self, key, default=None):
+        """ Return value for key if expired for less than max_stale seconds. """
+        with self._lock:
+            if key in self._time and \
+                    time.time() < self._time[key] + self._timeout + self._max_stale:
+                return self[key]
+            return default
+
+    def store(self, key, val, generation):
+        """ Set value for key unless cache was cleared since generation. """
+        with self._lock:
+            if self._timeout > 0 and generation == self.generation:
+                self[key] = val
+
+    def refresh(self, key, func):
+        """ Call func in a background thread to refresh key, unless a refresh
+            for key is already running or all refresh workers are busy.
+        """
+        with self._lock:
+            if key in self._refreshing or not self._workers.acquire(False):
+                return False
+            self._refreshing.add(key)
+
+        def _run():
+            try:
+                func()
+                self.errors.pop(key, None)
+            except Exception as exc: # pylint: disable=broad-except
+                self.errors[key] = exc
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+                self._workers.release()
+
+        thread = threading.Thread(target=_run)
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def lookup_last(self, key, default=None):
+        """ Return most recent value for key regardless of age. Values are
+            only dropped when the cache is cleared.
+        """
+        with self._lock:
+            return super(Cache, self).get(key, default)
 
     def clear(self):
-        super(Cache, self).clear()
-        self._time.clear()
+        with self._lock:
+            super(Cache, self).clear()
+            self._time.clear()
+            self.generation += 1
+            self.cleared = time.time()
+
+
+class Flight(object):
+    """ A command run on behalf of every caller asking for it concurrently. """
+    # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+# Single-flight bookkeeping for Base.get: in-progress dumps keyed on class,
+# arguments and cache generation, plus counters of dumps run and of callers
+# which waited on another caller's dump instead of running their own.
+_flights = {}
+_flights_lock = threading.Lock()
+metrics = collections.Counter()
+
+# Dumps run under a deadline record the attempt they belong to here, so
+# streams they open can be killed from the thread enforcing the deadline.
+_local = threading.local()
+
+
+class Attempt(threading.Thread):
+    """ Run func in a daemon thread, tracking streams it opens so they can be
+        killed. The attempt is put on done once func returns or raises.
+    """
+    def __init__(self, func, done):
+        super(Attempt, self).__init__()
+        self.daemon = True
+        self.func = func
+        self.done = done
+        self.streams = []
+        self.killed = False
+        self.result = None
+        self.error = None
+        self.elapsed = None
+        self.start()
+
+    def run(self):
+        _local.attempt = self
+        start = time.time()
+        try:
+            self.result = self.func()
+        except Exception as exc: # pylint: disable=broad-except
+            self.error = exc
+        finally:
+            self.elapsed = time.time() - start
+            self.done.put(self)
+
+    def kill(self):
+        """ Kill every child started by this attempt. """
+        self.killed = True
+        for stream in list(self.streams):
+            stream.kill()
+
+
+def deadline(func, timeout=None, hedge=None, name=''):
+    """ Call func, killing its children and raising sh.TimeoutException if it
+        takes longer than timeout seconds. If hedge is set and func has not
+        returned after that many seconds, a second call is started and the
+        first to succeed wins. Returns the winning Attempt.
+    """
+    done = queue.Queue()
+    attempts = [Attempt(func, done)]
+    start = time.time()
+    pending = 1
+    while True:
+        waits = []
+        if timeout is not None:
+            waits.append(start + timeout)
+        if hedge is not None and len(attempts) == 1:
+            waits.append(start + hedge)
+        try:
+            attempt = done.get(timeout=max(min(waits) - time.time(), 0) if waits else None)
+        except queue.Empty:
+            now = time.time()
+            if hedge is not None and len(attempts) == 1 and now >= start + hedge:
+                attempts.append(Attempt(func, done))
+                pending += 1
+                metrics['hedged'] += 1
+            if timeout is not None and now >= start + timeout:
+                for attempt in attempts:
+                    attempt.kill()
+                metrics['timeouts'] += 1
+                raise _sh().TimeoutException(-9, name)
+            continue
+
+        pending -= 1
+        if attempt.error is None or not pending:
+            for other in attempts:
+                if other is not attempt:
+                    other.kill()
+            if attempt.error is not None:
+                raise attempt.error
+            return attempt
+
+
+class Interner(object):
+    """ Bounded table mapping raw values to a single shared cast result.
+
+        Gateways, device names and protocols repeat across every line of a
+        large dump; interning them means identical values are parsed once and
+        share one object. Shared values must therefore be treated as
+        immutable. Once maxsize entries are held the table starts over.
+    """
+    def __init__(self, cast, maxsize=1 << 16):
+        self.cast = cast
+        self.maxsize = maxsize
+        self._table = {}
+
+    def __call__(self, value):
+        try:
+            return self._table[value]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable, nothing to share.
+            return self.cast(value)
+        result = self.cast(value)
+        if len(self._table) >= self.maxsize:
+            self._table.clear()
+        self._table[value] = result
+        return result
+
+    def __len__(self):
+        return len(self._table)
+
+    def clear(self):
+        """ Drop all interned values. """
+        self._table.clear()
+
+
+class LineMemo(object):
+    """ Objects parsed from each line of the latest dump, keyed on the raw
+        line and kept separately for each class and set of dump arguments,
+        so one memo may be shared by all classes through Base.set_memo.
+
+        Every completed dump replaces the previous generation for its class
+        and arguments, so lines which disappear are evicted, and unchanged lines
+        map to the same frozen object as last time without being parsed.
+        At most maxsize lines are remembered per generation, and at most
+        maxkeys generations are kept, least recently used dropped first.
+    """
+    def __init__(self, maxsize=1 << 20, maxkeys=64):
+        self.maxsize = maxsize
+        self.maxkeys = maxkeys
+        self._generations = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, key):
+        """ Return mapping of line to object from the last dump for key,
+            a (class, args) pair.
+        """
+        with self._lock:
+            return self._generations.get(key, {})
+
+    def store(self, key, lines):
+        """ Make lines the current generation for key. """
+        with self._lock:
+            self._generations.pop(key, None)
+            self._generations[key] = lines
+            while len(self._generations) > self.maxkeys:
+                self._generations.popitem(last=False)
+
+    def __len__(self):
+        return sum(len(i) for i in self._generations.values())
+
+    def clear(self):
+        """ Drop all generations. """
+        with self._lock:
+            self._generations.clear()
+
+
+# Global tables shared by all classes. Shared addresses are frozen, so
+# changing one in place cannot reach other objects or the table itself.
+intern_addr = Interner(_frozen_addr)
+intern_eui = Interner(_frozen_eui)
+intern_text = Interner(text_type)
+
+
+# Output of iproute2 is read from the pipe in chunks of this many bytes, with at
+# most STREAM_QUEUE chunks waiting to be consumed before the child is stalled.
+STREAM_CHUNK = 64 * 1024
+STREAM_QUEUE = 16
+
+
+class Stream(object):
+    """ Run cmd and yield lines of output as they are read from the pipe.
+
+        Memory is bounded by STREAM_CHUNK * STREAM_QUEUE: a slow consumer
+        blocks the reader, which in turn blocks the child on a full pipe.
+        Abandoning iteration early kills the child, as does calling kill()
+        from another thread. Executor commands are read straight from the
+        pipe; commands which are neither executor nor `sh` commands (mocks,
+        fake backends) are simply iterated.
+    """
+    def __init__(self, cmd, *args):
+        self.cmd = cmd
+        self.args = args
+        self._proc = None
+        self._output = None
+        self._chunks = None
+        self._started = False
+        self._killed = False
+        attempt = getattr(_local, 'attempt', None)
+        if attempt is not None:
+            attempt.streams.append(self)
+            self._killed = attempt.killed
+
+    def kill(self):
+        """ Stop the child. Iteration ends quietly once pending output is read. """
+        self._killed = True
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+            except OSError:
+                pass
+
+    def start(self):
+        """ Start the child now rather than on first iteration, so no output
+            is missed between here and the first read. Returns self.
+        """
+        if self._started:
+            return self
+        self._started = True
+        # A command can only be an sh.Command if sh has been imported.
+        sh = sys.modules.get('sh')
+        if isinstance(self.cmd, executor.Command):
+            self._proc = self.cmd.popen(*self.args)
+        elif sh is not None and isinstance(self.cmd, sh.Command):
+            chunks = self._chunks = queue.Queue(STREAM_QUEUE)
+
+            def _out(chunk):
+                if self._killed:
+                    return True
+                chunks.put(chunk)
+
+            self._proc = self.cmd(*self.args, _bg=True, _bg_exc=False, _no_out=True,
+                                  _out=_out, _out_bufsize=STREAM_CHUNK)
+        else:
+            self._output = self.cmd(*self.args)
+        if self._killed:
+            self.kill()
+        return self
+
+    def __iter__(self):
+        self.start()
+        if isinstance(self.cmd, executor.Command):
+            for line in self._iter_popen():
+                yield line
+            return
+        if self._chunks is None:
+            for line in self._output:
+                yield line
+            return
+
+        chunks = self._chunks
+
+        def _wait():
+            try:
+                self._proc.wait()
+                chunks.put(None)
+            except Exception as exc: # pylint: disable=broad-except
+                chunks.put(None if self._killed else exc)
+
+        waiter = threading.Thread(target=_wait)
+        waiter.daemon = True
+        waiter.start()
+
+        tail = ''
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                lines = (tail + chunk).split('\n')
+                tail = lines.pop()
+                for line in lines:
+                    yield line
+            if tail:
+                yield tail
+        finally:
+            if waiter.is_alive():
+                self.kill()
+                while waiter.is_alive():
+                    try:
+                        chunks.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+
+    def _iter_popen(self):
+        """ Read lines straight from the pipe of an executor command, which
+            needs no helper threads since the file object does the buffering.
+        """
+        proc = self._proc
+        try:
+            for line in proc.stdout:
+                yield line.decode('utf-8').rstrip('\n')
+            stderr = proc.stderr.read()
+            proc.wait()
+        finally:
+            if proc.returncode is None:
+                self.kill()
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+        if proc.returncode and not self._killed:
+            raise executor.error_return(self.cmd.argv + tuple(str(i) for i in self.args),
+                                        proc.returncode, b'', stderr)
+
+
+def stream(cmd, *args):
+    """ Iterate over lines of output of cmd. See Stream. """
+    return iter(Stream(cmd, *args))
+
+
+def batch(cmd, lines, force=False, timeout=None):
+    """ Run lines of iproute2 commands, without the leading `ip`, through a
+        single `ip -batch -` process baked from cmd. Unless force is set, ip
+        stops at the first failing line and raises ErrorReturnCode.
+    """
+    opts = ('-force', '-batch', '-') if force else ('-batch', '-')
+    kwargs = dict(_in=''.join(line + '\n' for line in lines))
+    if timeout is not None:
+        kwargs['_timeout'] = timeout
+    return cmd.bake(*opts)(**kwargs)
 
 
 # pylint: disable=invalid-name
@@ -80,23 +627,143 @@ class classproperty(property):
 
 
 
+class LazySequence(object):
+    """ Base for read-only sequences which build their items on access.
+        ResultSet stores them as they are rather than copying into a tuple.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ()
+
+
+class ResultSet(object):
+    """ Immutable sequence of frozen objects returned by Base.view.
+
+        The same result set is shared by the cache and every caller, so it is
+        never copied. Slicing and filter() return views over the same storage,
+        and thaw() returns mutable copies for callers who need them.
+    """
+    __slots__ = ('_items', '_index', 'stale')
+
+    def __init__(self, items=(), index=None, stale=False):
+        self._items = items if isinstance(items, (tuple, LazySequence)) else tuple(items)
+        self._index = index
+        self.stale = stale
+
+    def __len__(self):
+        return len(self._items if self._index is None else self._index)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            index = range(len(self._items)) if self._index is None else self._index
+            return ResultSet(self._items, index[key], self.stale)
+        return self._items[key if self._index is None else self._index[key]]
+
+    def __iter__(self):
+        if self._index is None:
+            return iter(self._items)
+        items = self._items
+        return (items[i] for i in self._index)
+
+    def filter(self, func):
+        """ Return view of objects for which func is true. """
+        index = range(len(self._items)) if self._index is None else self._index
+        items = self._items
+        return ResultSet(items, tuple(i for i in index if func(items[i])), self.stale)
+
+    def as_stale(self):
+        """ Return view of the same objects, flagged as stale. """
+        return ResultSet(self._items, self._index, True)
+
+    def thaw(self):
+        """ Return list of mutable copies. """
+        return [i.copy() for i in self]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ResultSet({0!r})'.format(list(self))
+
+
+class ResultList(list):
+    """ List returned by Base.get. stale is set if the dump timed out and the
+        result is the last one cached instead.
+    """
+    stale = False
+
+
 class Base(object):
     """ The base class does generic processing of the output of an iproute2
         `show` command. Each subclass should provide a regex on how to
         interpret lines of output.
+
+        Objects parsed from iproute2 output are frozen, since they may be
+        shared between callers. Use copy() to obtain a mutable object.
     """
-    regex = re.compile(r'')
+    # _frozen lives in a slot rather than __dict__, which holds only parsed fields.
+    __slots__ = ('__dict__', '__weakref__', '_frozen')
+
+    regex = LazyRegex(r'')
     casts = dict()
     cache = Cache(0)
+    parallel = None
+    memo = None
+    shared = None
+    timeout = None
+    hedge = None
 
     def __init__(self, **kwargs):
         """ We receive a dict of key/value pairs, which we should set as object
             attributes. If specified, we should also cast the values.
         """
+        object.__setattr__(self, '_frozen', False)
+        casts = self.casts
         for key, value in kwargs.items():
-            if value is not None and key in self.casts:
-                value = self.casts[key](value)
-            setattr(self, key, value)
+            if value is not None and key in casts:
+                kwargs[key] = casts[key](value)
+        self.__dict__.update(kwargs)
+
+    # copy and pickle restore _frozen through __setattr__, before it is set.
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("{0!r} object is frozen, use copy()".format(type(self).__name__))
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("{0!r} object is frozen, use copy()".format(type(self).__name__))
+        object.__delattr__(self, name)
+
+    def freeze(self):
+        """ Make object immutable, storing nested sequences as tuples of
+            frozen objects. Returns self.
+        """
+        state = self.__dict__
+        for key, value in state.items():
+            if isinstance(value, list):
+                state[key] = tuple(i.freeze() if isinstance(i, Base) else i for i in value)
+        object.__setattr__(self, '_frozen', True)
+        return self
+
+    def copy(self):
+        """ Return mutable copy of object. Nested sequences are copied into
+            new lists of mutable objects.
+        """
+        other = object.__new__(type(self))
+        object.__setattr__(other, '_frozen', False)
+        for key, value in self.__dict__.items():
+            if isinstance(value, (list, tuple)):
+                value = [i.copy() if isinstance(i, Base) else i for i in value]
+            other.__dict__[key] = value
+        return other
 
     @classmethod
     def _get(cls, *args):
@@ -132,13 +799,15 @@ class Base(object):
         """
         return tuple(list(args) + [i for kv in kwargs.items() for i in kv])
 
-    @staticmethod
-    def shwrap(func, order):
+    @classmethod
+    def shwrap(cls, func, order):
         """ Wraps a shell command so we can unwind the command arguments in
             the correct order. This won't matter in Python3.5 since kwargs are
-            an ordered dict.
+            an ordered dict. A _timeout keyword, or the class default timeout,
+            is passed on to the command, which is killed if it runs over.
         """
         def wrapped(*args, **kwargs):
+            timeout = kwargs.pop('_timeout', cls.timeout)
             args = list(args)
             for key in order:
                 if key in kwargs:
@@ -149,30 +818,233 @@ class Base(object):
                         args.extend(value)
                     elif not isinstance(value, bool):
                         args.append(value)
-            # remaining kwargs are unordered
-            for item in kwargs.items():
-                args.extend(item)
+            # remaining kwargs are unordered, and True marks a bare flag.
+            for key, value in kwargs.items():
+                if value is True:
+                    args.append(key)
+                elif value is not False:
+                    args.extend((key, value))
 
+            if timeout is not None:
+                return func(*args, _timeout=timeout)
             return func(*args)
         return wrapped
 
 
+    @classmethod
+    def _parse(cls, args, lines=None):
+        """ Yield objects parsed from the output of _get(*args), or from
+            lines if given.
+        """
+        if lines is None:
+            func = functools.partial(cls._get, *args) if args else cls._get
+            lines = func()
+        memo = cls.memo
+        try:
+            if memo is None:
+                for line in lines:
+                    yield cls.from_string(line, *args).freeze()
+                return
+
+            old, new = memo.generation((cls, args)), {}
+            maxsize, hits, misses = memo.maxsize, 0, 0
+            for line in lines:
+                obj = old.get(line)
+                if obj is None:
+                    obj = cls.from_string(line, *args).freeze()
+                    misses += 1
+                else:
+                    hits += 1
+                if len(new) < maxsize:
+                    new[line] = obj
+                yield obj
+            # only complete dumps may evict lines.
+            memo.store((cls, args), new)
+            memo.hits += hits
+            memo.misses += misses
+        finally:
+            if hasattr(lines, 'close'):
+                lines.close()
+
+    @classmethod
+    def _parse_parallel(cls, args):
+        """ Like _parse, but read the whole dump and hand it to the process
+            pool if it is large enough.
+        """
+        func = functools.partial(cls._get, *args) if args else cls._get
+        lines = list(func())
+        memo = cls.memo
+        if memo is None:
+            return cls.parallel.parse(cls, args, lines)
+
+        # only lines missing from the memo are handed to the pool.
+        old = memo.generation((cls, args))
+        misses = [i for i in lines if i not in old]
+        new = dict(zip(misses, cls.parallel.parse(cls, args, misses)))
+        new.update((i, old[i]) for i in lines if i not in new)
+        result = [new[i] for i in lines]
+        if len(new) > memo.maxsize:
+            new = dict(zip(lines[:memo.maxsize], result))
+        memo.store((cls, args), new)
+        memo.hits += len(lines) - len(misses)
+        memo.misses += len(misses)
+        return result
+
     @classmethod
     def get(cls, *args, **kwargs):
         """ Scrape iproute2 output and return filtered list of matches. """
+        filt = kwargs.pop('filt', None)
+        timeout, hedge = cls._deadline(kwargs)
+        result = cls._lookup(cls._unwind(*args, **kwargs), timeout, hedge)
+        # an unfiltered get is a plain copy, without a call per object.
+        items = ResultList(result if filt is None else (i for i in result if filt(i)))
+        items.stale = result.stale
+        return items
+
+    @classmethod
+    def view(cls, *args, **kwargs):
+        """ Like get, but return the cached ResultSet itself rather than a
+            list copy. Filtering with filt returns a view of it.
+        """
+        filt = kwargs.pop('filt', None)
+        timeout, hedge = cls._deadline(kwargs)
+        result = cls._lookup(cls._unwind(*args, **kwargs), timeout, hedge)
+        return result if filt is None else result.filter(filt)
+
+    @classmethod
+    def _deadline(cls, kwargs):
+        """ Pop per-call _timeout and _hedge, defaulting to set_deadline. """
+        return kwargs.pop('_timeout', cls.timeout), kwargs.pop('_hedge', cls.hedge)
+
+    @classmethod
+    def _lookup(cls, args, timeout=None, hedge=None):
+        """ Return ResultSet for args, from cache if possible. If the dump
+            times out, fall back to the last cached result marked as stale.
+        """
+        if cls.shared is not None:
+            result = cls.shared.result(cls, args)
+            if result is not None:
+                return result
+        cache = cls.cache
+        result = cache.lookup(args) if cache else None
+        if result is None and cache:
+            # stale while revalidate, if enabled.
+            result = cache.lookup_stale(args)
+            if result is not None:
+                cache.refresh(args, functools.partial(cls._single_flight, args, cache,
+                                                      cls.timeout, cls.hedge))
+        if result is None:
+            try:
+                result = cls._single_flight(args, cache, timeout, hedge)
+            except _sh().TimeoutException:
+                result = cache.lookup_last(args) if cache else None
+                if result is None:
+                    raise
+                result = result.as_stale()
+        return result
+
+    @classmethod
+    def _single_flight(cls, args, cache, timeout=None, hedge=None):
+        """ Run dump for args, or wait for an identical one already running.
+            The unfiltered result is cached and shared by all callers.
+        """
+        generation = cache.generation if cache is not None else None
+        key = (cls, args, generation)
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = Flight()
+                metrics['flights'] += 1
+            else:
+                flight.waiters += 1
+                metrics['coalesced'] += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise _sh().TimeoutException(-9, cls._name(args))
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = cls._dump(args, timeout, hedge)
+            if cache is not None:
+                cache.store(args, flight.result, generation)
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with _flights_lock:
+                del _flights[key]
+            flight.done.set()
+        return flight.result
+
+    @classmethod
+    def _dump(cls, args, timeout=None, hedge=None):
+        """ Parse output for args into a ResultSet, within deadline if any. """
+        parse = cls._parse if cls.parallel is None else cls._parse_parallel
+        latencies = getattr(cls, '_latencies', None)
+        if hedge is True:
+            # hedge at the 95th percentile of recent dumps, once we know it.
+            ordered = sorted(latencies or ())
+            hedge = ordered[int(len(ordered) * 0.95)] if len(ordered) >= 20 else None
+        if timeout is None and hedge is None:
+            start = time.time()
+            result = ResultSet(parse(args))
+            elapsed = time.time() - start
+        else:
+            attempt = deadline(lambda: ResultSet(parse(args)), timeout, hedge, cls._name(args))
+            result, elapsed = attempt.result, attempt.elapsed
+        if latencies is not None:
+            latencies.append(elapsed)
+        return result
+
+    @classmethod
+    def _name(cls, args):
+        return ' '.join([cls.__name__] + [str(i) for i in args])
+
+    @classmethod
+    def aget(cls, *args, **kwargs):
+        """ Asyncio version of get, run in the default executor. Concurrent
+            identical calls share one dump, as with get.
+        """
+        import asyncio
+        func = functools.partial(cls.get, *args, **kwargs)
+        return asyncio.get_event_loop().run_in_executor(None, func)
+
+    @classmethod
+    def iter_get(cls, *args, **kwargs):
+        """ Like get, but yield matches as iproute2 output is read rather than
+            building a list. The cache is bypassed, so memory stays bounded
+            regardless of table size. Stopping early kills the `ip` process.
+        """
         filt = kwargs.pop('filt', lambda x: True)
         args = cls._unwind(*args, **kwargs)
+        parsed = cls._parse(args)
+        try:
+            for item in parsed:
+                if filt(item):
+                    yield item
+        finally:
+            parsed.close()
 
-        if cls.cache and args in cls.cache:
-            return cls.cache[args][:]
+    @classproperty
+    def _monitor(cls):
+        """ The `ip monitor` command reporting changes to objects of this class. """
+        raise NotImplementedError
 
-        func = functools.partial(cls._get, *args) if args else cls._get
-        iterator = (cls.from_string(l, *args) for l in func())
-        result = [i for i in iterator if filt(i)]
-        if cls.cache is not None:
-            # save copy in cache.
-            cls.cache[args] = result[:]
-        return result
+    @classmethod
+    def watch(cls, **kwargs):
+        """ Follow changes through `ip monitor`. Returns a watch.Watcher, which
+            iterates (or async iterates) over batches of watch.Event.
+        """
+        from .watch import Watcher
+        return Watcher(cls, **kwargs)
+
+    def _key(self):
+        """ Identify object across changes. Override in subclass. """
+        return str(self)
 
     def __getattr__(self, name):
         """ Check for missing attributes. Override in subclass. """
@@ -188,9 +1060,46 @@ class Base(object):
         return self.__str__() == other.__str__()
 
     @classmethod
-    def set_cache(cls, timeout = 0):
-        """ Cache show results."""
-        cls.cache = Cache(timeout)
+    def set_cache(cls, timeout = 0, max_stale = 0, refresh_workers = 1):
+        """ Cache show results. See Cache for serving stale results. """
+        cls.cache = Cache(timeout, max_stale, refresh_workers)
+
+    @classmethod
+    def set_deadline(cls, timeout = None, hedge = None):
+        """ Kill commands running for longer than timeout seconds. Timed out
+            reads return the last cached result, flagged as stale, if any.
+            With hedge, reads still running after that many seconds are
+            retried in parallel; hedge=True uses the 95th percentile latency
+            of recent reads.
+        """
+        cls.timeout = timeout
+        cls.hedge = hedge
+        cls._latencies = collections.deque(maxlen=100)
+
+    @classmethod
+    def set_shared(cls, path = None):
+        """ Serve get from snapshots published under path by an
+            shm.Publisher in another process. Pass None to disable.
+        """
+        from .shm import SnapshotReader
+        cls.shared = SnapshotReader(path) if path else None
+
+    @classmethod
+    def set_memo(cls, maxsize = 1 << 20, maxkeys = 64):
+        """ Reuse objects parsed from lines which are unchanged since the
+            last dump with the same arguments. Pass maxsize=0 to disable.
+        """
+        cls.memo = LineMemo(maxsize, maxkeys) if maxsize else None
+
+    @classmethod
+    def set_parallel(cls, workers = None, threshold = 100000, chunksize = 10000):
+        """ Parse dumps of at least threshold lines in a pool of worker
+            processes, one for each CPU by default. Pass workers=0 to disable.
+        """
+        from .parallel import Parallel
+        if cls.__dict__.get('parallel') is not None:
+            cls.parallel.close()
+        cls.parallel = Parallel(workers, threshold, chunksize) if workers != 0 else None
 
 
 
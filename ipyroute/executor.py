@@ -0,0 +1,98 @@
+""" Minimal subprocess backend for running iproute2. """
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import threading
+
+
+def error_return(argv, code, stdout=b'', stderr=b''):
+    """ Build the exception `sh` would raise for a command exiting with code.
+        Negative codes, for children killed by a signal, map to SignalException.
+    """
+    import sh
+    name = 'ErrorReturnCode_{0}' if code > 0 else 'SignalException_{0}'
+    exc = getattr(sh, name.format(abs(code)))
+    return exc(' '.join(argv), stdout, stderr)
+
+
+def which(program):
+    """ Return full path of program in PATH, or None. """
+    for path in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        exe = os.path.join(path, program)
+        if os.path.isfile(exe) and os.access(exe, os.X_OK):
+            return exe
+    return None
+
+
+class Command(object):
+    """ Runs argv directly with subprocess, without the threads and
+        per-call object churn of `sh.RunningCommand`.
+
+        Attribute access and `bake` extend argv like `sh.Command`; children
+        are memoized, so attribute chains such as `IPR.ipv4.route.show` are
+        resolved once and reused. Calling returns stdout as text, and a
+        nonzero exit raises the same `ErrorReturnCode` subclass as `sh`.
+        Of the `sh` special keyword arguments only `_in` and `_timeout` are
+        honoured; other ones are ignored.
+    """
+    __slots__ = ('argv', '_children')
+
+    def __init__(self, *argv):
+        self.argv = argv
+        self._children = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._children[name]
+        except KeyError:
+            child = self._children[name] = Command(*(self.argv + (name,)))
+            return child
+
+    def bake(self, *args):
+        """ Return new command with args appended. """
+        return Command(*(self.argv + tuple(str(i) for i in args)))
+
+    def _argv(self, args, kwargs):
+        for key in kwargs:
+            if not key.startswith('_'):
+                raise TypeError("Unexpected keyword argument {0!r}".format(key))
+        return self.argv + tuple(str(i) for i in args)
+
+    def __call__(self, *args, **kwargs):
+        argv = self._argv(args, kwargs)
+        stdin = kwargs.get('_in')
+        if stdin is not None and not isinstance(stdin, bytes):
+            stdin = ''.join(stdin).encode('utf-8')
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                stdin=subprocess.PIPE if stdin is not None else None,
+                                close_fds=True)
+        timer, fired = None, []
+        if kwargs.get('_timeout') is not None:
+            def _kill():
+                fired.append(True)
+                proc.kill()
+            timer = threading.Timer(kwargs['_timeout'], _kill)
+            timer.start()
+        try:
+            stdout, stderr = proc.communicate(stdin)
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if fired:
+            import sh
+            raise sh.TimeoutException(proc.returncode, ' '.join(argv))
+        if proc.returncode:
+            raise error_return(argv, proc.returncode, stdout, stderr)
+        return stdout.decode('utf-8')
+
+    def popen(self, *args, **kwargs):
+        """ Start command with stdout and stderr piped, and return the
+            process. Used by Stream to read output incrementally.
+        """
+        return subprocess.Popen(self._argv(args, kwargs), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True)
+
+    def __repr__(self):
+        return ' '.join(self.argv)
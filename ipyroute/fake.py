@@ -0,0 +1,1155 @@
+""" In-memory iproute2 backend.
+
+    FakeKernel keeps links, addresses, routes, rules and neighbors in plain
+    dictionaries and answers the argv ipyroute builds with `ip -o` formatted
+    output, so we can exercise and benchmark ipyroute without root or a
+    network namespace:
+
+    >>> kernel = FakeKernel()
+    >>> ipyroute.base.IPR.bind(kernel.ip)
+    >>> ipyroute.Route4.add('10.0.0.0/24', dev='lo')
+
+    Only the subset of iproute2 that ipyroute drives is understood. Routes the
+    real kernel would derive from addresses (connected and local routes) are
+    not synthesized, so dumps only ever contain what was explicitly added.
+"""
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import collections
+import shlex
+import types
+
+import netaddr
+
+from .executor import error_return
+
+TABLES = {'default': 253, 'main': 254, 'local': 255}
+TABLE_NAMES = dict((v, k) for k, v in TABLES.items())
+
+ROUTE_TYPES = ('unicast', 'local', 'broadcast', 'multicast', 'throw',
+               'unreachable', 'prohibit', 'blackhole', 'nat')
+
+LINK_FLAGS = {'loopback': ['LOOPBACK'],
+              'dummy': ['BROADCAST', 'NOARP'],
+              'gre': ['NOARP'],
+              'ipip': ['NOARP']}
+ETHER_FLAGS = ['BROADCAST', 'MULTICAST']
+
+
+# Marks exhausted output in FakeKernel.run.
+_END = object()
+
+
+class Error(Exception):
+    """ Raised by handlers to signal a non-zero exit from `ip`, after printing
+        output lines.
+    """
+    def __init__(self, code, msg, output=()):
+        super(Error, self).__init__(msg)
+        self.code = code
+        self.output = output
+
+
+class Command(object):
+    """ Mimics the subset of `sh.Command` that ipyroute relies on: attribute
+        access and `bake` extend argv, calling runs it against the kernel.
+    """
+    def __init__(self, kernel, argv):
+        self._kernel = kernel
+        self._argv = argv
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return Command(self._kernel, self._argv + (name,))
+
+    def bake(self, *args):
+        """ Return new command with args appended. """
+        return Command(self._kernel, self._argv + tuple(str(i) for i in args))
+
+    def __call__(self, *args, **kwargs):
+        # sh special keyword arguments other than _in (_iter, _timeout, ...)
+        # are accepted and ignored.
+        argv = self._argv + tuple(str(i) for i in args)
+        return self._kernel.run(argv, kwargs.get('_in'))
+
+    def __repr__(self):
+        return ' '.join(self._argv)
+
+
+def _parse(tokens, keys, flags=()):
+    """ Split tokens into keyword options and remaining positionals.
+        `keys` maps every accepted keyword (and its aliases) to a canonical name.
+    """
+    opts, rest = {}, []
+    tokens = iter(tokens)
+    for tok in tokens:
+        if tok in keys:
+            try:
+                opts[keys[tok]] = next(tokens)
+            except StopIteration:
+                raise Error(255, 'Command line is not complete. Try option "help"')
+        elif tok in flags:
+            opts[tok] = True
+        else:
+            rest.append(tok)
+    return opts, rest
+
+
+def _prefix(value, family=None):
+    """ Parse prefix, returning IPNetwork with host bits checked. """
+    if value in ('default', 'all', 'any'):
+        return netaddr.IPNetwork('::/0' if family == 6 else '0.0.0.0/0')
+    try:
+        net = netaddr.IPNetwork(value)
+    except (netaddr.AddrFormatError, ValueError, TypeError):
+        raise Error(1, 'Error: inet prefix is expected rather than "{0}".'.format(value))
+    if family and net.version != family:
+        raise Error(1, 'Error: inet prefix is expected rather than "{0}".'.format(value))
+    return net
+
+
+def _address(value, family=None):
+    try:
+        addr = netaddr.IPAddress(value)
+    except (netaddr.AddrFormatError, ValueError, TypeError):
+        raise Error(1, 'Error: inet address is expected rather than "{0}".'.format(value))
+    if family and addr.version != family:
+        raise Error(1, 'Error: inet address is expected rather than "{0}".'.format(value))
+    return addr
+
+
+def _int(value, what):
+    try:
+        return int(value, 0)
+    except ValueError:
+        raise Error(1, 'Error: argument "{0}" is wrong: {1} is invalid'.format(value, what))
+
+
+def _hostlen(net):
+    return 32 if net.version == 4 else 128
+
+
+def _show_prefix(net):
+    """ iproute2 prints host routes without prefix length. """
+    if net.prefixlen == 0:
+        return 'default'
+    if net.prefixlen == _hostlen(net):
+        return str(net.ip)
+    return str(net.cidr)
+
+
+class RouteTable(collections.OrderedDict):
+    """ Routes of one table keyed on (network, metric), indexed by prefix so
+        deletes and longest prefix lookups don't scan the table.
+    """
+    def __init__(self):
+        super(RouteTable, self).__init__()
+        self.prefixes = {}                                  # (first, len) -> [key]
+        self.lengths = collections.Counter()                # prefix length -> routes
+
+    @staticmethod
+    def _prefix(network):
+        return (network.first, network.prefixlen)
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.prefixes.setdefault(self._prefix(key[0]), []).append(key)
+            self.lengths[key[0].prefixlen] += 1
+        super(RouteTable, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super(RouteTable, self).__delitem__(key)
+        prefix = self._prefix(key[0])
+        keys = self.prefixes[prefix]
+        keys.remove(key)
+        if not keys:
+            del self.prefixes[prefix]
+        self.lengths[key[0].prefixlen] -= 1
+        if not self.lengths[key[0].prefixlen]:
+            del self.lengths[key[0].prefixlen]
+
+    def keys_for(self, network):
+        """ Return keys of routes for network, any metric. """
+        return list(self.prefixes.get(self._prefix(network), ()))
+
+    def matching(self, addr):
+        """ Yield lists of routes containing addr, longest prefix first. """
+        hostlen = 32 if addr.version == 4 else 128
+        value = int(addr)
+        for length in sorted(self.lengths, reverse=True):
+            first = value >> (hostlen - length) << (hostlen - length) if length else 0
+            keys = self.prefixes.get((first, length))
+            if keys:
+                yield [self[k] for k in keys]
+
+
+class FakeKernel(object):
+    """ Stateful stand-in for iproute2 and the kernel tables behind it.
+        State lives in insertion ordered dictionaries so output is deterministic.
+    """
+    # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    def __init__(self):
+        self.links = collections.OrderedDict()
+        self.addresses = collections.OrderedDict()
+        self.locals = collections.Counter()     # local address -> count
+        self.routes = {4: collections.OrderedDict(), 6: collections.OrderedDict()}
+        self.rules = {4: [], 6: []}
+        self.neighbors = collections.OrderedDict()
+        self.nexthops = collections.OrderedDict()
+        self.netns = collections.defaultdict(list)
+        self._names = {}
+        self._lastindex = 0
+        self.ip = Command(self, ('ip',))
+
+        self._new_link('lo', 'loopback', mtu=65536, up=True,
+                       addr='00:00:00:00:00:00', brd='00:00:00:00:00:00')
+        self.run(('ip', 'addr', 'add', '127.0.0.1/8', 'scope', 'host', 'dev', 'lo'))
+        self.run(('ip', 'addr', 'add', '::1/128', 'scope', 'host', 'dev', 'lo'))
+        for family, rules in ((4, ('local', 'main', 'default')), (6, ('local', 'main'))):
+            for pref, table in zip((0, 32766, 32767), rules):
+                self.rules[family].append(dict(pref=pref, table=TABLES[table], _not=False,
+                                               src=None, dst=None, fwmark=None, iif=None))
+
+    def run(self, argv, stdin=None):
+        """ Execute argv (including the leading `ip`). Returns output lines.
+            stdin is read by `-batch -`.
+        """
+        try:
+            output = self._run(argv, stdin)
+            if isinstance(output, types.GeneratorType):
+                # show handlers check their arguments once iterated, so run
+                # them up to the first line here.
+                first = next(output, _END)
+                return self._drain(argv, first, output)
+            return output
+        except Error as exc:
+            raise self._error(argv, exc)
+
+    @staticmethod
+    def _error(argv, exc):
+        stdout = ''.join(line + '\n' for line in exc.output).encode('utf-8')
+        return error_return(argv, exc.code, stdout, str(exc).encode('utf-8'))
+
+    def _drain(self, argv, first, output):
+        """ Yield remaining output, converting errors as run does. """
+        if first is _END:
+            return
+        yield first
+        try:
+            for line in output:
+                yield line
+        except Error as exc:
+            raise self._error(argv, exc)
+
+    def _run(self, argv, stdin=None):
+        family, stats = None, 0
+        tokens = list(argv[1:])
+        batch, force, options = None, False, []
+        while tokens and tokens[0].startswith('-'):
+            opt = tokens.pop(0)
+            if opt not in ('-force', '-b', '-batch'):
+                options.append(opt)
+            if opt in ('-4', '-6'):
+                family = int(opt[1])
+            elif opt in ('-0', '-o', '-oneline'):
+                pass
+            elif opt in ('-s', '-stats', '-statistics'):
+                stats += 1
+            elif opt == '-force':
+                force = True
+            elif opt in ('-b', '-batch'):
+                if not tokens:
+                    raise Error(255, 'Option "{0}" requires an argument'.format(opt))
+                batch = tokens.pop(0)
+            else:
+                raise Error(255, 'Option "{0}" is unknown, try "ip -help".'.format(opt))
+
+        if batch is not None:
+            return self._batch(argv[:1] + tuple(options), batch, stdin, force)
+
+        if not tokens:
+            raise Error(255, 'Usage: ip [ OPTIONS ] OBJECT { COMMAND | help }')
+        obj = {'l': 'link', 'a': 'addr', 'address': 'addr', 'r': 'route', 'ro': 'route',
+               'ru': 'rule', 'n': 'neigh', 'neighbor': 'neigh',
+               'neighbour': 'neigh', 'nh': 'nexthop'}.get(tokens[0], tokens[0])
+        verb = tokens[1] if len(tokens) > 1 else 'show'
+        verb = {'list': 'show', 'lst': 'show', 'ls': 'show',
+                'delete': 'del', 'a': 'add'}.get(verb, verb)
+        handler = getattr(self, '_{0}_{1}'.format(obj, verb), None)
+        if handler is None:
+            if not hasattr(self, '_{0}_show'.format(obj)):
+                raise Error(1, 'Object "{0}" is unknown, try "ip help".'.format(tokens[0]))
+            raise Error(255, 'Command "{0}" is unknown, try "ip {1} help".'.format(verb, obj))
+        if verb == 'show':
+            return handler(family, tokens[2:], stats)
+        return handler(family, tokens[2:]) or []
+
+    def _batch(self, prefix, path, stdin, force):
+        """ Run each line of batch input as a command, as `ip -batch`. """
+        if path != '-':
+            with open(path) as fobj:
+                stdin = fobj.read()
+        if isinstance(stdin, bytes):
+            stdin = stdin.decode('utf-8')
+        elif stdin is not None and not isinstance(stdin, str):
+            stdin = ''.join(stdin)
+        output, failed = [], False
+        for lineno, line in enumerate((stdin or '').splitlines(), 1):
+            tokens = shlex.split(line, comments=True)
+            if not tokens:
+                continue
+            try:
+                output.extend(self._run(prefix + tuple(tokens)))
+            except Error:
+                failed = True
+                if not force:
+                    raise Error(1, 'Command failed {0}:{1}'.format(path, lineno), output)
+        if failed:
+            raise Error(1, 'Command failed {0}'.format(path), output)
+        return output
+
+    # Links
+
+    def _index(self, name):
+        try:
+            return self._names[name]
+        except KeyError:
+            raise Error(1, 'Cannot find device "{0}"'.format(name))
+
+    def _new_link(self, name, kind, **kwargs):
+        if name in self._names:
+            raise Error(2, 'RTNETLINK answers: File exists')
+        self._lastindex += 1
+        index = self._lastindex
+        link = dict(index=index, name=name, kind=kind, up=False, mtu=1500, master=None,
+                    parent=None, peer=None, group='default', qlen=1000, stats=[0] * 12,
+                    addr='02:00:00:{0:02x}:{1:02x}:{2:02x}'.format(
+                        (index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff),
+                    brd='ff:ff:ff:ff:ff:ff')
+        if kind in ('gre', 'ipip'):
+            link.update(addr='0.0.0.0', brd='0.0.0.0', mtu=1476)
+        link.update(kwargs)
+        self.links[index] = link
+        self._names[name] = index
+        return link
+
+    def _drop_link(self, index):
+        link = self.links.pop(index)
+        del self._names[link['name']]
+        for addr in self.addresses.pop(index, {}).values():
+            self._forget_local(addr)
+        for nhid in [k for k, n in self.nexthops.items() if n['dev'] == index]:
+            self._drop_nexthop(nhid)
+        for table in self.routes.values():
+            for routes in table.values():
+                for key in [k for k, r in routes.items() if r['dev'] == index]:
+                    del routes[key]
+        for key in [k for k in self.neighbors if k[2] == index]:
+            del self.neighbors[key]
+        for other in self.links.values():
+            if other['master'] == index:
+                other['master'] = None
+        return link
+
+    def _format_link(self, link, stats):
+        flags = list(LINK_FLAGS.get(link['kind'], ETHER_FLAGS))
+        if link['kind'] == 'bridge':
+            flags.append('MASTER')
+        if link['up']:
+            flags.extend(['UP', 'LOWER_UP'])
+        name = link['name']
+        if link['parent'] is not None:
+            parent = self.links.get(link['parent'])
+            name += '@' + (parent['name'] if parent else 'if{0}'.format(link['parent']))
+        elif link['kind'] in ('gre', 'ipip'):
+            name += '@NONE'
+        if link['kind'] in ('loopback', 'dummy'):
+            state = 'UNKNOWN' if link['up'] else 'DOWN'
+        else:
+            state = 'UP' if link['up'] else 'DOWN'
+        master = ''
+        if link['master'] is not None:
+            master = 'master {0} '.format(self.links[link['master']]['name'])
+        linktype = {'loopback': 'loopback', 'gre': 'gre', 'ipip': 'ipip'}.get(link['kind'], 'ether')
+        line = ('{0}: {1}: <{2}> mtu {3} qdisc {4} {5}state {6} mode DEFAULT group {7} '
+                'qlen {8}\\    link/{9} {10} brd {11}').format(
+                    link['index'], name, ','.join(flags), link['mtu'],
+                    'noqueue' if link['up'] else 'noop', master, state,
+                    link['group'], link['qlen'], linktype, link['addr'], link['brd'])
+        if stats:
+            line += ('\\    RX:  bytes packets errors dropped  missed   mcast           '
+                     '\\    {0} {1} {2} {3} {4} {5} '
+                     '\\    TX:  bytes packets errors dropped carrier collsns           '
+                     '\\    {6} {7} {8} {9} {10} {11} ').format(*link['stats'])
+        return line
+
+    def _link_show(self, _family, tokens, stats):
+        opts, rest = _parse(tokens, dict(dev='dev', group='group', master='master', type='type'),
+                            flags=('up',))
+        if rest:
+            opts['dev'] = rest[0]
+        links = list(self.links.values())
+        if 'dev' in opts:
+            if opts['dev'] not in self._names:
+                raise Error(1, 'Device "{0}" does not exist.'.format(opts['dev']))
+            links = [self.links[self._names[opts['dev']]]]
+        if 'group' in opts:
+            links = [l for l in links if l['group'] == opts['group']]
+        if 'master' in opts:
+            master = self._index(opts['master'])
+            links = [l for l in links if l['master'] == master]
+        if 'type' in opts:
+            links = [l for l in links if l['kind'] == opts['type']]
+        if 'up' in opts:
+            links = [l for l in links if l['up']]
+        return (self._format_link(l, stats) for l in links)
+
+    def _link_add(self, _family, tokens):
+        if 'type' not in tokens:
+            raise Error(2, 'Not enough information: "type" argument is required')
+        idx = tokens.index('type')
+        if idx + 1 == len(tokens):
+            raise Error(255, 'Command line is not complete. Try option "help"')
+        kind, extra = tokens[idx + 1], tokens[idx + 2:]
+        keys = dict(link='link', name='name', dev='name', address='addr', mtu='mtu',
+                    netns='netns', group='group', txqueuelen='qlen', qlen='qlen')
+        opts, rest = _parse(tokens[:idx], keys)
+        if rest and 'name' not in opts:
+            opts['name'] = rest.pop(0)
+        if rest or 'name' not in opts:
+            raise Error(2, 'Not enough information: "dev" argument is required.')
+
+        kwargs = {}
+        if 'link' in opts:
+            kwargs['parent'] = self._index(opts['link'])
+        if 'addr' in opts:
+            kwargs['addr'] = opts['addr'].lower()
+        if 'mtu' in opts:
+            kwargs['mtu'] = _int(opts['mtu'], 'mtu')
+        if 'group' in opts:
+            kwargs['group'] = opts['group']
+        if 'qlen' in opts:
+            kwargs['qlen'] = _int(opts['qlen'], 'qlen')
+
+        peer = None
+        if kind == 'veth':
+            peeropts, _ = _parse(extra[1:] if extra[:1] == ['peer'] else [],
+                                 dict(name='name', address='addr', mtu='mtu', netns='netns'))
+            peer = peeropts.get('name', 'veth{0}'.format(self._lastindex + 2))
+            if peer in self._names or peer == opts['name']:
+                raise Error(2, 'RTNETLINK answers: File exists')
+        elif kind == 'vlan':
+            vlanopts, _ = _parse(extra, dict(id='id', protocol='protocol'))
+            if 'id' not in vlanopts or 'parent' not in kwargs:
+                raise Error(2, 'Not enough information: "link" and "id" arguments are required.')
+            kwargs['vlan'] = _int(vlanopts['id'], 'id')
+        elif kind in ('macvlan', 'macvtap'):
+            kwargs['mode'] = _parse(extra, dict(mode='mode'))[0].get('mode', 'vepa')
+        elif kind in ('gre', 'ipip'):
+            tunopts, _ = _parse(extra, dict(local='local', remote='remote'))
+            kwargs['addr'] = tunopts.get('local', '0.0.0.0')
+            kwargs['brd'] = tunopts.get('remote', '0.0.0.0')
+
+        link = self._new_link(opts['name'], kind, **kwargs)
+        if peer is not None:
+            other = self._new_link(peer, kind, peer=link['index'], parent=link['index'])
+            link['peer'] = link['parent'] = other['index']
+        if 'netns' in opts:
+            self._move_netns(link['index'], opts['netns'])
+
+    def _move_netns(self, index, netns):
+        link = self._drop_link(index)
+        self.netns[netns].append(link['name'])
+
+    def _link_del(self, _family, tokens):
+        opts, rest = _parse(tokens, dict(dev='dev', group='group'))
+        if rest:
+            opts['dev'] = rest[0]
+        if 'group' in opts:
+            indexes = [k for k, l in self.links.items() if l['group'] == opts['group']]
+        elif 'dev' in opts:
+            indexes = [self._index(opts['dev'])]
+        else:
+            raise Error(255, 'Not enough information: "dev" argument is required.')
+        for index in indexes:
+            if self.links[index]['kind'] == 'loopback':
+                raise Error(2, 'RTNETLINK answers: Operation not supported')
+            peer = self.links[index]['peer']
+            self._drop_link(index)
+            if peer in self.links:
+                self._drop_link(peer)
+
+    def _link_set(self, _family, tokens):
+        keys = dict(dev='dev', mtu='mtu', name='name', address='addr', master='master',
+                    netns='netns', group='group', txqueuelen='qlen', qlen='qlen', alias='alias')
+        opts, rest = _parse(tokens, keys, flags=('up', 'down', 'nomaster'))
+        if rest and 'dev' not in opts:
+            opts['dev'] = rest.pop(0)
+        if rest:
+            raise Error(255, 'Error: either "dev" is duplicate, or "{0}" is a garbage.'.format(rest[0]))
+        if 'dev' not in opts:
+            raise Error(255, 'Not enough of information: "dev" argument is required.')
+        index = self._index(opts['dev'])
+        link = self.links[index]
+        if 'mtu' in opts:
+            link['mtu'] = _int(opts['mtu'], 'mtu')
+        if 'qlen' in opts:
+            link['qlen'] = _int(opts['qlen'], 'qlen')
+        if 'addr' in opts:
+            link['addr'] = opts['addr'].lower()
+        if 'group' in opts:
+            link['group'] = opts['group']
+        if 'master' in opts:
+            link['master'] = self._index(opts['master'])
+        if 'nomaster' in opts:
+            link['master'] = None
+        if 'name' in opts and opts['name'] != link['name']:
+            if opts['name'] in self._names:
+                raise Error(2, 'RTNETLINK answers: File exists')
+            del self._names[link['name']]
+            link['name'] = opts['name']
+            self._names[link['name']] = index
+        if 'up' in opts or 'down' in opts:
+            link['up'] = 'up' in opts
+        if 'netns' in opts:
+            self._move_netns(index, opts['netns'])
+
+    # Addresses
+
+    def _format_addr(self, index, addr):
+        link = self.links[index]
+        if addr['family'] == 6:
+            return ('{0}: {1}    inet6 {2} scope {3} \\       '
+                    'valid_lft forever preferred_lft forever').format(
+                        index, link['name'], addr['local'], addr['scope'])
+        parts = ['{0}: {1}    inet'.format(index, link['name'])]
+        if addr['peer']:
+            parts.extend([str(addr['local'].ip), 'peer', str(addr['peer'])])
+        else:
+            parts.append(str(addr['local']))
+        if addr['brd']:
+            parts.extend(['brd', addr['brd']])
+        parts.extend(['scope', addr['scope'], addr['label'] or link['name']])
+        return ' '.join(parts) + '\\       valid_lft forever preferred_lft forever'
+
+    def _addr_args(self, family, tokens):
+        keys = dict(local='local', peer='peer', broadcast='brd', brd='brd', scope='scope',
+                    label='label', dev='dev', valid_lft='valid_lft',
+                    preferred_lft='preferred_lft')
+        opts, rest = _parse(tokens, keys)
+        if rest and 'local' not in opts:
+            opts['local'] = rest.pop(0)
+        if 'local' not in opts:
+            raise Error(1, 'Not enough information: "local" argument is required.')
+        if 'dev' not in opts:
+            raise Error(1, 'Not enough information: "dev" argument is required.')
+        local = _prefix(opts['local'], family)
+        peer = _prefix(opts['peer'], local.version) if 'peer' in opts else None
+        if peer is not None:
+            local = netaddr.IPNetwork('{0}/{1}'.format(local.ip, _hostlen(local)))
+        index = self._index(opts['dev'])
+        return (index, str(local.ip), str(peer)), opts, local, peer
+
+    def _addr_add(self, family, tokens, replace=False, change=False):
+        key, opts, local, peer = self._addr_args(family, tokens)
+        index = key[0]
+        addresses = self.addresses.setdefault(index, collections.OrderedDict())
+        if key in addresses and not (replace or change):
+            raise Error(2, 'RTNETLINK answers: File exists')
+        if key not in addresses and change:
+            raise Error(2, 'RTNETLINK answers: No such file or directory')
+        if 'scope' in opts:
+            scope = opts['scope']
+        elif local.ip.is_loopback():
+            scope = 'host'
+        elif local.version == 6 and local.ip.is_link_local():
+            scope = 'link'
+        else:
+            scope = 'global'
+        brd = opts.get('brd')
+        if brd == '+':
+            brd = str(local.broadcast) if local.broadcast else None
+        if key not in addresses:
+            self.locals[local.ip] += 1
+        addresses[key] = dict(family=local.version, local=local, peer=peer, brd=brd,
+                              scope=scope, label=opts.get('label'))
+
+    def _forget_local(self, addr):
+        self.locals[addr['local'].ip] -= 1
+        if not self.locals[addr['local'].ip]:
+            del self.locals[addr['local'].ip]
+
+    def _drop_addr(self, index, key):
+        self._forget_local(self.addresses[index].pop(key))
+
+    def _addr_replace(self, family, tokens):
+        self._addr_add(family, tokens, replace=True)
+
+    def _addr_change(self, family, tokens):
+        self._addr_add(family, tokens, change=True)
+
+    def _addr_del(self, family, tokens):
+        key, _, _, _ = self._addr_args(family, tokens)
+        try:
+            self._drop_addr(key[0], key)
+        except KeyError:
+            raise Error(2, 'RTNETLINK answers: Cannot assign requested address')
+
+    def _select_addrs(self, family, tokens):
+        opts, rest = _parse(tokens, dict(dev='dev', label='label', scope='scope', to='to'))
+        if rest:
+            opts['dev'] = rest[0]
+        if 'dev' in opts:
+            if opts['dev'] not in self._names:
+                raise Error(1, 'Device "{0}" does not exist.'.format(opts['dev']))
+            indexes = [self._names[opts['dev']]]
+        else:
+            indexes = list(self.addresses)
+        to = _prefix(opts['to']) if 'to' in opts else None
+        for index in indexes:
+            for key, addr in list(self.addresses.get(index, {}).items()):
+                if family and addr['family'] != family:
+                    continue
+                if 'label' in opts and (addr['label'] or self.links[index]['name']) != opts['label']:
+                    continue
+                if 'scope' in opts and addr['scope'] != opts['scope']:
+                    continue
+                if to is not None and addr['local'].ip not in to:
+                    continue
+                yield index, key, addr
+
+    def _addr_show(self, family, tokens, _stats):
+        return (self._format_addr(i, a) for i, _, a in list(self._select_addrs(family, tokens)))
+
+    def _addr_flush(self, family, tokens):
+        if not tokens:
+            raise Error(1, 'Flush requires arguments.')
+        for index, key, _ in list(self._select_addrs(family, tokens)):
+            self._drop_addr(index, key)
+
+    # Routes
+
+    def _table(self, value):
+        if value in TABLES:
+            return TABLES[value]
+        return _int(value, 'table')
+
+    def _route_args(self, family, tokens):
+        """ Parse route spec into a record. Returns (table, key, record). """
+        nexthops, spec = [], tokens
+        if 'nexthop' in tokens:
+            idx = tokens.index('nexthop')
+            spec = tokens[:idx]
+            for tok in tokens[idx:]:
+                if tok == 'nexthop':
+                    nexthops.append([])
+                else:
+                    nexthops[-1].append(tok)
+        keys = dict(via='via', dev='dev', oif='dev', proto='proto', protocol='proto',
+                    scope='scope', src='src', metric='metric', priority='metric',
+                    preference='metric', table='table', mtu='mtu', advmss='advmss',
+                    to='to', realm='realm', pref='pref', nhid='nhid')
+        opts, rest = _parse(spec, keys, flags=('onlink',))
+        rtype = 'unicast'
+        if rest and rest[0] in ROUTE_TYPES:
+            rtype = rest.pop(0)
+        if 'to' in opts:
+            rest.insert(0, opts.pop('to'))
+        if not rest:
+            raise Error(255, 'Command line is not complete. Try option "help"')
+        if len(rest) > 1:
+            raise Error(255, 'Error: either "to" is duplicate, or "{0}" is a garbage.'.format(rest[1]))
+        network = _prefix(rest[0], family)
+        family = network.version
+        if network.cidr != network:
+            raise Error(2, 'Error: Invalid prefix for given prefix length.')
+
+        record = dict(type=rtype, network=network, via=None, dev=None, src=None,
+                      proto=opts.get('proto'), scope=opts.get('scope'),
+                      metric=_int(opts['metric'], 'metric') if 'metric' in opts else
+                      (1024 if family == 6 else 0),
+                      mtu=_int(opts['mtu'], 'mtu') if 'mtu' in opts else None,
+                      advmss=_int(opts['advmss'], 'advmss') if 'advmss' in opts else None,
+                      nhid=_int(opts['nhid'], 'nhid') if 'nhid' in opts else None,
+                      nexthops=[])
+        if 'via' in opts:
+            record['via'] = _address(opts['via'], family)
+        if 'dev' in opts:
+            record['dev'] = self._index(opts['dev'])
+        if 'src' in opts:
+            record['src'] = _address(opts['src'], family)
+        for hop in nexthops:
+            hopopts, garbage = _parse(hop, dict(via='via', dev='dev', weight='weight'),
+                                      flags=('onlink',))
+            if garbage:
+                raise Error(255, 'Error: either "to" is duplicate, or "{0}" is a garbage.'.format(garbage[0]))
+            record['nexthops'].append((
+                _address(hopopts['via'], family) if 'via' in hopopts else None,
+                self._index(hopopts['dev']) if 'dev' in hopopts else None,
+                _int(hopopts.get('weight', '1'), 'weight')))
+        table = self._table(opts.get('table', 'main'))
+        return family, table, (network, record['metric']), record, opts
+
+    def _route_add(self, family, tokens, replace=False, change=False):
+        family, table, key, record, _ = self._route_args(family, tokens)
+        if record['nhid'] is not None:
+            if record['nhid'] not in self.nexthops:
+                raise Error(2, 'Error: Nexthop id does not exist.')
+            if record['dev'] is not None or record['via'] is not None or record['nexthops']:
+                raise Error(2, 'Error: Nexthop specification and nexthop id are mutually exclusive.')
+        elif record['type'] == 'unicast' and record['dev'] is None and \
+                record['via'] is None and not record['nexthops']:
+            raise Error(2, 'Error: Device for nexthop is not specified.')
+        routes = self.routes[family].setdefault(table, RouteTable())
+        if key in routes and not (replace or change):
+            raise Error(2, 'RTNETLINK answers: File exists')
+        if key not in routes and change:
+            raise Error(2, 'RTNETLINK answers: No such file or directory')
+        routes[key] = record
+
+    def _route_replace(self, family, tokens):
+        self._route_add(family, tokens, replace=True)
+
+    def _route_change(self, family, tokens):
+        self._route_add(family, tokens, change=True)
+
+    def _route_del(self, family, tokens):
+        family, table, key, record, opts = self._route_args(family, tokens)
+        routes = self.routes[family].get(table, RouteTable())
+        candidates = [key] if 'metric' in opts else routes.keys_for(key[0])
+        for candidate in candidates:
+            route = routes.get(candidate)
+            if route is None:
+                continue
+            if record['via'] is not None and route['via'] != record['via']:
+                continue
+            if record['dev'] is not None and route['dev'] != record['dev']:
+                continue
+            del routes[candidate]
+            return
+        raise Error(2, 'RTNETLINK answers: No such process')
+
+    def _select_routes(self, family, tokens):
+        keys = dict(table='table', dev='dev', oif='dev', proto='proto', protocol='proto',
+                    via='via', type='type', scope='scope', exact='exact', root='root',
+                    match='match', to='exact')
+        opts, rest = _parse(tokens, keys)
+        if rest and rest[0] in ROUTE_TYPES:
+            opts['type'] = rest.pop(0)
+        if rest:
+            opts['exact'] = rest[0]
+        tablename = opts.get('table', 'main')
+        families = [family] if family else [4, 6]
+        dev = self._index(opts['dev']) if 'dev' in opts else None
+        selectors = [(k, _prefix(opts[k], family)) for k in ('exact', 'root', 'match') if k in opts]
+        for fam in families:
+            tables = self.routes[fam]
+            if tablename == 'all':
+                selected = list(tables.items())
+            else:
+                table = self._table(tablename)
+                selected = [(table, tables.get(table, {}))]
+            for table, routes in selected:
+                for key, route in list(routes.items()):
+                    if dev is not None:
+                        _, rdev, hops = self._resolve(route)
+                        if rdev != dev and dev not in [h[1] for h in hops]:
+                            continue
+                    if 'proto' in opts and route['proto'] != opts['proto']:
+                        continue
+                    if 'type' in opts and route['type'] != opts['type']:
+                        continue
+                    if 'via' in opts and str(route['via']) != opts['via']:
+                        continue
+                    if not all(self._route_matches(route['network'], kind, prefix)
+                               for kind, prefix in selectors):
+                        continue
+                    yield fam, table, key, route, tablename == 'all', dev is not None
+
+    @staticmethod
+    def _route_matches(network, kind, prefix):
+        if network.version != prefix.version:
+            return False
+        if kind == 'exact':
+            return network == prefix
+        if kind == 'root':
+            return network.prefixlen >= prefix.prefixlen and network.ip in prefix
+        return network.prefixlen <= prefix.prefixlen and prefix.ip in network
+
+    def _resolve(self, route):
+        """ Return (via, dev, nexthops) of route, following nhid if set. """
+        if route['nhid'] is None:
+            return route['via'], route['dev'], route['nexthops']
+        nexthop = self.nexthops[route['nhid']]
+        if nexthop['group']:
+            return None, None, [(self.nexthops[i]['via'], self.nexthops[i]['dev'], weight)
+                                for i, weight in nexthop['group']]
+        return nexthop['via'], nexthop['dev'], []
+
+    def _format_route(self, route, table=None, hidedev=False):
+        via, dev, nexthops = self._resolve(route)
+        parts = []
+        if route['type'] != 'unicast':
+            parts.append(route['type'])
+        parts.append(_show_prefix(route['network']))
+        if route['nhid'] is not None:
+            parts.extend(['nhid', str(route['nhid'])])
+        if via is not None:
+            parts.extend(['via', str(via)])
+        if dev is not None and not hidedev:
+            parts.extend(['dev', self.links[dev]['name']])
+        if table is not None and table != TABLES['main']:
+            parts.extend(['table', TABLE_NAMES.get(table, str(table))])
+        if route['proto'] not in (None, 'boot'):
+            parts.extend(['proto', route['proto']])
+        if route['scope'] not in (None, 'global', 'universe'):
+            parts.extend(['scope', route['scope']])
+        if route['src'] is not None:
+            parts.extend(['src', str(route['src'])])
+        if route['metric'] or route['network'].version == 6:
+            parts.extend(['metric', str(route['metric'])])
+        if route['mtu'] is not None:
+            parts.extend(['mtu', str(route['mtu'])])
+        if route['advmss'] is not None:
+            parts.extend(['advmss', str(route['advmss'])])
+        line = ' '.join(parts)
+        for via, dev, weight in nexthops:
+            hop = ['nexthop']
+            if via is not None:
+                hop.extend(['via', str(via)])
+            if dev is not None:
+                hop.extend(['dev', self.links[dev]['name']])
+            hop.extend(['weight', str(weight)])
+            line += ' \\    ' + ' '.join(hop)
+        return line
+
+    def _route_show(self, family, tokens, _stats):
+        return (self._format_route(route, table if showtable else None, hidedev)
+                for _, table, _, route, showtable, hidedev
+                in self._select_routes(family, tokens))
+
+    def _route_lookup(self, family, table, dst, oif):
+        """ Return longest matching route for dst in table, or None. """
+        routes = self.routes[family].get(table)
+        if routes is None:
+            return None
+        for candidates in routes.matching(dst):
+            if oif is not None:
+                candidates = [r for r in candidates if self._resolve(r)[1] == oif]
+            if candidates:
+                return min(candidates, key=lambda r: r['metric'])
+        return None
+
+    def _rule_matches(self, rule, dst, src, mark, iif):
+        match = (rule['src'] is None or (src is not None and src in rule['src'])) and \
+                (rule['dst'] is None or dst in rule['dst']) and \
+                (rule['fwmark'] is None or rule['fwmark'] == mark) and \
+                (rule['iif'] is None or rule['iif'] == iif)
+        return match != rule['_not']
+
+    def _primary(self, index, family):
+        """ Return first address of family on link, used as source. """
+        for addr in self.addresses.get(index, {}).values():
+            if addr['family'] == family:
+                return addr['local'].ip
+        return None
+
+    def _route_get(self, family, tokens):
+        keys = dict(to='to', iif='iif', oif='oif', dev='oif', mark='mark', fwmark='mark',
+                    tos='tos', dsfield='tos', vrf='vrf', uid='uid', ipproto='ipproto',
+                    sport='sport', dport='dport', **{'from': 'src'})
+        opts, rest = _parse(tokens, keys, flags=('connected', 'fibmatch'))
+        if 'to' in opts:
+            rest.insert(0, opts.pop('to'))
+        if len(rest) != 1:
+            raise Error(255, 'Command line is not complete. Try option "help"')
+        dst = _address(rest[0], family)
+        family = dst.version
+        src = _address(opts['src'], family) if 'src' in opts else None
+        mark = _int(opts['mark'], 'mark') if 'mark' in opts else None
+        oif = self._index(opts['oif']) if 'oif' in opts else None
+        parts = [str(dst)]
+        if src is not None:
+            parts.extend(['from', str(src)])
+
+        # addresses stand in for the local table.
+        if dst in self.locals:
+            parts.extend(['dev', 'lo'] if src is not None else ['dev', 'lo', 'src', str(dst)])
+            return ['local ' + ' '.join(parts) + ' uid 0 \\    cache <local> ']
+
+        for rule in self.rules[family]:
+            if self._rule_matches(rule, dst, src, mark, opts.get('iif')):
+                route = self._route_lookup(family, rule['table'], dst, oif)
+                if route is not None:
+                    break
+        else:
+            raise Error(2, 'RTNETLINK answers: Network is unreachable')
+        if route['type'] in ('unreachable', 'prohibit', 'blackhole'):
+            raise Error(2, {'unreachable': 'RTNETLINK answers: No route to host',
+                            'prohibit': 'RTNETLINK answers: Permission denied',
+                            'blackhole': 'RTNETLINK answers: Invalid argument'}[route['type']])
+
+        via, dev, nexthops = self._resolve(route)
+        if nexthops:
+            via, dev, _ = nexthops[0]
+        if via is not None:
+            parts.extend(['via', str(via)])
+        parts.extend(['dev', self.links[dev]['name']])
+        if src is None:
+            source = route['src'] or self._primary(dev, family)
+            if source is not None:
+                parts.extend(['src', str(source)])
+        if mark:
+            parts.extend(['mark', str(mark)])
+        return [' '.join(parts) + ' uid 0 \\    cache ']
+
+    def _route_flush(self, family, tokens):
+        if not tokens:
+            raise Error(255, '"ip route flush" requires arguments.')
+        for fam, table, key, _, _, _ in list(self._select_routes(family, tokens)):
+            del self.routes[fam][table][key]
+
+    # Nexthops
+
+    def _nexthop_args(self, family, tokens):
+        keys = dict(id='id', via='via', dev='dev', group='group', proto='proto',
+                    protocol='proto', type='type')
+        opts, rest = _parse(tokens, keys, flags=('blackhole', 'onlink', 'fdb'))
+        if rest:
+            raise Error(255, 'Error: either "to" is duplicate, or "{0}" is a garbage.'.format(rest[0]))
+        if 'id' in opts:
+            nhid = _int(opts['id'], 'id')
+        else:
+            nhid = max(self.nexthops or [0]) + 1
+        record = dict(id=nhid, via=None, dev=None, group=None, family=family,
+                      proto=opts.get('proto'), blackhole='blackhole' in opts,
+                      onlink='onlink' in opts, fdb='fdb' in opts)
+        if 'group' in opts:
+            record['group'] = []
+            for member in opts['group'].split('/'):
+                member, _, weight = member.partition(',')
+                member = _int(member, 'id')
+                if member not in self.nexthops or self.nexthops[member]['group']:
+                    raise Error(2, 'Error: Invalid nexthop id.')
+                record['group'].append((member, _int(weight or '1', 'weight')))
+            return record
+        if 'via' in opts:
+            record['via'] = _address(opts['via'], family)
+            record['family'] = record['via'].version
+        if 'dev' in opts:
+            record['dev'] = self._index(opts['dev'])
+        elif not record['blackhole'] and not record['fdb']:
+            raise Error(2, 'Error: Device attribute required for non-blackhole and non-fdb nexthops.')
+        return record
+
+    def _nexthop_add(self, family, tokens, replace=False):
+        record = self._nexthop_args(family, tokens)
+        if record['id'] in self.nexthops and not replace:
+            raise Error(2, 'Error: Nexthop id already exists.')
+        self.nexthops[record['id']] = record
+
+    def _nexthop_replace(self, family, tokens):
+        self._nexthop_add(family, tokens, replace=True)
+
+    def _drop_nexthop(self, nhid):
+        """ Remove nexthop along with routes using it, as the kernel does. """
+        self.nexthops.pop(nhid, None)
+        for table in self.routes.values():
+            for routes in table.values():
+                for key in [k for k, r in routes.items() if r['nhid'] == nhid]:
+                    del routes[key]
+        for other in list(self.nexthops.values()):
+            if other['group'] and nhid in [i for i, _ in other['group']]:
+                other['group'] = [(i, w) for i, w in other['group'] if i != nhid]
+                if not other['group']:
+                    self._drop_nexthop(other['id'])
+
+    def _nexthop_del(self, _family, tokens):
+        opts, _ = _parse(tokens, dict(id='id'))
+        if 'id' not in opts:
+            raise Error(255, 'Error: Nexthop id required.')
+        nhid = _int(opts['id'], 'id')
+        if nhid not in self.nexthops:
+            raise Error(2, 'Error: Nexthop id does not exist.')
+        self._drop_nexthop(nhid)
+
+    def _select_nexthops(self, family, tokens):
+        opts, _ = _parse(tokens, dict(id='id', dev='dev', proto='proto', protocol='proto'),
+                         flags=('groups',))
+        dev = self._index(opts['dev']) if 'dev' in opts else None
+        for nexthop in list(self.nexthops.values()):
+            if 'id' in opts and nexthop['id'] != _int(opts['id'], 'id'):
+                continue
+            if family and nexthop['family'] not in (None, family):
+                continue
+            if dev is not None and nexthop['dev'] != dev:
+                continue
+            if 'groups' in opts and not nexthop['group']:
+                continue
+            if 'proto' in opts and nexthop['proto'] != opts['proto']:
+                continue
+            yield nexthop
+
+    def _format_nexthop(self, nexthop):
+        parts = ['id', str(nexthop['id'])]
+        if nexthop['group']:
+            parts.extend(['group', '/'.join(str(i) if w == 1 else '{0},{1}'.format(i, w)
+                                            for i, w in nexthop['group'])])
+        if nexthop['via'] is not None:
+            parts.extend(['via', str(nexthop['via'])])
+        if nexthop['dev'] is not None:
+            parts.extend(['dev', self.links[nexthop['dev']]['name']])
+        for flag in ('blackhole', 'onlink'):
+            if nexthop[flag]:
+                parts.append(flag)
+        if nexthop['proto'] not in (None, 'boot'):
+            parts.extend(['proto', nexthop['proto']])
+        if nexthop['fdb']:
+            parts.append('fdb')
+        return ' '.join(parts)
+
+    def _nexthop_show(self, family, tokens, _stats):
+        return (self._format_nexthop(i) for i in self._select_nexthops(family, tokens))
+
+    def _nexthop_flush(self, family, tokens):
+        for nexthop in list(self._select_nexthops(family, tokens)):
+            self._drop_nexthop(nexthop['id'])
+
+    # Rules
+
+    def _rule_args(self, family, tokens):
+        keys = dict(pref='pref', priority='pref', preference='pref', order='pref',
+                    lookup='table', table='table', fwmark='fwmark', iif='iif', dev='iif',
+                    to='dst', **{'from': 'src'})
+        opts, rest = _parse(tokens, keys, flags=('not',))
+        if rest:
+            raise Error(255, 'Error: argument "{0}" is wrong: Failed to parse rule type'.format(rest[0]))
+        family = family or 4
+        record = dict(_not='not' in opts, pref=None, table=None, fwmark=None,
+                      iif=opts.get('iif'), src=None, dst=None)
+        if 'pref' in opts:
+            record['pref'] = _int(opts['pref'], 'preference')
+        if 'table' in opts:
+            record['table'] = self._table(opts['table'])
+        if 'fwmark' in opts:
+            record['fwmark'] = _int(opts['fwmark'], 'fwmark')
+        for key in ('src', 'dst'):
+            if key in opts:
+                prefix = _prefix(opts[key], family)
+                record[key] = None if prefix.prefixlen == 0 else prefix
+        return family, record, opts
+
+    def _rule_add(self, family, tokens):
+        family, record, _ = self._rule_args(family, tokens)
+        rules = self.rules[family]
+        if record['table'] is None:
+            record['table'] = TABLES['main']
+        if record['pref'] is None:
+            prefs = [r['pref'] for r in rules if r['pref']]
+            record['pref'] = min(prefs) - 1 if prefs else 0
+        if record in rules:
+            raise Error(2, 'RTNETLINK answers: File exists')
+        rules.append(record)
+        rules.sort(key=lambda r: r['pref'])
+
+    def _rule_del(self, family, tokens):
+        family, record, opts = self._rule_args(family, tokens)
+        rules = self.rules[family]
+        given = dict((k, v) for k, v in record.items()
+                     if v is not None and (k != '_not' or 'not' in opts))
+        for idx, rule in enumerate(rules):
+            if all(rule[k] == v for k, v in given.items()):
+                del rules[idx]
+                return
+        raise Error(2, 'RTNETLINK answers: No such file or directory')
+
+    @staticmethod
+    def _format_rule(rule):
+        parts = ['{0}:\t{1}from'.format(rule['pref'], 'not ' if rule['_not'] else ''),
+                 str(rule['src']) if rule['src'] is not None else 'all']
+        if rule['dst'] is not None:
+            parts.extend(['to', str(rule['dst'])])
+        if rule['fwmark'] is not None:
+            parts.extend(['fwmark', hex(rule['fwmark'])])
+        if rule['iif'] is not None:
+            parts.extend(['iif', rule['iif']])
+        parts.extend(['lookup', TABLE_NAMES.get(rule['table'], str(rule['table']))])
+        return ' '.join(parts)
+
+    def _rule_show(self, family, _tokens, _stats):
+        families = [family] if family else [4, 6]
+        return (self._format_rule(r) for f in families for r in list(self.rules[f]))
+
+    # Neighbors
+
+    def _neigh_args(self, family, tokens):
+        keys = dict(lladdr='lladdr', nud='nud', dev='dev', to='to')
+        opts, rest = _parse(tokens, keys, flags=('proxy', 'router'))
+        if rest and 'to' not in opts:
+            opts['to'] = rest.pop(0)
+        if 'to' not in opts or 'dev' not in opts:
+            raise Error(255, 'Device and destination are required arguments.')
+        addr = _address(opts['to'], family)
+        return (addr.version, addr, self._index(opts['dev'])), opts
+
+    def _neigh_add(self, family, tokens, replace=False, change=False):
+        key, opts = self._neigh_args(family, tokens)
+        if key in self.neighbors and not (replace or change):
+            raise Error(2, 'RTNETLINK answers: File exists')
+        if key not in self.neighbors and change:
+            raise Error(2, 'RTNETLINK answers: No such file or directory')
+        lladdr = opts.get('lladdr')
+        self.neighbors[key] = dict(lladdr=lladdr.lower() if lladdr else None,
+                                   nud=opts.get('nud', 'permanent').upper(),
+                                   router='router' in opts)
+
+    def _neigh_replace(self, family, tokens):
+        self._neigh_add(family, tokens, replace=True)
+
+    def _neigh_change(self, family, tokens):
+        self._neigh_add(family, tokens, change=True)
+
+    def _neigh_del(self, family, tokens):
+        key, _ = self._neigh_args(family, tokens)
+        if self.neighbors.pop(key, None) is None:
+            raise Error(2, 'RTNETLINK answers: No such file or directory')
+
+    def _select_neighs(self, family, tokens):
+        opts, rest = _parse(tokens, dict(dev='dev', nud='nud', to='to'))
+        if rest:
+            opts['to'] = rest[0]
+        dev = self._index(opts['dev']) if 'dev' in opts else None
+        to = _prefix(opts['to'], family) if 'to' in opts else None
+        nud = opts['nud'].upper() if 'nud' in opts and opts['nud'] != 'all' else None
+        for key, neigh in list(self.neighbors.items()):
+            if family and key[0] != family:
+                continue
+            if dev is not None and key[2] != dev:
+                continue
+            if to is not None and key[1] not in to:
+                continue
+            if nud is not None and neigh['nud'] != nud:
+                continue
+            yield key, neigh, dev is not None
+
+    def _format_neigh(self, key, neigh, hidedev):
+        parts = [str(key[1])]
+        if not hidedev:
+            parts.extend(['dev', self.links[key[2]]['name']])
+        if neigh['lladdr']:
+            parts.extend(['lladdr', neigh['lladdr']])
+        if neigh['router']:
+            parts.append('router')
+        parts.append(neigh['nud'])
+        return ' '.join(parts)
+
+    def _neigh_show(self, family, tokens, _stats):
+        return (self._format_neigh(*i) for i in self._select_neighs(family, tokens))
+
+    def _neigh_flush(self, family, tokens):
+        if not tokens:
+            raise Error(1, 'Flush requires arguments.')
+        for key, _, _ in list(self._select_neighs(family, tokens)):
+            del self.neighbors[key]
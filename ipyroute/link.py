@@ -2,15 +2,27 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
-import re
+import array
+import sys
+import time
+
 
 from ipyroute import base
 from .address import Address
 from .neighbor import Neighbor
 
+# Counters reported by `ip -s link`, in the order they are stored by LinkSampler.
+STATS = ('rx_bytes', 'rx_packets', 'rx_errors', 'rx_dropped',
+         'tx_bytes', 'tx_packets', 'tx_errors', 'tx_dropped')
+
+# Matches the RX and TX blocks, skipping header names which vary across versions.
+_STATS = base.LazyRegex(r'\\\s+RX:[^\\]*\\\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d+)[^\\]*'
+                    r'\\\s+TX:[^\\]*\\\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d+)')
+
+
 class Link(base.Base):
     """ Interact with `ip link`. """
-    regex = re.compile(r'(?P<num>\d+): '
+    regex = base.LazyRegex(r'(?P<num>\d+): '
                        r'(?P<name>\S+?)(@(?P<phy>\S+))?: '
                        r'<(?P<flags>\S+)> '
                        r'(mtu (?P<mtu>\d+)\s*)?'
@@ -31,14 +43,24 @@ class Link(base.Base):
                        'ALLMULTI', 'NOARP', 'DYNAMIC'])
     _validassoc = set(['MASTER', 'SLAVE'])
 
+    @staticmethod
+    def _unwind(*args, **kwargs):
+        """ As Base._unwind, but stats=True requests counters with `-s`. """
+        stats = ('-s',) if kwargs.pop('stats', False) else ()
+        return stats + base.Base._unwind(*args, **kwargs)
+
     @classmethod
     def _get(cls, *args):
         # We load link in IPR class at runtime.
         # pylint: disable=no-member
+        cmd = base.IPR.link
+        if args[:1] == ('-s',):
+            cmd, args = cmd.bake('-s'), args[1:]
         try:
-            return base.IPR.link.link.show(*args)
+            for line in base.stream(cmd.link.show, *args):
+                yield line
         except base.ErrorReturnCode:
-            return []
+            return
 
     def __getattr__(self, name):
         if name == 'group':
@@ -50,6 +72,14 @@ class Link(base.Base):
             return name[3:].upper() in self.flags
         super(Link, self).__getattr__(name)
 
+    @base.classproperty
+    def _monitor(cls):
+        # pylint: disable=no-member
+        return base.IPR.link.monitor.link
+
+    def _key(self):
+        return self.num
+
     @base.classproperty
     def cmd(cls):
         # We load root in IPR class at runtime.
@@ -80,8 +110,100 @@ class Link(base.Base):
         order = ()
         return self.shwrap(func, order)
 
+    # Options accepted by `ip link add` itself; other spec keys follow `type`.
+    _addopts = ('link', 'mtu', 'address', 'group', 'txqueuelen')
+    # Options applied with `ip link set` once links exist. netns is left out:
+    # it moves the link away, so it goes in a line of its own after these,
+    # together with up since the move takes the link down.
+    _setopts = ('master', 'nomaster', 'mtu', 'address', 'group', 'txqueuelen',
+                'alias', 'name', 'up')
+
+    @classmethod
+    def _set_lines(cls, name, settings):
+        """ Yield `link set` batch lines for settings, moving the link to
+            another namespace last.
+        """
+        netns = settings.get('netns')
+        args = ['link', 'set', 'dev', str(name)]
+        for key in cls._setopts:
+            value = settings.get(key)
+            if value is None or key == 'up' and netns is not None:
+                continue
+            if key == 'up':
+                args.append('up' if value else 'down')
+            elif isinstance(value, bool):
+                if value:
+                    args.append(key)
+            else:
+                args.extend((key, str(value)))
+        if len(args) > 4:
+            yield ' '.join(args)
+        if netns is not None:
+            args = ['link', 'set', 'dev', str(settings.get('name', name)), 'netns', str(netns)]
+            if settings.get('up') is not None:
+                args.append('up' if settings['up'] else 'down')
+            yield ' '.join(args)
+
+    @classmethod
+    def _add_lines(cls, spec):
+        """ Yield batch lines creating the link described by spec. """
+        spec = dict(spec)
+        name, kind = spec.pop('name'), spec.pop('type')
+        args = ['link', 'add']
+        for key in cls._addopts:
+            if spec.get(key) is not None:
+                args.extend((key, str(spec.pop(key))))
+        args.extend(('name', str(name), 'type', str(kind)))
+        peer = spec.pop('peer', None)
+        if peer is not None:
+            args.extend(('peer', 'name', str(peer)))
+        # master and up are only settable once the link exists, and netns
+        # must come after them since the link leaves this namespace.
+        settings = dict((k, spec.pop(k)) for k in ('master', 'up', 'alias', 'netns') if k in spec)
+        for key, value in sorted(spec.items()):
+            args.extend((key, str(value)))
+        yield ' '.join(args)
+        for line in cls._set_lines(name, settings):
+            yield line
+
+    @classmethod
+    def _provision(cls, lines, names, force):
+        cls.cache.clear()
+        try:
+            base.batch(base.IPR.root, lines, force, cls.timeout)
+        finally:
+            cls.cache.clear()
+        links = dict((i.name, i) for i in cls.get())
+        return [links[i] for i in names if i in links]
+
+    @classmethod
+    def add_many(cls, specs, force=False):
+        """ Create links in a single `ip -batch` run, and return them from
+            one dump afterwards. Each spec is a dict with name and type, plus
+            any of link, mtu, address, group, txqueuelen, netns, master and
+            up; veth peers are named with peer, and any other keys are passed
+            after type, e.g. dict(name='eth0.100', type='vlan', link='eth0',
+            id=100, up=True). Links moved to another namespace are not
+            returned.
+        """
+        specs = list(specs)
+        lines = [line for spec in specs for line in cls._add_lines(spec)]
+        return cls._provision(lines, [i['name'] for i in specs], force)
+
+    @classmethod
+    def set_many(cls, changes, force=False):
+        """ Apply settings to many links in a single `ip -batch` run, and
+            return them from one dump afterwards. changes maps link names to
+            dicts of settings (or is a list of such pairs), any of master, nomaster, mtu, address, group,
+            txqueuelen, alias, name (to rename), netns and up.
+        """
+        changes = list(changes.items() if hasattr(changes, 'items') else changes)
+        lines = [line for name, settings in changes for line in cls._set_lines(name, settings)]
+        names = [settings.get('name', name) for name, settings in changes]
+        return cls._provision(lines, names, force)
+
     @classmethod
-    def construct(cls, result, _, *args):
+    def construct(cls, result, ipstr, *args):
         _cls = cls
         if 'group' in args:
             idx = args.index('group')
@@ -91,6 +213,10 @@ class Link(base.Base):
             _cls = EtherLink
         elif linktype == 'gre':
             _cls = GRELink
+        if '-s' in args:
+            match = _STATS.search(ipstr)
+            if match:
+                result.update(zip(STATS, (int(i) for i in match.groups())))
         return _cls(**result)
 
     @property
@@ -147,8 +273,138 @@ class Link(base.Base):
         self._mod_neighbor(Neighbor.change, *args)
 
 class EtherLink(Link):
-    casts = dict(addr=base.EUI, brd=base.EUI, **Link.casts)
+    casts = dict(addr=base.to_eui, brd=base.to_eui, **Link.casts)
 
 class GRELink(Link):
-    casts = dict(addr=base.IPAddress, brd=base.IPAddress, **Link.casts)
+    casts = dict(addr=base.to_addr, brd=base.to_addr, **Link.casts)
+
+
+
+# array('Q') is unavailable before Python 3.3.
+_COUNTER = 'Q' if sys.version_info >= (3, 3) else 'L'
+
+
+class LinkSampler(object):
+    """ Sample link counters from a single `ip -s link` dump per interval and
+        compute per-interface deltas and rates.
+
+        Counters, deltas and rates are kept in flat arrays allocated up front,
+        indexed by slot * len(STATS) + field, so sampling thousands of links
+        allocates no per-link objects beyond the parsed lines. A counter that
+        goes backwards is assumed to have wrapped at 2**width, unless the
+        wrapped delta is implausibly large, in which case the counter was
+        reset and the new value is taken as the delta.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, interval=1.0, maxlinks=4096, width=64):
+        self.interval = interval
+        self.maxlinks = maxlinks
+        self._wrap = 1 << width
+        size = maxlinks * len(STATS)
+        self.counters = array.array(_COUNTER, [0]) * size
+        self.deltas = array.array(_COUNTER, [0]) * size
+        self.rates = array.array('d', [0.0]) * size
+        self._slots = {}        # ifindex -> slot
+        self._names = {}        # name -> ifindex
+        self._free = list(range(maxlinks - 1, -1, -1))
+        self._last = None
+        self._clock = getattr(time, 'monotonic', time.time)
+
+    def _slot(self, num, name):
+        """ Return slot for ifindex, and whether it is new. """
+        slot = self._slots.get(num)
+        if slot is not None:
+            return slot, False
+        if not self._free:
+            raise ValueError("More than {0} links to sample".format(self.maxlinks))
+        slot = self._slots[num] = self._free.pop()
+        self._names[name] = num
+        return slot, True
+
+    def sample(self):
+        """ Take one sample. Returns seconds elapsed since the previous one,
+            or None for the first sample, which only primes counters.
+        """
+        now = self._clock()
+        elapsed = None if self._last is None else now - self._last
+        self._last = now
+
+        width = len(STATS)
+        wrap, half = self._wrap, self._wrap >> 1
+        counters, deltas, rates = self.counters, self.deltas, self.rates
+        seen = set()
+        # pylint: disable=protected-access
+        for line in Link._get('-s'):
+            num, name, _ = line.split(': ', 2)
+            match = _STATS.search(line)
+            if not match:
+                continue
+            num, name = int(num), name.partition('@')[0]
+            if self._names.get(name, num) != num:
+                # name moved to a new ifindex, forget the old one.
+                self._release(self._names[name])
+            slot, new = self._slot(num, name)
+            self._names[name] = num
+            seen.add(num)
+            base_ = slot * width
+            for i, value in enumerate(match.groups()):
+                value, idx = int(value), base_ + i
+                delta = 0
+                if not new and elapsed is not None:
+                    delta = value - counters[idx]
+                    if delta < 0:
+                        delta += wrap
+                        if delta > half:
+                            delta = value
+                deltas[idx] = delta
+                rates[idx] = delta / elapsed if elapsed else 0.0
+                counters[idx] = value % wrap
+
+        for num in set(self._slots) - seen:
+            self._release(num)
+        return elapsed
+
+    def _release(self, num):
+        slot = self._slots.pop(num)
+        for name, idx in list(self._names.items()):
+            if idx == num:
+                del self._names[name]
+        width = len(STATS)
+        for idx in range(slot * width, (slot + 1) * width):
+            self.counters[idx] = self.deltas[idx] = 0
+            self.rates[idx] = 0.0
+        self._free.append(slot)
+
+    def _index(self, link, field):
+        num = self._names[link] if isinstance(link, base.string_types) else getattr(link, 'num', link)
+        return self._slots[num] * len(STATS) + STATS.index(field)
+
+    def rate(self, link, field='rx_bytes'):
+        """ Return per-second rate of field over the last interval. Links may
+            be given by name, ifindex or Link object.
+        """
+        return self.rates[self._index(link, field)]
+
+    def delta(self, link, field='rx_bytes'):
+        """ Return change in field over the last interval. """
+        return self.deltas[self._index(link, field)]
+
+    def links(self):
+        """ Return mapping of sampled link names to ifindex. """
+        return dict(self._names)
 
+    def __iter__(self):
+        """ Sample every interval, yielding elapsed time after each sample.
+            Sampling is scheduled on a fixed grid so slow dumps do not drift.
+        """
+        self.sample()
+        deadline = self._clock()
+        while True:
+            deadline += self.interval
+            delay = deadline - self._clock()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # fell behind, restart grid rather than sampling back to back.
+                deadline = self._clock()
+            yield self.sample()
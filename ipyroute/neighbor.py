@@ -1,15 +1,17 @@
 """ Manage neighbors. """
 # -*- coding: utf-8 -*-
-import re
 from ipyroute import base
 
 class Neighbor(base.Base):
-    regex = re.compile(r'(?P<ipaddr>[0-9a-f.:]+) '
+    regex = base.LazyRegex(r'(?P<ipaddr>[0-9a-f.:]+) '
                         '(dev (?P<ifname>\S+)\s+)?'
                         '(lladdr (?P<ifaddr>[0-9a-f.:]+)\s+)?'
                         '(router)?\s*(?P<nud>\S+)')
 
-    casts = dict(ipaddr=base.IPAddress, ifaddr=base.EUI)
+    casts = dict(ipaddr=base.to_addr,
+                 ifaddr=base.intern_eui,
+                 ifname=base.intern_text,
+                 nud=base.intern_text)
     _validnuds = set(['REACHABLE', 'STALE', 'PERMANENT', 'FAILED'])
     _order = ('lladdr', 'nud', 'proxy', 'dev')
 
@@ -18,9 +20,9 @@ class Neighbor(base.Base):
         """ Return neighbors. """
         for version in (base.IPR.ipv4, base.IPR.ipv6):
             try:
-                for line in version.neigh.show(*args):
+                for line in base.stream(version.neigh.show, *args):
                     yield line
-            except:
+            except base.ErrorReturnCode:
                 pass
 
     def __getattr__(self, name):
@@ -29,6 +31,14 @@ class Neighbor(base.Base):
             return name.upper() == self.nud
         super(Neighbor, self).__getattr__(name)
 
+    @base.classproperty
+    def _monitor(cls):
+        # pylint: disable=no-member
+        return base.IPR.root.monitor.neigh
+
+    def _key(self):
+        return (self.ipaddr, self.ifname)
+
     @base.classproperty
     def cmd(cls):
         # We load root in IPR class at runtime.
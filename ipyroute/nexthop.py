@@ -0,0 +1,116 @@
+""" Manage kernel nexthop objects. """
+
+from ipyroute import base
+from .route import Route4, Route6
+
+class NexthopObject(base.Base):
+    """ Interact with `ip nexthop`. Routes installed with `nhid` resolve their
+        forwarding through these objects, so replacing one nexthop or group
+        moves every route using it in a single operation.
+    """
+    regex = base.LazyRegex(r'id (?P<id>\d+)\s+'
+                       r'(group (?P<group>\S+)\s*)?'
+                       r'(type (?P<grouptype>\S+)\s*)?'
+                       r'(via (?P<via>\S+)\s*)?'
+                       r'(dev (?P<dev>\S+)\s*)?'
+                       r'(scope (?P<scope>\S+)\s*)?'
+                       r'(?P<blackhole>blackhole\s*)?'
+                       r'(?P<onlink>onlink\s*)?'
+                       r'(proto (?P<proto>\S+)\s*)?'
+                       r'(?P<fdb>fdb)?')
+
+    casts = dict(id=int,
+                 via=base.intern_addr,
+                 dev=base.intern_text,
+                 proto=base.intern_text,
+                 blackhole=bool,
+                 onlink=bool,
+                 fdb=bool)
+
+    _order = ('id', 'group', 'type', 'via', 'dev', 'blackhole', 'onlink', 'proto', 'fdb')
+
+    @classmethod
+    def _get(cls, *args):
+        for line in base.stream(cls.cmd.show, *args):
+            yield line
+
+    @base.classproperty
+    def cmd(cls):
+        # We load root in IPR class at runtime.
+        # pylint: disable=no-member
+        return base.IPR.root.nexthop
+
+    @base.classproperty
+    def _monitor(cls):
+        # pylint: disable=no-member
+        return base.IPR.root.monitor.nexthop
+
+    def _key(self):
+        return self.id
+
+    @classmethod
+    def construct(cls, result, _, *args):
+        _cls = NexthopGroup if result.get('group') else NexthopObject
+        return _cls(**result)
+
+    @classmethod
+    def _modify(cls, func, nhid, **kwargs):
+        # Routes referring to nexthops print their resolved gateways.
+        for klass in (cls, Route4, Route6):
+            klass.cache.clear()
+        kwargs = dict((k, v) for k, v in kwargs.items() if v is not None and v is not False)
+        return cls.shwrap(func, cls._order)(id=nhid, **kwargs)
+
+    @classmethod
+    def add(cls, nhid, **kwargs):
+        """ Add command for nexthop. """
+        return cls._modify(cls.cmd.add, nhid, **kwargs)
+
+    @classmethod
+    def replace(cls, nhid, **kwargs):
+        """ Replace command for nexthop. """
+        return cls._modify(cls.cmd.replace, nhid, **kwargs)
+
+    @classmethod
+    def delete(cls, nhid):
+        """ Delete command for nexthop. Routes using it are removed by the kernel. """
+        return cls._modify(getattr(cls.cmd, 'del'), nhid)
+
+    def __hash__(self):
+        return self.id
+
+
+class NexthopGroup(NexthopObject):
+    """ Nexthop object holding a weighted set of other nexthop objects. """
+
+    @classmethod
+    def _get(cls, *args):
+        for line in base.stream(cls.cmd.show, 'groups', *args):
+            yield line
+
+    @staticmethod
+    def _convert_members(members):
+        """ Convert list of ids, (id, weight) tuples or objects into group spec. """
+        spec = []
+        for member in members:
+            weight = 1
+            if isinstance(member, (list, tuple)):
+                member, weight = member
+            member = getattr(member, 'id', member)
+            spec.append(str(member) if weight == 1 else '{0},{1}'.format(member, weight))
+        return '/'.join(spec)
+
+    @classmethod
+    def _modify(cls, func, nhid, **kwargs):
+        if 'members' in kwargs:
+            kwargs['group'] = cls._convert_members(kwargs.pop('members'))
+        return super(NexthopGroup, cls)._modify(func, nhid, **kwargs)
+
+    @property
+    def members(self):
+        """ Return list of (id, weight) tuples. """
+        members = []
+        for member in self.group.split('/'):
+            nhid, _, weight = member.partition(',')
+            members.append((int(nhid), int(weight) if weight else 1))
+        return members
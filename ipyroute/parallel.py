@@ -0,0 +1,105 @@
+""" Parse large dumps in a pool of worker processes. """
+# -*- coding: utf-8 -*-
+import multiprocessing
+
+import netaddr
+
+from ipyroute import base
+
+# Tags for packed values. Objects cross the process boundary as tuples of
+# plain ints and strings, which pickle far smaller and faster than netaddr
+# objects and let the parent share identical values between records.
+_ADDR, _NET, _EUI, _OBJ, _TUPLE, _LIST = range(6)
+
+
+def pack(value):
+    """ Convert parsed value into nested tuples of builtin types. """
+    if isinstance(value, netaddr.IPNetwork):
+        return (_NET, value.value, value.prefixlen, value.version)
+    if isinstance(value, netaddr.IPAddress):
+        return (_ADDR, value.value, value.version)
+    if isinstance(value, netaddr.EUI):
+        return (_EUI, int(value))
+    if isinstance(value, base.Base):
+        return (_OBJ, type(value), tuple((k, pack(v)) for k, v in value.__dict__.items()))
+    if isinstance(value, tuple):
+        return (_TUPLE, tuple(pack(i) for i in value))
+    if isinstance(value, list):
+        return (_LIST, tuple(pack(i) for i in value))
+    return value
+
+
+def unpack(value, memo):
+    """ Rebuild value from pack. Equal addresses and strings are shared
+        through memo; shared addresses are frozen, and networks, which netaddr
+        lets change in place, are never shared.
+    """
+    if not isinstance(value, tuple):
+        return memo.setdefault(value, value) if isinstance(value, base.string_types) else value
+    tag = value[0]
+    if tag == _OBJ:
+        obj = object.__new__(value[1])
+        obj.__dict__.update((k, unpack(v, memo)) for k, v in value[2])
+        return obj.freeze()
+    if tag == _TUPLE:
+        return tuple(unpack(i, memo) for i in value[1])
+    if tag == _LIST:
+        return [unpack(i, memo) for i in value[1]]
+    if tag == _NET:
+        return netaddr.IPNetwork((value[1], value[2]), version=value[3])
+    cached = memo.get(value)
+    if cached is None:
+        if tag == _ADDR:
+            cached = base.FrozenIPAddress(value[1], value[2])
+        else:
+            cached = base.FrozenEUI(value[1], dialect=netaddr.mac_unix_expanded)
+        memo[value] = cached
+    return cached
+
+
+def _parse_chunk(task):
+    """ Worker side: parse chunk of lines into packed objects. """
+    cls, args, lines = task
+    return [pack(cls.from_string(line, *args)) for line in lines]
+
+
+class Parallel(object):
+    """ Process pool used by Base.get for dumps of at least threshold lines.
+
+        Output is split into chunks of chunksize lines, parsed by workers and
+        reassembled in output order. Smaller dumps are parsed in-process,
+        since forking work out only pays off for large tables.
+    """
+    def __init__(self, workers=None, threshold=100000, chunksize=10000):
+        self.workers = workers
+        self.threshold = threshold
+        self.chunksize = chunksize
+        self._pool = None
+
+    @property
+    def pool(self):
+        """ Process pool, started on first use. """
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+        return self._pool
+
+    def parse(self, cls, args, lines):
+        """ Yield objects parsed from list of lines, in order. """
+        if len(lines) < self.threshold:
+            for line in lines:
+                yield cls.from_string(line, *args).freeze()
+            return
+
+        size = self.chunksize
+        tasks = ((cls, args, lines[i:i + size]) for i in range(0, len(lines), size))
+        memo = {}
+        for chunk in self.pool.imap(_parse_chunk, tasks):
+            for item in chunk:
+                yield unpack(item, memo)
+
+    def close(self):
+        """ Shut down worker processes. """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -1,15 +1,111 @@
 """ Lookup rules """
+import collections
 import functools
-import re
-import six
+import threading
+import time
 from ipyroute import base
 
+# Keywords in `ip route show` output which are followed by a value.
+_VALUED = frozenset(('via', 'dev', 'proto', 'scope', 'src', 'metric', 'table', 'mtu',
+                     'advmss', 'nhid', 'pref', 'expires', 'error', 'realm', 'realms',
+                     'window', 'rtt', 'rttvar', 'rto_min', 'ssthresh', 'cwnd', 'initcwnd',
+                     'initrwnd', 'hoplimit', 'features', 'congctl', 'weight', 'from',
+                     'tos', 'quickack', 'reordering', 'fastopen_no_cookie'))
+# Keywords which describe kernel state and are not accepted by `ip route add`.
+_STATE = frozenset(('table', 'expires', 'error', 'cache', 'linkdown', 'dead', 'offload',
+                    'trap', 'offload_failed', 'rt_offload', 'rt_trap', 'rt_offload_failed'))
+
+CloneProgress = collections.namedtuple('CloneProgress', 'routes skipped elapsed rate')
+
+# Aliases for `ip route get` selectors passed to Route.resolve.
+_SELECTORS = {'from_': 'from', 'fwmark': 'mark'}
+# Keywords `ip route get` accepts after the destination, bar fibmatch, which
+# prints the matching prefix rather than the destination.
+_GET_KEYS = frozenset(['from', 'iif', 'oif', 'mark', 'tos', 'dsfield', 'vrf', 'uid',
+                       'ipproto', 'sport', 'dport', 'connected'])
+_MISSING = object()
+
+
+class ResolveMemo(object):
+    """ Routes returned by Route.resolve, per destination and context.
+
+        Entries are dropped whenever the cache of the route class, or of the
+        address, link, rule and nexthop classes, is cleared, which every
+        change made through ipyroute does: addresses and links also decide
+        the source, connected and local routes. With follow, `ip monitor
+        route` also drops them on route changes made elsewhere, which include
+        those caused by address and link changes. At most maxsize entries are
+        kept, oldest dropped first.
+    """
+    def __init__(self, cls, maxsize=1 << 16, follow=False):
+        from ipyroute import address, link, nexthop, rule
+        self.cls = cls
+        self.maxsize = maxsize
+        self._classes = (cls, address.Address, link.Link, rule.Rule, rule.Rule4, rule.Rule6,
+                         nexthop.NexthopObject)
+        self._routes = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = self._current()
+        self._watcher = None
+        if follow:
+            self._watcher = cls.watch(batch_size=1, batch_latency=0)
+            thread = threading.Thread(target=self._follow)
+            thread.daemon = True
+            thread.start()
+
+    def _follow(self):
+        for _ in self._watcher:
+            self.clear()
+
+    def _current(self):
+        return tuple(i.cache.generation for i in self._classes)
+
+    def _check(self):
+        generation = self._current()
+        if generation != self._generation:
+            self._routes.clear()
+            self._generation = generation
+        return generation
+
+    def generation(self):
+        """ Return current generation, dropping entries if it changed. """
+        with self._lock:
+            return self._check()
+
+    def lookup(self, key, default=None):
+        """ Return route stored for key, which may be None if unresolvable. """
+        with self._lock:
+            self._check()
+            return self._routes.get(key, default)
+
+    def store(self, key, route, generation):
+        """ Store route for key unless routes changed since generation. """
+        with self._lock:
+            if self._check() != generation:
+                return
+            self._routes[key] = route
+            while len(self._routes) > self.maxsize:
+                self._routes.popitem(last=False)
+
+    def __len__(self):
+        return len(self._routes)
+
+    def clear(self):
+        """ Drop all entries. """
+        with self._lock:
+            self._routes.clear()
+
+    def close(self):
+        """ Stop following changes. """
+        if self._watcher is not None:
+            self._watcher.close()
+
 class Nexthop(base.Base):
-    regex = re.compile(r'nexthop via (?P<via>\S+)\s+'
+    regex = base.LazyRegex(r'nexthop via (?P<via>\S+)\s+'
                        r'dev (?P<dev>\S+) '
                        r'weight (?P<weight>\d+)')
-    casts = dict(via=base.IPAddress,
-                 dev=unicode if not six.PY3 else lambda x: x,
+    casts = dict(via=base.intern_addr,
+                 dev=base.intern_text,
                  weight=int)
 
 
@@ -24,8 +120,9 @@ class Route(base.Base):
              'blackhole',
              'nat')
 
-    regex = re.compile(r'((?P<type>('+'|'.join(types)+'))\s+)?'
+    regex = base.LazyRegex(r'((?P<type>('+'|'.join(types)+'))\s+)?'
                        r'(?P<network>\S+)\s+'
+                       r'(nhid (?P<nhid>\d+)\s*)?'
                        r'(via (?P<via>\S+)\s*)?'
                        r'(dev (?P<dev>\S+)\s*)?'
                        r'(proto (?P<proto>\S+)\s*)?'
@@ -35,17 +132,20 @@ class Route(base.Base):
                        r'(advmss (?P<advmss>\d+)\s*)?'
                        r'(error (?P<error>-?\d+)\s*)?')
 
-    casts = dict(network=base.IPNetwork,
-                 src=base.IPAddress,
-                 via=base.IPAddress,
+    casts = dict(network=base.to_network,
+                 src=base.intern_addr,
+                 via=base.intern_addr,
+                 dev=base.intern_text,
+                 proto=base.intern_text,
                  metric=int,
+                 nhid=int,
                  mtu=int,
                  advmss=int,
                  error=int)
 
     @classmethod
     def _get(cls, *args):
-        for line in cls.cmd.show(*args):
+        for line in base.stream(cls.cmd.show, *args):
             yield line
 
     @base.classproperty
@@ -54,39 +154,224 @@ class Route(base.Base):
         return cls.shwrap(cls.cmd.flush, ('table', 'label'))
 
 
+    _order = ('table', 'nhid', 'src', 'advmss', 'mtu', '')
+
     @classmethod
-    def add(cls, network, **kwargs):
-        """ Add command for route. """
+    def _modify(cls, func, network, **kwargs):
         cls.cache.clear()
-        kwargs = dict((k, v) for k, v in kwargs.items() if v is not None)
         if 'nexthops' in kwargs:
             kwargs[''] = cls._convert_nexthops(kwargs.pop('nexthops'))
-        func = cls.shwrap(cls.cmd.add, ('table', 'src', 'advmss', 'mtu', ''))
+        if 'nhid' in kwargs:
+            # accept nexthop objects as well as plain ids.
+            kwargs['nhid'] = getattr(kwargs['nhid'], 'id', kwargs['nhid'])
+        func = cls.shwrap(func, cls._order)
         if 'type' in kwargs:
             func = functools.partial(func, kwargs.pop('type'))
         return func(network, **kwargs)
 
+    @classmethod
+    def add(cls, network, **kwargs):
+        """ Add command for route. """
+        kwargs = dict((k, v) for k, v in kwargs.items() if v is not None)
+        return cls._modify(cls.cmd.add, network, **kwargs)
+
     @classmethod
     def delete(cls, network, **kwargs):
         """ Add command for route. """
-        cls.cache.clear()
-        if 'nexthops' in kwargs:
-            kwargs[''] = cls._convert_nexthops(kwargs.pop('nexthops'))
-        func = cls.shwrap(cls.cmd.delete, ('table', 'src', 'advmss', 'mtu', ''))
-        if 'type' in kwargs:
-            func = functools.partial(func, kwargs.pop('type'))
-        return func(network, **kwargs)
+        return cls._modify(cls.cmd.delete, network, **kwargs)
 
     @classmethod
     def replace(cls, network, **kwargs):
         """ Replace command for route. """
-        cls.cache.clear()
-        if 'nexthops' in kwargs:
-            kwargs[''] = cls._convert_nexthops(kwargs.pop('nexthops'))
-        func = cls.shwrap(cls.cmd.replace, ('table', 'src', 'advmss', 'mtu', ''))
-        if 'type' in kwargs:
-            func = functools.partial(func, kwargs.pop('type'))
-        return func(network, **kwargs)
+        return cls._modify(cls.cmd.replace, network, **kwargs)
+
+    @classmethod
+    def batch(cls, ops, force=False):
+        """ Run many route changes through a single `ip -batch` process.
+            ops is an iterable of (verb, network, kwargs), where verb is one
+            of add, replace or delete and kwargs are as for that method.
+        """
+        def _args(*args, **_):
+            return args
+        lines = []
+        for verb, network, kwargs in ops:
+            kwargs = dict((k, v) for k, v in kwargs.items() if v is not None)
+            args = cls._modify(_args, network, **kwargs)
+            lines.append(' '.join(['route', verb] + [str(i) for i in args]))
+        try:
+            return base.batch(cls._ip, lines, force, cls.timeout)
+        finally:
+            cls.cache.clear()
+
+    @classmethod
+    def fields(cls, line):
+        """ Split line of `ip route show` output into an ordered dict of raw
+            string fields, without casting. Flags map to True, and multipath
+            routes have a list of such dicts under nexthops.
+        """
+        tokens = line.replace('\\', ' ').split()
+        fields = target = collections.OrderedDict()
+        if tokens[0] in cls.types:
+            fields['type'] = tokens.pop(0)
+        fields['network'] = tokens[0]
+        idx = 1
+        while idx < len(tokens):
+            token = tokens[idx]
+            if token == 'nexthop':
+                target = collections.OrderedDict()
+                fields.setdefault('nexthops', []).append(target)
+            elif token in _VALUED and idx + 1 < len(tokens):
+                idx += 1
+                target[token] = tokens[idx]
+            else:
+                target[token] = True
+            idx += 1
+        return fields
+
+    @staticmethod
+    def _fields_args(fields, skip=()):
+        args = []
+        for key, value in fields.items():
+            if key in _STATE or key in skip or key in ('type', 'network', 'nexthops'):
+                continue
+            args.append(key)
+            if value is not True:
+                args.append(str(value))
+        return args
+
+    resolved = None
+
+    @classmethod
+    def set_resolve_memo(cls, maxsize=1 << 16, follow=False):
+        """ Reuse routes returned by resolve until the next route change.
+            See ResolveMemo. Pass maxsize=0 to disable.
+        """
+        if cls.__dict__.get('resolved') is not None:
+            cls.resolved.close()
+        cls.resolved = ResolveMemo(cls, maxsize, follow) if maxsize else None
+
+    @staticmethod
+    def _get_line(destination, context):
+        args = ['route', 'get', str(destination)]
+        for key, value in context:
+            args.append(key)
+            if value is not True:
+                args.append(str(value))
+        return ' '.join(args)
+
+    @classmethod
+    def _resolved(cls, line):
+        """ Parse `ip route get` output, keeping the fields shared with show. """
+        fields = cls.fields(line)
+        result = dict.fromkeys(cls.regex.groupindex)
+        result.update((k, v) for k, v in fields.items() if k in result and v is not True)
+        return cls.construct(result, line).freeze()
+
+    @classmethod
+    def resolve(cls, destinations, batch_size=10000, **context):
+        """ Return the route the kernel picks for each destination, in order,
+            as reported by `ip route get`: network is the destination as a
+            host prefix, and via, dev and src are those chosen. context holds
+            further selectors, such as from_, iif, oif, mark (or fwmark), tos
+            and vrf; True passes a bare flag, such as connected. Unknown
+            selectors raise TypeError. Destinations without a route resolve
+            to None.
+
+            Lookups run through `ip -force -batch`, batch_size at a time,
+            each batch killed after _timeout seconds (default cls.timeout).
+            With set_resolve_memo, results are reused until the next route
+            change.
+        """
+        timeout = context.pop('_timeout', cls.timeout)
+        context = dict((_SELECTORS.get(k, k), v) for k, v in context.items())
+        unknown = sorted(set(context) - _GET_KEYS)
+        if unknown:
+            raise TypeError("resolve() got unknown selector {0!r}".format(unknown[0]))
+        context = tuple(sorted((k, v) for k, v in context.items()
+                               if v is not None and v is not False))
+        addrs = [base.to_addr(i) for i in destinations]
+        memo = cls.resolved
+        generation = memo.generation() if memo is not None else None
+        routes, pending = {}, []
+        for addr in addrs:
+            if addr in routes:
+                continue
+            route = memo.lookup((addr, context), _MISSING) if memo is not None else _MISSING
+            if route is _MISSING:
+                pending.append(addr)
+            routes[addr] = route
+
+        for idx in range(0, len(pending), batch_size):
+            chunk = pending[idx:idx + batch_size]
+            try:
+                output = base.batch(cls._ip, [cls._get_line(i, context) for i in chunk],
+                                    True, timeout)
+            except base.ErrorReturnCode as exc:
+                # ip carries on past failed lookups, then exits nonzero.
+                output = exc.stdout.decode('utf-8')
+            lines = output.splitlines() if isinstance(output, base.string_types) else output
+            # Failed lookups print nothing, so match answers to destinations.
+            found = iter(cls._resolved(line) for line in lines if line.strip())
+            route = next(found, None)
+            for addr in chunk:
+                if route is not None and route.network.ip == addr:
+                    routes[addr], route = route, next(found, None)
+                else:
+                    routes[addr] = None
+                if memo is not None:
+                    memo.store((addr, context), routes[addr], generation)
+        return [routes[addr] for addr in addrs]
+
+    @classmethod
+    def clone_table(cls, src, dst, transform=None, batch_size=10000, progress=None,
+                    force=False):
+        """ Copy routes from table src into table dst. The source dump is
+            streamed and every line split with fields; transform may edit the
+            fields in place, or return None to skip the route. Routes are
+            installed with `route replace` through `ip -batch`, batch_size at
+            a time, and progress, if given, is called with a CloneProgress
+            after each batch. Returns the final CloneProgress.
+        """
+        if str(src) == str(dst):
+            raise ValueError("Cannot clone table {0} into itself".format(src))
+        start = time.time()
+        count, skipped, lines = 0, 0, []
+
+        def _flush():
+            batched = bool(lines)
+            if batched:
+                base.batch(cls._ip, lines, force, cls.timeout)
+                del lines[:]
+            elapsed = time.time() - start
+            stats = CloneProgress(count, skipped, elapsed, count / elapsed if elapsed else 0.0)
+            if progress is not None and batched:
+                progress(stats)
+            return stats
+
+        try:
+            for line in base.stream(cls.cmd.show, 'table', src):
+                fields = cls.fields(line)
+                if transform is not None:
+                    fields = transform(fields)
+                    if fields is None:
+                        skipped += 1
+                        continue
+                args = ['route', 'replace', fields.get('type', ''), fields['network']]
+                # routes using a nexthop object also print its gateway and
+                # device, which ip rejects alongside nhid.
+                skip = ('via', 'dev') if 'nhid' in fields else ()
+                args.extend(cls._fields_args(fields, skip))
+                args.extend(('table', str(dst)))
+                for nexthop in () if skip else fields.get('nexthops', ()):
+                    args.append('nexthop')
+                    args.extend(cls._fields_args(nexthop))
+                lines.append(' '.join(i for i in args if i))
+                count += 1
+                if len(lines) >= batch_size:
+                    _flush()
+            return _flush()
+        finally:
+            cls.cache.clear()
 
     @classmethod
     def _convert_nexthops(cls, nexthops):
@@ -99,10 +384,16 @@ class Route(base.Base):
                 nextargs.append(str(getattr(nexthop, key)))
         return nextargs
 
+    # Routes sharing a nexthop group print identical nexthop lists, so parse
+    # each distinct list once and share the resulting objects. They are
+    # frozen, so a change through one route cannot leak into another.
+    _nexthops = base.Interner(lambda text: tuple(Nexthop(**n.groupdict()).freeze()
+                                                 for n in Nexthop.regex.finditer(text)))
+
     @classmethod
     def construct(cls, result, ipstr, *args):
-        nhops = Nexthop.regex.finditer(ipstr)
-        result['nexthops'] = [Nexthop(**n.groupdict()) for n in nhops]
+        idx = ipstr.find('nexthop ')
+        result['nexthops'] = list(cls._nexthops(ipstr[idx:])) if idx >= 0 else []
         if result.get('network') == 'default':
             result['network'] = cls.anyaddr
         return cls(**result)
@@ -111,6 +402,9 @@ class Route(base.Base):
         """ Needed for constructing sets. """
         return self.network
 
+    def _key(self):
+        return (self.network, self.metric)
+
     def __getattr__(self, name):
         if not name.startswith('is_'):
             return super(Route, self).__getattr__(name)
@@ -120,15 +414,31 @@ class Route(base.Base):
 class Route4(Route):
     anyaddr = "0.0.0.0/0"
 
+    @base.classproperty
+    def _ip(cls):
+        return base.IPR.ipv4
+
     @base.classproperty
     def cmd(cls, *args):
         return base.IPR.ipv4.route
 
+    @base.classproperty
+    def _monitor(cls):
+        return base.IPR.ipv4.monitor.route
+
 class Route6(Route):
     anyaddr = "::/0"
 
+    @base.classproperty
+    def _ip(cls):
+        return base.IPR.ipv6
+
     @base.classproperty
     def cmd(cls, *args):
         return base.IPR.ipv6.route
 
+    @base.classproperty
+    def _monitor(cls):
+        return base.IPR.ipv6.monitor.route
+
 
@@ -1,10 +1,8 @@
 """ Lookup rules """
-import re
-import six
 from ipyroute import base
 
 class Rule(base.Base):
-    regex = re.compile(r'(?P<pref>\d+):\s+'
+    regex = base.LazyRegex(r'(?P<pref>\d+):\s+'
                        r'((?P<_not>not)\s+)?'
                        r'(from (?P<fromprefix>\w+)\s+)?'
                        r'(to (?P<toprefix>\w+)\s+)?'
@@ -14,16 +12,16 @@ class Rule(base.Base):
 
     casts = dict(_not=bool,
                  pref=int,
-                 fwmark=lambda x: int(x, 16) if isinstance(x, six.string_types) and 'x' in x else int(x),
-                 lookup=unicode if not six.PY3 else lambda x: x,
-                 fromprefix=base.IPNetwork,
-                 toprefix=base.IPNetwork,
-                 iif=unicode if not six.PY3 else lambda x: x)
+                 fwmark=lambda x: int(x, 16) if isinstance(x, base.string_types) and 'x' in x else int(x),
+                 lookup=unicode if not base.PY3 else lambda x: x,
+                 fromprefix=base.to_network,
+                 toprefix=base.to_network,
+                 iif=unicode if not base.PY3 else lambda x: x)
     _order = ('not', 'from', 'fwmark', 'lookup', 'iif', 'pref')
 
     @classmethod
     def _get(cls, *args):
-        for line in cls.cmd.show(*args):
+        for line in base.stream(cls.cmd.show, *args):
             yield line
 
     def add(self):
@@ -59,6 +57,10 @@ class Rule4(Rule):
         """ Rules are a pain because we have to manage both v4 and v6 transparently. """
         return base.IPR.ipv4.rule
 
+    @base.classproperty
+    def _monitor(cls):
+        return base.IPR.ipv4.monitor.rule
+
 class Rule6(Rule):
     anyaddr = "::/0"
 
@@ -67,4 +69,8 @@ class Rule6(Rule):
         """ Rules are a pain because we have to manage both v4 and v6 transparently. """
         return base.IPR.ipv6.rule
 
+    @base.classproperty
+    def _monitor(cls):
+        return base.IPR.ipv6.monitor.rule
+
 
@@ -0,0 +1,235 @@
+""" Share dumps between processes through memory-mapped snapshots. """
+# -*- coding: utf-8 -*-
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+import weakref
+
+from ipyroute import base
+
+# Snapshot files start with magic, generation, the time the dump started and
+# the number of lines. An offset table follows, holding where each line starts
+# and, last, where the final one ends, so lines are found without scanning.
+_HEADER = struct.Struct('<4sQdQ')
+_OFFSET = struct.Struct('<Q')
+_MAGIC = b'IPR2'
+# The control file holds the generation of the last completed publish.
+_CONTROL = struct.Struct('<Q')
+CONTROL = 'generation'
+# Rounds kept besides the current one, for readers still opening files.
+KEEP = 2
+
+
+def round_path(path, generation):
+    """ Return directory holding the snapshots of a publish round. """
+    return os.path.join(path, 'round-{0}'.format(generation))
+
+
+def snapshot_name(cls, args):
+    """ Return file name of snapshot for cls and dump arguments. """
+    digest = hashlib.sha1('\0'.join(str(i) for i in args).encode('utf-8')).hexdigest()
+    return '{0}.{1}-{2}'.format(cls.__module__, cls.__name__, digest[:16])
+
+
+def _control(path):
+    """ Open control file under path, creating it if needed, and map it. """
+    fname = os.path.join(path, CONTROL)
+    try:
+        fd = os.open(fname, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        os.write(fd, _CONTROL.pack(0))
+    except OSError:
+        fd = os.open(fname, os.O_RDWR)
+    try:
+        return mmap.mmap(fd, _CONTROL.size)
+    finally:
+        os.close(fd)
+
+
+class Publisher(object):
+    """ Dump tables and publish them as snapshots under path, normally a
+        tmpfs such as /dev/shm, for SnapshotReader in other processes.
+
+        Each snapshot holds the raw output lines of one dump. A round writes
+        every snapshot into a temporary directory, which is renamed into place
+        as round-N before the control generation is bumped to N, so readers
+        see all tables of a round or none of them.
+    """
+    def __init__(self, path, targets=None, interval=1.0):
+        from ipyroute import Link, Address, Route4, Route6, Rule4, Rule6, Neighbor
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.interval = interval
+        self.targets = list(targets or [(cls, ()) for cls in (
+            Link, Address, Route4, Route6, Rule4, Rule6, Neighbor)])
+        self._control = _control(path)
+        self.generation = _CONTROL.unpack_from(self._control)[0]
+
+    @staticmethod
+    def _write(dirname, cls, args, generation):
+        started = time.time()
+        # pylint: disable=protected-access
+        lines = [line.encode('utf-8') for line in cls._get(*args)]
+        offsets, pos = [], 0
+        for line in lines:
+            offsets.append(pos)
+            pos += len(line)
+        offsets.append(pos)
+        with open(os.path.join(dirname, snapshot_name(cls, args)), 'wb') as fobj:
+            fobj.write(_HEADER.pack(_MAGIC, generation, started, len(lines)))
+            fobj.write(struct.pack('<{0}Q'.format(len(offsets)), *offsets))
+            fobj.write(b''.join(lines))
+
+    def publish(self):
+        """ Publish one round of snapshots. Returns the new generation. """
+        generation = self.generation + 1
+        tmp = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+        try:
+            os.chmod(tmp, 0o755)
+            for cls, args in self.targets:
+                self._write(tmp, cls, tuple(args), generation)
+            os.rename(tmp, round_path(self.path, generation))
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        _CONTROL.pack_into(self._control, 0, generation)
+        self.generation = generation
+        # Mapped snapshots outlive their files, so old rounds can go.
+        for name in os.listdir(self.path):
+            if name.startswith('round-') and name[6:].isdigit() and \
+                    int(name[6:]) < generation - KEEP:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        return generation
+
+    def run(self):
+        """ Publish every interval seconds, forever. """
+        while True:
+            start = time.time()
+            self.publish()
+            time.sleep(max(self.interval - (time.time() - start), 0))
+
+
+class Snapshot(object):
+    """ A mapped snapshot file. """
+    def __init__(self, fname):
+        with open(fname, 'rb') as fobj:
+            self._map = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, self.started, self.count = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC:
+            raise ValueError("Not a snapshot: {0!r}".format(fname))
+        self._payload = _HEADER.size + (self.count + 1) * _OFFSET.size
+
+    def __len__(self):
+        return self.count
+
+    def line(self, idx):
+        """ Return output line idx, decoded straight from the mapping. """
+        start, = _OFFSET.unpack_from(self._map, _HEADER.size + idx * _OFFSET.size)
+        end, = _OFFSET.unpack_from(self._map, _HEADER.size + (idx + 1) * _OFFSET.size)
+        return self._map[self._payload + start:self._payload + end].decode('utf-8')
+
+    def lines(self):
+        """ Yield output lines held in snapshot. """
+        for idx in range(self.count):
+            yield self.line(idx)
+
+
+class SnapshotItems(base.LazySequence):
+    """ Objects of a snapshot, each parsed from its line on first access.
+
+        Built objects are only held weakly, so a worker keeps no more of a
+        table in memory than its callers do; the text itself lives once, in
+        the shared mapping. An object still referenced is returned again
+        rather than parsed anew.
+    """
+    __slots__ = ('cls', 'args', 'snapshot', '_built')
+
+    def __init__(self, cls, args, snapshot):
+        self.cls = cls
+        self.args = args
+        self.snapshot = snapshot
+        self._built = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return tuple(self[i] for i in range(*idx.indices(len(self))))
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("snapshot index out of range")
+        obj = self._built.get(idx)
+        if obj is None:
+            obj = self.cls.from_string(self.snapshot.line(idx), *self.args).freeze()
+            self._built[idx] = obj
+        return obj
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class SnapshotReader(object):
+    """ Serve Base.get from snapshots published under path.
+
+        Checking for a new generation reads the mapped control file, so
+        gets between publishes cost no system calls, take no locks and return
+        the same ResultSet. Its objects are parsed from the shared mapping as
+        they are accessed (see SnapshotItems), so no worker holds its own copy
+        of a table: view() and indexing touch only what they return, while
+        get() builds every object for the list it returns.
+        Snapshots taken before this process last changed state through
+        ipyroute are ignored, and get falls back to running `ip` itself.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._control = None
+        self._generation = None
+        self._snapshots = {}
+        self._results = {}
+        self._names = {}
+
+    def _current(self, name):
+        if self._control is None:
+            try:
+                with open(os.path.join(self.path, CONTROL), 'rb') as fobj:
+                    self._control = mmap.mmap(fobj.fileno(), _CONTROL.size,
+                                              access=mmap.ACCESS_READ)
+            except (IOError, OSError, ValueError):
+                return None
+        generation = _CONTROL.unpack_from(self._control)[0]
+        if generation != self._generation:
+            self._snapshots.clear()
+            self._generation = generation
+        try:
+            return self._snapshots[name]
+        except KeyError:
+            pass
+        try:
+            snapshot = Snapshot(os.path.join(round_path(self.path, generation), name))
+        except (IOError, OSError, ValueError):
+            snapshot = None
+        self._snapshots[name] = snapshot
+        return snapshot
+
+    def result(self, cls, args):
+        """ Return ResultSet for cls and args, or None if not published. """
+        try:
+            name = self._names[cls, args]
+        except KeyError:
+            name = self._names[cls, args] = snapshot_name(cls, args)
+        snapshot = self._current(name)
+        if snapshot is None or snapshot.started < cls.cache.cleared:
+            return None
+        cached = self._results.get(name)
+        if cached is not None and cached[0] == snapshot.generation:
+            return cached[1]
+        result = base.ResultSet(SnapshotItems(cls, args, snapshot))
+        self._results[name] = (snapshot.generation, result)
+        return result
@@ -0,0 +1,163 @@
+""" Change notifications from `ip monitor`. """
+# -*- coding: utf-8 -*-
+import collections
+import threading
+import time
+
+from ipyroute import base
+from ipyroute.base import queue
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+# Events were dropped; consumers should resync from a full dump.
+OVERFLOW = 'overflow'
+
+Event = collections.namedtuple('Event', 'kind obj')
+
+
+class Watcher(object):
+    """ Iterate over batches of change events for a class.
+
+        A reader thread follows `ip monitor` and parses every line with the
+        class regex. Events are held in a bounded queue; if the consumer falls
+        behind, pending events are discarded and the next batch is a single
+        OVERFLOW event, after which the consumer should call resync().
+
+        Batches hold up to batch_size events, and are returned as soon as
+        batch_latency seconds have passed since the first event arrived.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, cls, batch_size=64, batch_latency=0.05, queue_size=4096, seed=False):
+        self.cls = cls
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
+        self._events = queue.Queue(queue_size)
+        self._overflow = threading.Event()
+        self._done = threading.Event()
+        self._error = None
+        self._known = set()
+        self._lock = threading.Lock()
+
+        # The monitor runs before the seed dump, so changes made while it is
+        # taken are buffered, and read once it has set the known objects.
+        # pylint: disable=protected-access
+        self._stream = base.Stream(cls._monitor).start()
+        if seed:
+            try:
+                self.resync()
+            except BaseException:
+                self._stream.kill()
+                raise
+        self._thread = threading.Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def resync(self):
+        """ Return full dump of current state and reset tracking of known
+            objects, so events following it are classified correctly.
+        """
+        result = list(self.cls.iter_get())
+        with self._lock:
+            # pylint: disable=protected-access
+            self._known = set(i._key() for i in result)
+        return result
+
+    def _event(self, line):
+        kind = CHANGED
+        if line.startswith('Deleted '):
+            kind, line = REMOVED, line[len('Deleted '):]
+        try:
+            obj = self.cls.from_string(line)
+        except ValueError:
+            # not every notification is for an object we can parse.
+            return None
+        key = obj._key() # pylint: disable=protected-access
+        with self._lock:
+            if kind == REMOVED:
+                self._known.discard(key)
+            elif key not in self._known:
+                self._known.add(key)
+                kind = ADDED
+        return Event(kind, obj)
+
+    def _read(self):
+        try:
+            for line in self._stream:
+                event = self._event(line)
+                if event is None:
+                    continue
+                try:
+                    self._events.put_nowait(event)
+                except queue.Full:
+                    self._overflow.set()
+        except Exception as exc: # pylint: disable=broad-except
+            self._error = exc
+        finally:
+            self._done.set()
+
+    def _get(self, timeout=None):
+        """ Return next event, None on timeout. Raises StopIteration once the
+            monitor has exited and all events are consumed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self._overflow.is_set():
+                return Event(OVERFLOW, None)
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.time())
+            try:
+                return self._events.get(timeout=max(wait, 0))
+            except queue.Empty:
+                pass
+            if self._done.is_set() and self._events.empty():
+                if self._error is not None:
+                    raise self._error # pylint: disable=raising-bad-type
+                raise StopIteration
+            if deadline is not None and time.time() >= deadline:
+                return None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        event = self._get()
+        if event.kind == OVERFLOW:
+            self._overflow.clear()
+            while not self._events.empty():
+                self._events.get_nowait()
+            return [event]
+
+        batch = [event]
+        deadline = time.time() + self.batch_latency
+        while len(batch) < self.batch_size:
+            try:
+                event = self._get(max(deadline - time.time(), 0))
+            except StopIteration:
+                break
+            if event is None:
+                break
+            if event.kind == OVERFLOW:
+                # flag stays set, reported on next batch.
+                break
+            batch.append(event)
+        return batch
+
+    next = __next__
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+
+        def _next():
+            try:
+                return next(self)
+            except StopIteration:
+                raise StopAsyncIteration # pylint: disable=undefined-variable
+        return asyncio.get_event_loop().run_in_executor(None, _next)
+
+    def close(self):
+        """ Stop following changes. """
+        self._stream.kill()
+        self._thread.join()
@@ -22,7 +22,7 @@ setup(name='ipyroute',
       author_email='joao.taveira@gmail.com',
       url='https://github.com/jta/ipyroute',
       packages=['ipyroute'],
-      install_requires=[ "sh", "netaddr", "six" ],
+      install_requires=[ "sh", "netaddr" ],
       license='MIT',
       platforms='any',
       classifiers=['Development Status :: 4 - Beta',
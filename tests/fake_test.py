@@ -0,0 +1,574 @@
+""" Test in-memory iproute2 backend.
+"""
+import json
+import mock
+import six
+import unittest
+
+import ipyroute
+from ipyroute import fake
+from ipyroute import __main__ as cli
+
+# tests elsewhere replace the proxy with a mock, so keep hold of the real one.
+IPR = ipyroute.base.IPR
+
+class FakeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.kernel = fake.FakeKernel()
+        IPR.bind(self.kernel.ip)
+        ipyroute.base.IPR = IPR
+
+    def tearDown(self):
+        pass
+
+
+class TestFakeLink(FakeTestCase):
+    """ Test link handling. """
+    def test_loopback(self):
+        """ Fresh kernel only has loopback. """
+        link, = ipyroute.Link.get()
+        assert link.name == 'lo'
+        assert link.loopback
+        assert link.up
+
+    def test_veth(self):
+        """ Veth pairs are created and removed together. """
+        IPR.root.link.add('veth0', 'type', 'veth', 'peer', 'name', 'veth1')
+        IPR.root.link.set.dev.veth0.up()
+        _, veth0, veth1 = ipyroute.Link.get()
+        assert veth0.name == 'veth0' and veth0.phy == 'veth1'
+        assert veth0.up and not veth1.up
+        assert veth0.addr == ipyroute.EUI('02:00:00:00:00:02')
+
+        veth1.delete()
+        assert [i.name for i in ipyroute.Link.get()] == ['lo']
+
+    def test_macvlan(self):
+        """ Link.add builds a child link. """
+        lo, = ipyroute.Link.get()
+        lo.add('mv0', type='macvlan', mode='private')
+        link = ipyroute.Link.get('dev', 'mv0').pop()
+        assert link.phy == 'lo'
+
+    def test_missing_link(self):
+        """ Unknown devices return nothing. """
+        assert ipyroute.Link.get('dev', 'eth9') == []
+
+    def test_stats(self):
+        """ Counters are parsed only when requested. """
+        self.kernel.links[1]['stats'] = [100, 2, 0, 1, 0, 0, 50, 1, 3, 0, 0, 0]
+        lo, = ipyroute.Link.get(stats=True)
+        assert (lo.rx_bytes, lo.rx_packets, lo.rx_errors, lo.rx_dropped) == (100, 2, 0, 1)
+        assert (lo.tx_bytes, lo.tx_packets, lo.tx_errors, lo.tx_dropped) == (50, 1, 3, 0)
+        lo, = ipyroute.Link.get()
+        assert 'rx_bytes' not in lo.__dict__
+
+    def test_add_many(self):
+        """ Links are created in one batch and returned from one dump. """
+        calls = []
+        run = self.kernel.run
+        self.kernel.run = lambda argv, stdin=None: calls.append(argv) or run(argv, stdin)
+        links = ipyroute.Link.add_many(
+            [dict(name='veth{0}'.format(i), type='veth', peer='peer{0}'.format(i),
+                  mtu=9000, up=True) for i in range(3)] +
+            [dict(name='lo.100', type='vlan', link='lo', id=100),
+             dict(name='gone', type='dummy', netns='ns1')])
+        assert [i.name for i in links] == ['veth0', 'veth1', 'veth2', 'lo.100']
+        assert all(i.mtu == 9000 and i.up for i in links[:3])
+        assert isinstance(links[0], ipyroute.link.EtherLink)
+        assert links[3].phy == 'lo'
+        assert self.kernel.netns['ns1'] == ['gone']
+        assert len(calls) == 2
+
+    def test_add_netns(self):
+        """ Links are moved to another namespace after their settings. """
+        links = ipyroute.Link.add_many([dict(name='v0', type='veth', peer='v1',
+                                             netns='ns1', up=True)])
+        assert [i.name for i in links] == []
+        assert self.kernel.netns['ns1'] == ['v0']
+        lines = ipyroute.Link._add_lines(dict(name='v0', type='veth', master='br0',
+                                              netns='ns1', up=True))
+        assert list(lines)[1:] == ['link set dev v0 master br0', 'link set dev v0 netns ns1 up']
+        assert [i.name for i in ipyroute.Link.get() if i.name == 'v1'] == ['v1']
+        ipyroute.Link.set_many([('v1', dict(name='w1', netns='ns2'))])
+        assert self.kernel.netns['ns2'] == ['w1']
+
+    def test_set_many(self):
+        """ Settings are applied in one batch, stopping at failures. """
+        ipyroute.Link.add_many([dict(name='d{0}'.format(i), type='dummy') for i in range(3)])
+        links = ipyroute.Link.set_many([('d0', dict(name='e0', up=True)),
+                                        ('d1', dict(mtu=1400, up=False))])
+        assert [(i.name, i.mtu, i.up) for i in links] == [('e0', 1500, True), ('d1', 1400, False)]
+        with self.assertRaises(ipyroute.base.ErrorReturnCode):
+            ipyroute.Link.set_many([('d1', dict(mtu=1300)), ('d9', dict(up=True)),
+                                    ('d2', dict(mtu=1300))])
+        assert [i.mtu for i in ipyroute.Link.get()[2:]] == [1300, 1500]
+        with self.assertRaises(ipyroute.base.ErrorReturnCode):
+            ipyroute.Link.set_many([('d9', dict(up=True)), ('d2', dict(mtu=1300))], force=True)
+        assert ipyroute.Link.get()[-1].mtu == 1300
+
+
+class TestLinkSampler(FakeTestCase):
+    """ Test link counter sampling. """
+    def setUp(self):
+        super(TestLinkSampler, self).setUp()
+        self.now = [0.0]
+        self.sampler = ipyroute.LinkSampler(maxlinks=4, width=32)
+        self.sampler._clock = lambda: self.now[0]
+
+    def tick(self, rx_bytes):
+        self.now[0] += 2
+        self.kernel.links[1]['stats'][0] = rx_bytes
+        return self.sampler.sample()
+
+    def test_rates(self):
+        """ Deltas and rates cover the last interval. """
+        assert self.tick(1000) is None
+        assert self.sampler.rate('lo') == 0
+        assert self.tick(3000) == 2
+        assert self.sampler.delta('lo') == 2000
+        assert self.sampler.rate(1, 'rx_bytes') == 1000.0
+
+    def test_wrap(self):
+        """ Counters going backwards wrapped, unless far off. """
+        self.tick(2**32 - 100)
+        self.tick(100)
+        assert self.sampler.delta('lo') == 200
+        self.tick(2**31)
+        self.tick(5)
+        assert self.sampler.delta('lo') == 5
+
+    def test_links(self):
+        """ Slots are released when links go away. """
+        IPR.root.link.add('dummy0', 'type', 'dummy')
+        self.tick(0)
+        assert self.sampler.links() == {'lo': 1, 'dummy0': 2}
+        IPR.root.link('del', 'dummy0')
+        self.tick(0)
+        assert self.sampler.links() == {'lo': 1}
+        with self.assertRaises(KeyError):
+            self.sampler.rate('dummy0')
+
+
+class TestFakeAddress(FakeTestCase):
+    """ Test address handling. """
+    def test_add_address(self):
+        """ Addresses round trip through the parser. """
+        ipyroute.Address.add('172.16.0.1/12', label='lo:test', dev='lo')
+        ipyroute.Address.add('172.16.0.2', peer='172.17.0.1/32', dev='lo')
+        addrs = ipyroute.Address.get('dev', 'lo')
+        assert [str(i.addr) for i in addrs] == ['127.0.0.1/8', '172.16.0.1/12', '172.16.0.2/32', '::1/128']
+        assert addrs[1].label == 'test'
+        assert addrs[2].peer == ipyroute.IPNetwork('172.17.0.1/32')
+
+        ipyroute.Address.delete('172.16.0.2', peer='172.17.0.1/32', dev='lo')
+        assert len(ipyroute.Address.get()) == 3
+
+    def test_duplicate_address(self):
+        """ Adding an existing address fails like RTNETLINK does. """
+        try:
+            ipyroute.Address.add('127.0.0.1/8', dev='lo')
+        except ipyroute.base.ErrorReturnCode as exc:
+            assert exc.exit_code == 2
+            assert b'File exists' in exc.stderr
+        else:
+            assert False
+
+
+class TestAddressIndex(FakeTestCase):
+    """ Test reverse address lookups. """
+    def setUp(self):
+        super(TestAddressIndex, self).setUp()
+        IPR.root.link.add('eth0', 'type', 'dummy')
+        ipyroute.Address.add('10.0.0.1/24', dev='eth0')
+        ipyroute.Address.add('10.0.0.2/32', label='eth0:vip', dev='eth0')
+        ipyroute.Address.add('10.1.0.1', peer='10.2.0.1/32', dev='eth0')
+        self.index = ipyroute.AddressIndex()
+
+    def test_lookup(self):
+        """ Exact and containing lookups. """
+        addr, = self.index.lookup('10.0.0.2')
+        assert addr.ifname == 'eth0' and addr.label == 'vip'
+        assert not self.index.lookup('10.0.0.3')
+        assert [str(i.addr) for i in self.index.containing('10.0.0.2')] == ['10.0.0.2/32', '10.0.0.1/24']
+        assert [str(i.addr) for i in self.index.containing('10.0.0.128/25')] == ['10.0.0.1/24']
+        assert [str(i.addr) for i in self.index.containing('127.1.2.3')] == ['127.0.0.1/8']
+        assert not self.index.containing('10.0.0.0/16')
+        assert [str(i.addr) for i in self.index.peer('10.2.0.1')] == ['10.1.0.1/32']
+
+    def test_groups(self):
+        """ Addresses are grouped by interface and label. """
+        assert len(self.index.by_ifnum(2)) == 3
+        assert len(self.index.by_ifnum(1)) == 2
+        vip, = self.index.by_label('vip')
+        assert str(vip.addr) == '10.0.0.2/32'
+
+    def test_incremental(self):
+        """ Changes made through Address commands update the index. """
+        ipyroute.Address.add('192.168.0.1/16', label='eth0:new', dev='eth0')
+        addr, = self.index.containing('192.168.1.1')
+        assert addr.ifnum == 2 and addr.label == 'new'
+
+        ipyroute.Address.delete('10.1.0.1', peer='10.2.0.1/32', dev='eth0')
+        assert not self.index.peer('10.2.0.1')
+        ipyroute.Address.delete('10.0.0.2/32', dev='eth0')
+        assert not self.index.lookup('10.0.0.2')
+        assert not self.index.by_label('vip')
+        assert len(self.index.by_ifnum(2)) == 2
+
+    def test_positional(self):
+        """ Positional iproute2 arguments update the index too. """
+        ipyroute.Address.add('10.9.0.1/24', 'dev', 'eth0', 'label', 'eth0:pos')
+        addr, = self.index.lookup('10.9.0.1')
+        assert addr.ifnum == 2 and addr.label == 'pos'
+        ipyroute.Address.delete('local', '10.9.0.1/24', 'dev', 'eth0')
+        assert not self.index.lookup('10.9.0.1')
+
+    def test_unparsed(self):
+        """ Changes the index cannot follow trigger a rebuild instead. """
+        ipyroute.Address.add('10.9.0.1/24', 'dev', 'eth0', 'nodad', 'noprefixroute')
+        with mock.patch.object(ipyroute.AddressIndex, '_update', side_effect=ValueError):
+            ipyroute.Address.add('10.9.0.2/24', 'dev', 'eth0')
+        assert self.index.lookup('10.9.0.1')
+        addr, = self.index.lookup('10.9.0.2')
+        assert addr.ifnum == 2
+
+
+class TestFakeRoute(FakeTestCase):
+    """ Test route handling. """
+    def test_multipath(self):
+        """ Multipath routes are printed as nexthop lists. """
+        nexthops = [ipyroute.Nexthop(via='10.0.0.1', dev='lo', weight=1),
+                    ipyroute.Nexthop(via='10.0.0.2', dev='lo', weight=2)]
+        ipyroute.Route4.add('default', src='10.0.0.3', nexthops=nexthops)
+        route, = ipyroute.Route4.get()
+        assert route.network == ipyroute.IPNetwork('0.0.0.0/0')
+        assert route.src == ipyroute.IPAddress('10.0.0.3')
+        assert [(i.via, i.weight) for i in route.nexthops] == \
+            [(ipyroute.IPAddress('10.0.0.1'), 1), (ipyroute.IPAddress('10.0.0.2'), 2)]
+
+    def test_tables(self):
+        """ Routes are kept per table and family. """
+        ipyroute.Route4.add('10.0.0.0/8', dev='lo', metric=10)
+        ipyroute.Route4.add('10.0.0.0/8', dev='lo', table=100)
+        ipyroute.Route6.add('2001:db8::/32', dev='lo')
+        assert [i.metric for i in ipyroute.Route4.get()] == [10]
+        assert [i.metric for i in ipyroute.Route4.get(table=100)] == [None]
+        route, = ipyroute.Route6.get()
+        assert route.metric == 1024
+
+        ipyroute.Route4.flush(table=100)
+        assert not ipyroute.Route4.get(table=100)
+
+    def test_delete_missing(self):
+        """ Deleting an unknown route returns ESRCH. """
+        try:
+            ipyroute.Route4.delete('10.0.0.0/8')
+        except ipyroute.base.ErrorReturnCode as exc:
+            assert exc.exit_code == 2
+            assert b'No such process' in exc.stderr
+        else:
+            assert False
+
+    def test_delete_link(self):
+        """ Routes go away with their device. """
+        IPR.root.link.add('dummy0', 'type', 'dummy')
+        ipyroute.Route4.add('10.0.0.0/8', dev='dummy0')
+        IPR.root.link.delete('dummy0')
+        assert not ipyroute.Route4.get()
+
+    def test_many_routes(self):
+        """ Tables hold a large number of routes. """
+        for i in range(10000):
+            ipyroute.Route4.add('10.{0}.{1}.0/24'.format(i // 256, i % 256), dev='lo')
+        assert len(list(IPR.ipv4.route.show())) == 10000
+
+    def test_clone_table(self):
+        """ Tables are cloned in batches, with routes transformed on the way. """
+        ipyroute.Link.add_many([dict(name='d0', type='dummy'), dict(name='d1', type='dummy')])
+        for i in range(25):
+            ipyroute.Route4.add('10.0.{0}.0/24'.format(i), dev='d0', metric=i, proto='static')
+        nexthops = [ipyroute.Nexthop(via='10.0.0.1', dev='d0', weight=1),
+                    ipyroute.Nexthop(via='10.0.1.1', dev='d0', weight=2)]
+        ipyroute.Route4.add('10.9.0.0/16', nexthops=nexthops)
+        ipyroute.NexthopObject.add(1, via='10.0.0.2', dev='d0')
+        ipyroute.Route4.add('10.5.0.0/24', nhid=1)
+
+        def transform(fields):
+            if fields['network'] == '10.0.3.0/24':
+                return None
+            if 'dev' in fields:
+                fields['dev'] = 'd1'
+            return fields
+        reports = []
+        stats = ipyroute.Route4.clone_table('main', 100, transform, batch_size=10,
+                                            progress=reports.append)
+        assert [i.routes for i in reports] == [10, 20, 26]
+        assert (stats.routes, stats.skipped) == (26, 1)
+
+        routes = ipyroute.Route4.get('table', '100')
+        assert len(routes) == 26
+        byprefix = dict((str(i.network), i) for i in routes)
+        assert byprefix['10.5.0.0/24'].nhid == 1 and byprefix['10.5.0.0/24'].dev == 'd0'
+        assert routes[5].dev == 'd1' and routes[5].metric == 6 and routes[5].proto == 'static'
+        assert [(str(i.via), i.dev, i.weight) for i in byprefix['10.9.0.0/16'].nexthops] == \
+            [('10.0.0.1', 'd0', 1), ('10.0.1.1', 'd0', 2)]
+        with self.assertRaises(ValueError):
+            ipyroute.Route4.clone_table(100, '100')
+
+
+    def test_prefix_index(self):
+        """ Deletes and lookups go through the per-prefix index. """
+        for metric in (10, 20):
+            ipyroute.Route4.add('10.1.0.0/16', dev='lo', metric=metric)
+        ipyroute.Route4.add('10.1.2.0/24', dev='lo', metric=5)
+        ipyroute.Route4.add('10.0.0.0/8', dev='lo')
+        assert IPR.ipv4.route.get('10.1.2.3') == ['10.1.2.3 dev lo src 127.0.0.1 uid 0 \\    cache ']
+        routes = self.kernel.routes[4][254]
+        ipyroute.Route4.delete('10.1.0.0/16')
+        ipyroute.Route4.delete('10.1.2.0/24')
+        assert [k[1] for k in routes.keys_for(ipyroute.IPNetwork('10.1.0.0/16'))] == [20]
+        assert [r['metric'] for r in next(routes.matching(ipyroute.IPAddress('10.1.2.3')))] == [20]
+
+    def test_resolve(self):
+        """ Destinations resolve to the route the kernel would pick. """
+        IPR.root.link.add('eth0', 'type', 'dummy')
+        ipyroute.Address.add('10.0.0.2/24', dev='eth0')
+        ipyroute.Route4.add('10.0.0.0/24', dev='eth0')
+        ipyroute.Route4.add('default', via='10.0.0.1', dev='eth0')
+        ipyroute.Route4.add('10.50.0.0/16', type='unreachable')
+        ipyroute.Route4.add('default', via='10.0.0.9', dev='eth0', table=100)
+        ipyroute.Rule4(fwmark=5, lookup='100').add()
+
+        dests = ['8.8.8.8', '10.0.0.7', '10.50.0.1', '10.0.0.2', '8.8.8.8']
+        remote, local, unreachable, own, again = ipyroute.Route4.resolve(dests, batch_size=2)
+        assert remote.network == ipyroute.IPNetwork('8.8.8.8/32')
+        assert (remote.via, remote.dev, remote.src) == \
+            (ipyroute.IPAddress('10.0.0.1'), 'eth0', ipyroute.IPAddress('10.0.0.2'))
+        assert local.via is None and local.dev == 'eth0'
+        assert unreachable is None
+        assert own.is_local
+        assert again is remote
+
+        with mock.patch.object(ipyroute.base, 'batch', wraps=ipyroute.base.batch) as batch:
+            marked, = ipyroute.Route4.resolve(['8.8.8.8'], fwmark=5, _timeout=5)
+        assert batch.call_args[0][1:] == (['route get 8.8.8.8 mark 5'], True, 5)
+        assert marked.via == ipyroute.IPAddress('10.0.0.9')
+        with self.assertRaises(TypeError):
+            ipyroute.Route4.resolve(['8.8.8.8'], gateway='10.0.0.1')
+
+    def test_resolve_memo(self):
+        """ Resolved routes are reused until the next route change. """
+        ipyroute.Route4.set_resolve_memo()
+        try:
+            ipyroute.Route4.add('default', via='10.0.0.1', dev='lo')
+            first, = ipyroute.Route4.resolve(['8.8.8.8'])
+            assert ipyroute.Route4.resolve(['8.8.8.8'])[0] is first
+            assert len(ipyroute.Route4.resolved) == 1
+
+            ipyroute.Route4.replace('default', via='10.0.0.5', dev='lo')
+            second, = ipyroute.Route4.resolve(['8.8.8.8'])
+            assert second.via == ipyroute.IPAddress('10.0.0.5')
+        finally:
+            ipyroute.Route4.set_resolve_memo(0)
+
+    def test_resolve_memo_address(self):
+        """ Address changes drop resolved routes, even with a route cache. """
+        IPR.root.link.add('eth0', 'type', 'dummy')
+        ipyroute.Address.add('10.0.0.2/24', dev='eth0')
+        ipyroute.Route4.add('10.0.0.0/24', dev='eth0')
+        ipyroute.Route4.set_resolve_memo()
+        ipyroute.Route4.set_cache(60)
+        try:
+            first, = ipyroute.Route4.resolve(['10.0.0.9'])
+            assert first.src == ipyroute.IPAddress('10.0.0.2')
+            ipyroute.Address.delete('10.0.0.2/24', dev='eth0')
+            ipyroute.Address.add('10.0.0.3/24', dev='eth0')
+            second, = ipyroute.Route4.resolve(['10.0.0.9'])
+            assert second.src == ipyroute.IPAddress('10.0.0.3')
+        finally:
+            ipyroute.Route4.set_resolve_memo(0)
+            ipyroute.Route4.set_cache(0)
+
+
+class TestAggregator(FakeTestCase):
+    """ Test route aggregation. """
+    def setUp(self):
+        super(TestAggregator, self).setUp()
+        ipyroute.Link.add_many([dict(name='d0', type='dummy'), dict(name='d1', type='dummy')])
+        self.agg = ipyroute.Aggregator(ipyroute.Route4)
+
+    def routes(self):
+        return sorted((str(i.network), i.dev) for i in ipyroute.Route4.get())
+
+    def test_merge(self):
+        """ Adjacent routes merge around more specifics, and deletes shrink them. """
+        for i in range(8):
+            self.agg.add('10.0.{0}.0/24'.format(i), dev='d0')
+        self.agg.add('10.0.3.128/25', dev='d1')
+        self.agg.commit()
+        assert self.routes() == [('10.0.0.0/21', 'd0'), ('10.0.3.128/25', 'd1')]
+        assert self.agg.lookup('10.0.5.0/24') == ipyroute.IPNetwork('10.0.0.0/21')
+
+        self.agg.delete('10.0.5.0/24')
+        ops = self.agg.commit()
+        assert ops[-1][0] == 'delete'
+        assert self.routes() == [('10.0.0.0/22', 'd0'), ('10.0.3.128/25', 'd1'),
+                                 ('10.0.4.0/24', 'd0'), ('10.0.6.0/23', 'd0')]
+        assert self.agg.commit() == []
+
+    def test_shadow(self):
+        """ Aggregates never override a route that lost to an original. """
+        for net in ('10.1.0.0/26', '10.1.0.64/26', '10.1.0.128/25'):
+            self.agg.add(net, dev='d0')
+        self.agg.add('10.1.0.0/25', dev='d1')
+        self.agg.commit()
+        assert self.routes() == [('10.1.0.0/25', 'd1'), ('10.1.0.0/26', 'd0'),
+                                 ('10.1.0.128/25', 'd0'), ('10.1.0.64/26', 'd0')]
+
+    def test_shadow_staged(self):
+        """ A staged route is not folded into a staged covering route when
+            another group's route lies between them.
+        """
+        self.agg.add('10.0.0.0/24', dev='d0')
+        self.agg.add('10.0.1.0/24', dev='d0')
+        self.agg.add('10.0.1.0/25', dev='lo')
+        self.agg.add('10.0.0.0/23', dev='lo')
+        self.agg.commit()
+        assert self.routes() == [('10.0.0.0/23', 'lo'), ('10.0.0.0/24', 'd0'),
+                                 ('10.0.1.0/24', 'd0'), ('10.0.1.0/25', 'lo')]
+        route, = ipyroute.Route4.resolve(['10.0.1.5'])
+        assert route.dev == 'lo'
+
+
+class TestFakeRule(FakeTestCase):
+    """ Test rule handling. """
+    def test_rule(self):
+        """ Rules are sorted by preference. """
+        rule = ipyroute.Rule4(fromprefix=ipyroute.Rule4.anyaddr, fwmark=5, lookup='100', pref=10)
+        rule.add()
+        rules = ipyroute.Rule4.get()
+        assert [i.pref for i in rules] == [0, 10, 32766, 32767]
+        assert rules[1].fwmark == 5
+        rules[1].delete()
+        assert [i.pref for i in ipyroute.Rule4.get()] == [0, 32766, 32767]
+
+
+class TestFakeNeighbor(FakeTestCase):
+    """ Test neighbor handling. """
+    def test_neighbor(self):
+        """ Neighbor output omits device when filtering on it. """
+        ipyroute.Neighbor.add('10.0.0.1', lladdr='AA:BB:CC:DD:EE:FF', dev='lo')
+        neigh, = ipyroute.Neighbor.get()
+        assert neigh.ifname == 'lo'
+        assert neigh.permanent
+        neigh, = ipyroute.Neighbor.get(dev='lo')
+        assert neigh.ifname is None
+        assert neigh.ifaddr == ipyroute.EUI('aa:bb:cc:dd:ee:ff')
+
+    def test_unknown_device(self):
+        """ Bad show arguments raise ErrorReturnCode like ip does. """
+        assert not ipyroute.Neighbor.get(dev='nope')
+        try:
+            ipyroute.Route4.get(dev='nope')
+        except ipyroute.base.ErrorReturnCode:
+            pass
+        else:
+            assert False
+
+
+class TestFakeNexthop(FakeTestCase):
+    """ Test nexthop objects. """
+    def setUp(self):
+        super(TestFakeNexthop, self).setUp()
+        IPR.root.link.add('eth0', 'type', 'dummy')
+        IPR.root.link.add('eth1', 'type', 'dummy')
+        ipyroute.NexthopObject.add(1, via='10.0.0.1', dev='eth0')
+        ipyroute.NexthopObject.add(2, via='10.0.1.1', dev='eth1')
+        ipyroute.NexthopGroup.add(10, members=[1, (2, 3)], proto='static')
+
+    def test_show(self):
+        """ Nexthops and groups are parsed into their own classes. """
+        first, second, group = ipyroute.NexthopObject.get()
+        assert type(first) is ipyroute.NexthopObject
+        assert first.via == ipyroute.IPAddress('10.0.0.1')
+        assert second.dev == 'eth1'
+        assert isinstance(group, ipyroute.NexthopGroup)
+        assert group.members == [(1, 1), (2, 3)]
+        assert group.proto == 'static'
+        assert ipyroute.NexthopGroup.get() == [group]
+
+    def test_failover(self):
+        """ Replacing the group moves every route using it. """
+        group, = ipyroute.NexthopGroup.get()
+        for i in range(10):
+            ipyroute.Route4.add('10.1.{0}.0/24'.format(i), nhid=group)
+        routes = ipyroute.Route4.get()
+        assert all(i.nhid == 10 for i in routes)
+        assert all(len(i.nexthops) == 2 for i in routes)
+        assert routes[0].nexthops[0] is routes[-1].nexthops[0]
+
+        ipyroute.NexthopGroup.replace(10, members=[2])
+        routes = ipyroute.Route4.get()
+        assert [(i.via, i.dev) for i in routes[0].nexthops] == [(ipyroute.IPAddress('10.0.1.1'), 'eth1')]
+
+    def test_delete(self):
+        """ Deleting the last member removes group and routes. """
+        ipyroute.Route4.add('10.1.0.0/24', nhid=10)
+        ipyroute.Route4.add('10.2.0.0/24', nhid=1)
+        route = ipyroute.Route4.get('10.2.0.0/24').pop()
+        assert route.via == ipyroute.IPAddress('10.0.0.1')
+        ipyroute.NexthopObject.delete(1)
+        ipyroute.NexthopObject.delete(2)
+        assert not ipyroute.NexthopObject.get()
+        assert not ipyroute.Route4.get()
+
+    def test_missing_nhid(self):
+        """ Routes must refer to existing nexthops. """
+        try:
+            ipyroute.Route4.add('10.1.0.0/24', nhid=99)
+        except ipyroute.base.ErrorReturnCode as exc:
+            assert b'Nexthop id does not exist' in exc.stderr
+        else:
+            assert False
+
+
+class TestFakeCli(FakeTestCase):
+    """ Test command line interface. """
+    def run_cli(self, *argv):
+        out = six.StringIO()
+        with mock.patch('sys.stdout', out):
+            code = cli.main(list(argv))
+        return code, json.loads(out.getvalue()) if out.getvalue() else None
+
+    def test_link(self):
+        """ Links are created and listed as JSON. """
+        code, links = self.run_cli('link', 'add', 'name', 'dummy0', 'type', 'dummy', 'up')
+        assert code == 0
+        assert [i['name'] for i in links] == ['dummy0']
+        _, links = self.run_cli('link', 'show')
+        assert [i['name'] for i in links] == ['lo', 'dummy0']
+        assert links[1]['addr'] == '02:00:00:00:00:02'
+        assert self.run_cli('link', 'del', 'dummy0') == (0, {'ok': True})
+        assert len(self.run_cli('link', 'show')[1]) == 1
+
+    def test_route(self):
+        """ Routes are added, listed and deleted with iproute2 arguments. """
+        IPR.root.link.add('eth0', 'type', 'dummy')
+        ipyroute.Address.add('10.0.0.2/24', dev='eth0')
+        code, _ = self.run_cli('route', 'add', '10.1.0.0/16', 'via', '10.0.0.1', 'dev', 'eth0',
+                               'metric', '10')
+        assert code == 0
+        _, routes = self.run_cli('route', 'show', '10.1.0.0/16')
+        assert routes[0]['network'] == '10.1.0.0/16'
+        assert (routes[0]['via'], routes[0]['metric']) == ('10.0.0.1', 10)
+        self.run_cli('route', 'del', '10.1.0.0/16')
+        assert not self.run_cli('route', 'show', '10.1.0.0/16')[1]
+
+    def test_error(self):
+        """ Failures exit with the status of ip and report stderr as JSON. """
+        err = six.StringIO()
+        with mock.patch('sys.stderr', err):
+            code, _ = self.run_cli('route', 'del', '10.9.0.0/16')
+        assert code == 2
+        assert 'error' in json.loads(err.getvalue())
@@ -2,6 +2,7 @@
 """
 import functools
 import mock
+import sh
 import socket
 import time
 import unittest
@@ -9,6 +10,7 @@ import unittest
 from nose.tools import raises
 
 import ipyroute
+from ipyroute import executor
 
 def mocked(method, output):
     def wrap(func):
@@ -405,3 +407,636 @@ class TestLinkAux(unittest.TestCase):
         assert ipyroute.IPNetwork('192.168.1.1/32') in link.peers
         assert ipyroute.base.IPR.ipv4.addr.show.call_count == 2
 
+
+class TestStream(unittest.TestCase):
+    """ Test incremental reads of iproute2 output. """
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+
+    def tearDown(self):
+        pass
+
+    def test_stream_lines(self):
+        """ Lines are reassembled across chunk boundaries. """
+        import sh
+        cmd = sh.Command('printf')
+        lines = list(ipyroute.base.stream(cmd, 'a\\n' + 'b' * 100000 + '\\nc'))
+        assert lines == ['a', 'b' * 100000, 'c']
+
+    def test_stream_cancel(self):
+        """ Closing the stream kills the child. """
+        import sh
+        lines = ipyroute.base.stream(sh.Command('yes'))
+        assert [next(lines) for _ in range(10)] == ['y'] * 10
+        lines.close()
+
+    @raises(ipyroute.base.ErrorReturnCode)
+    def test_stream_error(self):
+        """ Non-zero exit is raised once output is consumed. """
+        import sh
+        list(ipyroute.base.stream(sh.Command('false')))
+
+    @mocked("link.link.show",
+            "1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN \   link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00\n\
+2: bond0: <BROADCAST,MULTICAST,MASTER> mtu 1500 qdisc noop state DOWN \    link/ether 82:e1:10:2e:d2:bf brd ff:ff:ff:ff:ff:ff")
+    def test_iter_get(self):
+        """ iter_get yields matches without touching the cache. """
+        ipyroute.Link.set_cache(10)
+        links = ipyroute.Link.iter_get(filt=lambda x: x.name != 'lo')
+        assert [i.name for i in links] == ['bond0']
+        assert not ipyroute.Link.cache
+        ipyroute.Link.set_cache(0)
+
+class TestIntern(unittest.TestCase):
+    """ Test sharing of repeated values. """
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+
+    def tearDown(self):
+        pass
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 via 172.16.56.4 dev p6p1 proto bird\n\
+10.0.1.0/24 via 172.16.56.4 dev p6p1 proto bird \ nexthop via 172.16.56.4  dev p6p1 weight 1")
+    def test_shared_values(self):
+        """ Identical gateways and devices share one object. """
+        first, second = ipyroute.Route4.get()
+        assert first.via is second.via
+        assert first.dev is second.dev
+        assert first.proto is second.proto
+        assert second.nexthops[0].via is first.via
+        assert first.network is not second.network
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 via 172.16.56.4 dev p6p1\n10.0.1.0/24 via 172.16.56.4 dev p6p1")
+    def test_shared_immutable(self):
+        """ Shared addresses cannot be changed in place. """
+        first, second = ipyroute.Route4.get()
+        via = first.via
+        via += 1
+        assert str(via) == '172.16.56.5'
+        assert str(second.via) == '172.16.56.4'
+        assert str(ipyroute.base.intern_addr('172.16.56.4')) == '172.16.56.4'
+        with self.assertRaises(AttributeError):
+            first.via.value = 5
+        eui = ipyroute.base.intern_eui('aa:bb:cc:dd:ee:ff')
+        with self.assertRaises(AttributeError):
+            eui.value = 5
+        assert eui == ipyroute.EUI('aa:bb:cc:dd:ee:ff')
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 proto bird \\ nexthop via 172.16.56.4  dev p6p1 weight 1\n\
+10.0.1.0/24 proto bird \\ nexthop via 172.16.56.4  dev p6p1 weight 1")
+    def test_shared_nexthops(self):
+        """ Shared nexthops cannot be changed through one route. """
+        first, second = ipyroute.Route4.get()
+        assert first.nexthops[0] is second.nexthops[0]
+        with self.assertRaises(AttributeError):
+            first.nexthops[0].weight = 7
+        assert second.nexthops[0].weight == 1
+
+    def test_bounded(self):
+        """ Table starts over once full. """
+        interner = ipyroute.base.Interner(ipyroute.IPAddress, maxsize=2)
+        first = interner('10.0.0.1')
+        assert interner('10.0.0.1') is first
+        interner('10.0.0.2')
+        interner('10.0.0.3')
+        assert len(interner) == 1
+        assert interner('10.0.0.1') is not first
+        assert interner('10.0.0.1') == first
+
+class TestNexthopObject(unittest.TestCase):
+    """ Test nexthop object lib. """
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+
+    def tearDown(self):
+        pass
+
+    @mocked("root.nexthop.show", "id 1 via 172.16.56.4 dev p6p1 scope link proto static\n\
+id 2 blackhole\n\
+id 3 group 1,2/4 proto bird")
+    def test_nexthops(self):
+        """ Parse nexthop objects. """
+        single, blackhole, group = ipyroute.NexthopObject.get()
+        assert single.id == 1
+        assert single.via == ipyroute.IPAddress('172.16.56.4')
+        assert single.dev == 'p6p1'
+        assert single.proto == 'static'
+        assert blackhole.blackhole
+        assert group.members == [(1, 2), (4, 1)]
+
+    def test_add_group(self):
+        """ Confirm group addition syntax. """
+        ipyroute.NexthopGroup.add(3, members=[(1, 2), 4], proto='bird')
+        expected = ipyroute.base.IPR.root.nexthop.add
+        assert expected.called
+        assert " ".join(str(i) for i in expected.call_args[0]) == 'id 3 group 1,2/4 proto bird'
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 nhid 3 proto bird \ nexthop via 172.16.56.4 dev p6p1 weight 2")
+    def test_route_nhid(self):
+        """ Routes refer to nexthop objects by id. """
+        route, = ipyroute.Route4.get()
+        assert route.nhid == 3
+        assert route.proto == 'bird'
+        assert route.nexthops[0].weight == 2
+
+        ipyroute.Route4.replace('10.0.0.0/24', nhid=ipyroute.NexthopObject(id=5), table=10)
+        expected = ipyroute.base.IPR.ipv4.route.replace
+        assert " ".join(str(i) for i in expected.call_args[0]) == '10.0.0.0/24 table 10 nhid 5'
+
+class TestWatch(unittest.TestCase):
+    """ Test change events. """
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+
+    def tearDown(self):
+        pass
+
+    @mocked("ipv4.monitor.route", "10.0.0.0/24 via 172.16.56.4 dev p6p1 proto bird\n\
+10.0.0.0/24 via 172.16.57.4 dev p6p1 proto bird\n\
+Deleted 10.0.0.0/24 via 172.16.57.4 dev p6p1 proto bird")
+    def test_route_events(self):
+        """ Route notifications map to added, changed and removed events. """
+        from ipyroute import watch
+        events = [e for batch in ipyroute.Route4.watch(batch_latency=1) for e in batch]
+        assert [e.kind for e in events] == [watch.ADDED, watch.CHANGED, watch.REMOVED]
+        assert events[1].obj.via == ipyroute.IPAddress('172.16.57.4')
+
+    @mocked("root.monitor.neigh", "10.11.12.3 dev p6p2 lladdr ff:ff:ff:ff:ff:ff REACHABLE\n\
+10.11.12.3 dev p6p2 FAILED")
+    @mocked("ipv4.neigh.show", "10.11.12.3 dev p6p2 lladdr ff:ff:ff:ff:ff:ff STALE")
+    @mocked("ipv6.neigh.show", "")
+    def test_seed(self):
+        """ Seeding from a dump classifies known objects as changed. """
+        from ipyroute import watch
+        watcher = ipyroute.Neighbor.watch(seed=True, batch_size=1)
+        first, second = list(watcher)
+        assert first[0].kind == watch.CHANGED
+        assert second[0].kind == watch.CHANGED
+        assert second[0].obj.failed
+
+    @mocked("root.monitor.neigh", "10.11.12.3 dev p6p2 lladdr ff:ff:ff:ff:ff:ff REACHABLE")
+    @mocked("ipv6.neigh.show", "")
+    def test_seed_after_monitor(self):
+        """ The monitor is running before the seed dump is taken. """
+        monitor = ipyroute.base.IPR.root.monitor.neigh
+        dump = mock.Mock(side_effect=lambda *args: [] if monitor.called else None)
+        ipyroute.base.IPR.ipv4.neigh.show = dump
+        watcher = ipyroute.Neighbor.watch(seed=True)
+        assert dump.called and monitor.called
+        assert [[e.kind for e in i] for i in watcher] == [['added']]
+
+    @mocked("link.monitor.link", "\n".join(
+        "{0}: dummy{0}: <BROADCAST,NOARP> mtu 1500 qdisc noop state DOWN \    link/ether c2:9a:cc:30:2c:67 brd ff:ff:ff:ff:ff:ff".format(i)
+        for i in range(10)))
+    def test_overflow(self):
+        """ Consumer is told to resync when events are dropped. """
+        from ipyroute import watch
+        watcher = ipyroute.Link.watch(queue_size=2)
+        watcher._thread.join()
+        batches = list(watcher)
+        assert batches == [[watch.Event(watch.OVERFLOW, None)]]
+
+    @mocked("ipv6.monitor.rule", "32766:  from all lookup main")
+    def test_async(self):
+        """ Batches can be consumed from asyncio. """
+        import asyncio
+        watcher = ipyroute.Rule6.watch()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            batch = loop.run_until_complete(watcher.__anext__())
+            assert batch[0].obj.lookup == 'main'
+            with self.assertRaises(StopAsyncIteration):
+                loop.run_until_complete(watcher.__anext__())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+class TestSingleFlight(unittest.TestCase):
+    """ Test coalescing of concurrent identical dumps. """
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+
+    def tearDown(self):
+        ipyroute.Route4.set_cache(0)
+
+    def test_coalesce(self):
+        """ Concurrent callers share a single dump. """
+        import threading
+        started = threading.Event()
+        release = threading.Event()
+
+        def show(*args):
+            started.set()
+            release.wait()
+            return ["10.0.0.0/24 via 172.16.56.4 dev p6p1 proto bird"]
+        ipyroute.base.IPR.ipv4.route.show.side_effect = show
+
+        before = ipyroute.base.metrics['coalesced']
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(ipyroute.Route4.get()))
+                   for _ in range(8)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while ipyroute.base.metrics['coalesced'] - before < 7:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert ipyroute.base.IPR.ipv4.route.show.call_count == 1
+        assert len(results) == 8
+        assert all(len(i) == 1 for i in results)
+        assert results[0][0] is results[1][0]
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1\n10.0.1.0/24 dev p6p2")
+    def test_filter_not_cached(self):
+        """ Filtered calls cache the full dump. """
+        ipyroute.Route4.set_cache(10)
+        assert len(ipyroute.Route4.get(filt=lambda x: x.dev == 'p6p1')) == 1
+        assert len(ipyroute.Route4.get()) == 2
+        assert ipyroute.base.IPR.ipv4.route.show.call_count == 1
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1")
+    def test_aget(self):
+        """ Asyncio callers get the same results. """
+        import asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            route, = loop.run_until_complete(ipyroute.Route4.aget())
+            assert route.dev == 'p6p1'
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+    """ Test serving expired cache entries during refresh. """
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+        ipyroute.Route4.set_cache(0.05, max_stale=10)
+
+    def tearDown(self):
+        ipyroute.Route4.set_cache(0)
+
+    def wait_refresh(self):
+        while ipyroute.Route4.cache._refreshing:
+            time.sleep(0.01)
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1")
+    def test_stale(self):
+        """ Expired entry is served while a refresh runs in background. """
+        assert ipyroute.Route4.get()[0].dev == 'p6p1'
+        ipyroute.base.IPR.ipv4.route.show.return_value = ["10.0.0.0/24 dev p6p2"]
+        time.sleep(0.06)
+        assert ipyroute.Route4.get()[0].dev == 'p6p1'
+        self.wait_refresh()
+        assert ipyroute.Route4.get()[0].dev == 'p6p2'
+        assert ipyroute.base.IPR.ipv4.route.show.call_count == 2
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1")
+    def test_refresh_error(self):
+        """ Failed refresh keeps last good value. """
+        ipyroute.Route4.get()
+        ipyroute.base.IPR.ipv4.route.show.side_effect = ValueError('boom')
+        time.sleep(0.06)
+        assert ipyroute.Route4.get()[0].dev == 'p6p1'
+        self.wait_refresh()
+        assert ipyroute.Route4.get()[0].dev == 'p6p1'
+        assert isinstance(ipyroute.Route4.cache.errors[()], ValueError)
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1")
+    def test_writes_invalidate(self):
+        """ Changes made through ipyroute are never hidden by stale entries. """
+        ipyroute.Route4.get()
+        ipyroute.Route4.add('10.0.1.0/24', dev='p6p1')
+        ipyroute.Route4.get()
+        assert ipyroute.base.IPR.ipv4.route.show.call_count == 2
+
+
+class TestResultSet(unittest.TestCase):
+    """ Test immutable result sets. """
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+        ipyroute.Route4.set_cache(10)
+
+    def tearDown(self):
+        ipyroute.Route4.set_cache(0)
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1\n10.0.1.0/24 dev p6p2\n10.0.2.0/24 dev p6p1")
+    def test_view(self):
+        """ Cached views are shared, not copied. """
+        view = ipyroute.Route4.view()
+        assert ipyroute.Route4.view() is view
+        assert len(view) == 3
+        assert [str(i.network) for i in view[1:]] == ['10.0.1.0/24', '10.0.2.0/24']
+        assert view[-1] is view[1:][-1]
+        p6p1 = ipyroute.Route4.view(filt=lambda x: x.dev == 'p6p1')
+        assert [i.network for i in p6p1] == [view[0].network, view[2].network]
+        assert p6p1[1:][0] is view[2]
+        assert list(view) == ipyroute.Route4.get()
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1")
+    def test_frozen(self):
+        """ Parsed objects are immutable until copied. """
+        route, = ipyroute.Route4.view()
+        with self.assertRaises(AttributeError):
+            route.dev = 'p6p2'
+        with self.assertRaises(AttributeError):
+            del route.dev
+        copy, = ipyroute.Route4.view().thaw()
+        copy.dev = 'p6p2'
+        assert route.dev == 'p6p1'
+        assert copy.network == route.network
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 proto bird \\ nexthop via 172.16.56.4  dev p6p1 weight 1")
+    def test_frozen_nested(self):
+        """ Nested nexthops are frozen too, and copied on thaw. """
+        route, = ipyroute.Route4.view()
+        assert isinstance(route.nexthops, tuple)
+        with self.assertRaises(AttributeError):
+            route.nexthops[0].weight = 7
+        copy, = ipyroute.Route4.view().thaw()
+        copy.nexthops[0].weight = 7
+        copy.nexthops.append(copy.nexthops[0])
+        assert route.nexthops[0].weight == 1
+        assert len(route.nexthops) == 1
+
+    def test_copy_pickle(self):
+        """ Objects survive copy, deepcopy and pickle, frozen or not. """
+        import copy
+        import pickle
+        route = ipyroute.Route4(network='10.0.0.0/24', dev='p6p1')
+        frozen = ipyroute.Route4(network='10.0.1.0/24', dev='p6p2').freeze()
+        for func in (copy.copy, copy.deepcopy, lambda x: pickle.loads(pickle.dumps(x))):
+            other = func(route)
+            assert str(other) == str(route)
+            other.dev = 'p6p3'
+            other = func(frozen)
+            assert str(other) == str(frozen)
+            with self.assertRaises(AttributeError):
+                other.dev = 'p6p3'
+
+
+class TestParallel(unittest.TestCase):
+    """ Test parsing dumps in worker processes. """
+    lines = ["10.0.{0}.0/24 via 10.1.0.{1} dev p6p{1} proto static metric {0}".format(i, i % 3)
+             for i in range(50)]
+    lines.append("10.9.0.0/16 proto zebra  nexthop via 10.0.0.1  dev p6p1 weight 1"
+                 " nexthop via 10.0.0.2  dev p6p2 weight 1")
+
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+        ipyroute.base.IPR.ipv4.route.show.return_value = self.lines
+        ipyroute.Route4.set_parallel(2, threshold=20, chunksize=7)
+
+    def tearDown(self):
+        ipyroute.Route4.set_parallel(0)
+
+    def test_parallel(self):
+        """ Parallel parse matches serial parse, in order. """
+        result = ipyroute.Route4.get()
+        ipyroute.Route4.set_parallel(0)
+        assert result[:50] == ipyroute.Route4.get()[:50]
+        assert [i.metric for i in result[:50]] == list(range(50))
+        assert result[1].via is result[4].via
+        with self.assertRaises(AttributeError):
+            result[1].via.value = 5
+        nexthops = result[-1].nexthops
+        assert [str(i.via) for i in nexthops] == ['10.0.0.1', '10.0.0.2']
+        with self.assertRaises(AttributeError):
+            result[0].dev = 'p6p9'
+
+    def test_threshold(self):
+        """ Small dumps are parsed in process. """
+        ipyroute.base.IPR.ipv4.route.show.return_value = self.lines[:10]
+        assert len(ipyroute.Route4.get()) == 10
+        assert ipyroute.Route4.parallel._pool is None
+
+
+class TestExecutor(unittest.TestCase):
+    """ Test subprocess backend. """
+    def setUp(self):
+        self.sh = executor.Command(executor.which('sh'), '-c')
+
+    def test_call(self):
+        """ Output is returned as text, errors raise sh exceptions. """
+        assert self.sh('echo a; echo b') == 'a\nb\n'
+        assert self.sh('cat', _in=['x\n', 'y']) == 'x\ny'
+        with self.assertRaises(sh.ErrorReturnCode_3) as ctx:
+            self.sh('echo oops >&2; exit 3')
+        assert ctx.exception.stderr == b'oops\n'
+        with self.assertRaises(sh.SignalException_SIGKILL):
+            self.sh('kill -9 $$')
+
+    def test_bake(self):
+        """ Attribute chains are built once. """
+        ip = executor.Command('/sbin/ip')
+        assert ip.route.show is ip.route.show
+        assert ip.bake('-4', 6).route.argv == ('/sbin/ip', '-4', '6', 'route')
+        with self.assertRaises(TypeError):
+            ip.route.show(table='main')
+
+    def test_stream(self):
+        """ Stream reads lines from the pipe and checks exit status. """
+        assert list(ipyroute.base.stream(self.sh, 'printf "a\\nb"')) == ['a', 'b']
+        with self.assertRaises(sh.ErrorReturnCode_2):
+            list(ipyroute.base.stream(self.sh, 'echo a; exit 2'))
+        lines = ipyroute.base.stream(self.sh, 'echo a; exec sleep 10')
+        start = time.time()
+        assert next(lines) == 'a'
+        lines.close()
+        assert time.time() - start < 5
+
+
+class TestDeadline(unittest.TestCase):
+    """ Test timeouts and hedged reads. """
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+        self.sh = executor.Command(executor.which('sh'), '-c')
+
+    def tearDown(self):
+        ipyroute.Route4.set_cache(0)
+        ipyroute.Route4.set_deadline()
+
+    def test_executor(self):
+        """ Hung commands are killed. """
+        start = time.time()
+        with self.assertRaises(sh.TimeoutException):
+            self.sh('exec sleep 10', _timeout=0.1)
+        assert time.time() - start < 5
+        assert self.sh('echo a', _timeout=5) == 'a\n'
+
+    def test_read(self):
+        """ Timed out reads raise, or fall back to stale cache. """
+        ipyroute.base.IPR.ipv4.route.show = self.sh.bake('echo 10.0.0.0/24 dev p6p1')
+        ipyroute.Route4.set_cache(0.01)
+        ipyroute.Route4.set_deadline(timeout=0.2)
+        result = ipyroute.Route4.get()
+        assert not result.stale
+        ipyroute.base.IPR.ipv4.route.show = self.sh.bake('exec sleep 10')
+        time.sleep(0.02)
+        start = time.time()
+        stale = ipyroute.Route4.get()
+        assert stale.stale and stale == result
+        assert ipyroute.Route4.view().stale
+        ipyroute.Route4.cache.clear()
+        with self.assertRaises(sh.TimeoutException):
+            ipyroute.Route4.get()
+        assert time.time() - start < 5
+
+    def test_hedge(self):
+        """ Slow reads are retried, and the first to answer wins. """
+        calls = []
+        def show(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                time.sleep(1)
+            return ["10.0.{0}.0/24 dev p6p1".format(len(calls))]
+        ipyroute.base.IPR.ipv4.route.show.side_effect = show
+        start = time.time()
+        route, = ipyroute.Route4.get(_hedge=0.05, _timeout=5)
+        assert time.time() - start < 0.5
+        assert str(route.network) == '10.0.2.0/24'
+
+    def test_write(self):
+        """ Timeouts are passed on to writes. """
+        ipyroute.Route4.set_deadline(timeout=3)
+        ipyroute.Route4.add('10.0.0.0/24', dev='p6p1')
+        ipyroute.base.IPR.ipv4.route.add.assert_called_with('10.0.0.0/24', 'dev', 'p6p1', _timeout=3)
+        ipyroute.Route4.delete('10.0.0.0/24', _timeout=1)
+        ipyroute.base.IPR.ipv4.route.delete.assert_called_with('10.0.0.0/24', _timeout=1)
+
+
+class TestLineMemo(unittest.TestCase):
+    """ Test reuse of objects parsed from unchanged lines. """
+    def setUp(self):
+        ipyroute.base.IPR = mock.Mock()
+        ipyroute.Route4.set_memo(maxsize=2)
+
+    def tearDown(self):
+        ipyroute.Route4.set_memo(0)
+        ipyroute.Route4.set_parallel(0)
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1\n10.0.1.0/24 dev p6p1\n10.0.2.0/24 dev p6p1")
+    def test_memo(self):
+        """ Unchanged lines reuse objects, vanished lines are evicted. """
+        first = ipyroute.Route4.get()
+        ipyroute.base.IPR.ipv4.route.show.return_value = \
+            ["10.0.1.0/24 dev p6p1", "10.0.0.0/24 dev p6p1", "10.0.3.0/24 dev p6p2"]
+        second = ipyroute.Route4.get()
+        assert second[0] is first[1] and second[1] is first[0]
+        assert second[2].dev == 'p6p2'
+        memo = ipyroute.Route4.memo
+        assert (memo.hits, memo.misses, len(memo)) == (2, 4, 2)
+        assert ipyroute.Route4.get('table', 'main')[0] is not second[0]
+        assert len(memo) == 4
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1\n10.0.1.0/24 dev p6p1\n10.0.2.0/24 dev p6p1")
+    def test_parallel(self):
+        """ Only changed lines are sent to worker processes. """
+        ipyroute.Route4.set_parallel(2, threshold=1)
+        first = ipyroute.Route4.get()
+        second = ipyroute.Route4.get()
+        assert second[0] is first[0] and second[1] is first[1]
+        assert second[2] == first[2]
+        assert ipyroute.Route4.memo.misses == 4
+
+    def test_shared(self):
+        """ A memo shared by all classes keeps their lines apart. """
+        ipyroute.base.Base.set_memo()
+        try:
+            ipyroute.base.IPR.configure_mock(**{
+                'ipv4.rule.show.return_value': ["0: from all lookup local"],
+                'ipv6.rule.show.return_value': ["0: from all lookup local"]})
+            rule4, = ipyroute.Rule4.get()
+            rule6, = ipyroute.Rule6.get()
+            assert type(rule4) is ipyroute.Rule4 and type(rule6) is ipyroute.Rule6
+        finally:
+            ipyroute.base.Base.set_memo(0)
+
+
+class TestShared(unittest.TestCase):
+    """ Test serving dumps from published snapshots. """
+    def setUp(self):
+        import tempfile
+        from ipyroute import shm
+        ipyroute.base.IPR = mock.Mock()
+        self.path = tempfile.mkdtemp()
+        self.publisher = shm.Publisher(self.path, [(ipyroute.Route4, ())])
+        ipyroute.Route4.set_shared(self.path)
+
+    def tearDown(self):
+        import shutil
+        ipyroute.Route4.set_shared(None)
+        shutil.rmtree(self.path)
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1")
+    def test_shared(self):
+        """ Readers see published generations without running ip. """
+        show = ipyroute.base.IPR.ipv4.route.show
+        assert ipyroute.Route4.get()[0].dev == 'p6p1'
+        assert show.call_count == 1
+        self.publisher.publish()
+        show.return_value = ["10.0.0.0/24 dev p6p2"]
+        first = ipyroute.Route4.view()
+        assert ipyroute.Route4.view() is first
+        assert first[0].dev == 'p6p1'
+        assert show.call_count == 2
+        self.publisher.publish()
+        assert ipyroute.Route4.get()[0].dev == 'p6p2'
+        assert show.call_count == 3
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1\n10.0.1.0/24 dev p6p2")
+    def test_rounds(self):
+        """ Each round is swapped in whole, and old rounds are removed. """
+        import os
+        from ipyroute import shm
+        for _ in range(4):
+            self.publisher.publish()
+        assert sorted(os.listdir(self.path)) == ['generation', 'round-2', 'round-3', 'round-4']
+        name = shm.snapshot_name(ipyroute.Route4, ())
+        snapshot = shm.Snapshot(os.path.join(shm.round_path(self.path, 4), name))
+        assert snapshot.generation == 4
+        assert list(snapshot.lines()) == ["10.0.0.0/24 dev p6p1", "10.0.1.0/24 dev p6p2"]
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1\n10.0.1.0/24 dev p6p2\n10.0.2.0/24 dev p6p1")
+    def test_lazy(self):
+        """ Shared objects are parsed on access, and only held by callers. """
+        self.publisher.publish()
+        view = ipyroute.Route4.view()
+        items = view._items
+        assert len(view) == 3 and not len(items._built)
+        last = view[-1]
+        assert str(last.network) == '10.0.2.0/24' and view[2] is last
+        assert len(items._built) == 1
+        del last
+        assert not len(items._built)
+        assert [i.dev for i in view.filter(lambda x: x.dev == 'p6p1')] == ['p6p1', 'p6p1']
+
+    @mocked("ipv4.route.show", "10.0.0.0/24 dev p6p1")
+    def test_local_write(self):
+        """ Snapshots older than a local change are not used. """
+        self.publisher.publish()
+        ipyroute.Route4.add('10.0.1.0/24', dev='p6p1')
+        show = ipyroute.base.IPR.ipv4.route.show
+        show.return_value = ["10.0.0.0/24 dev p6p1", "10.0.1.0/24 dev p6p1"]
+        assert len(ipyroute.Route4.get()) == 2
+        assert show.call_count == 2
+
+
+class TestImport(unittest.TestCase):
+    """ Test lazy package imports. """
+    def test_submodules(self):
+        """ Submodules are reachable as attributes after `import ipyroute`. """
+        import os
+        import subprocess
+        import sys
+        code = ("import sys, ipyroute\n"
+                "assert 'netaddr' not in sys.modules\n"
+                "assert ipyroute.route.Route4 is ipyroute.Route4\n"
+                "assert ipyroute.shm.Publisher and ipyroute.watch.Watcher\n")
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(ipyroute.__file__)))
+        subprocess.check_call([sys.executable, '-c', code], env=env)